@@ -1,55 +1,431 @@
+import time
+
+_STARTED = time.perf_counter()
+
 import json
 import os
+import sys
 import argparse
 
 from src.rag.config import RagConfig
+from src.rag.filters import validate_filters
+from src.rag.index_faiss import INDEX_TYPES, VECTOR_STORAGE, FaissIndex
 from src.rag.pipeline import RagPipeline
+from src.rag import snapshots
+
+# Heavy libraries (torch, transformers, faiss) are imported lazily, so this
+# only covers the CLI and pipeline modules themselves.
+IMPORT_SECONDS = time.perf_counter() - _STARTED
+
+
+def print_progress(stats):
+    print(
+        f"  batch {stats['batches']}: {stats['documents']} doc(s), {stats['chunks']} chunk(s) "
+        f"in {stats['elapsed_s']:.1f}s ({stats['chunks_per_s']:.1f} chunks/s, {stats['docs_per_s']:.2f} docs/s)"
+    )
+
+
+def print_dedup(stats):
+    share = stats["collapsed"] / stats["chunks"] if stats["chunks"] else 0.0
+    print(f"Dedup: collapsed {stats['collapsed']} of {stats['chunks']} chunk(s) ({share:.1%}) into existing vectors")
 
 
 def cmd_build(args):
-    cfg = RagConfig(index_dir=args.index_dir)
+    cfg = RagConfig(
+        index_dir=args.index_dir,
+        embed_cache_dir=args.embed_cache_dir,
+        embed_workers=args.embed_workers,
+        embed_threads_per_worker=args.embed_threads,
+        build_batch_size=args.batch_size,
+        ingest_workers=args.workers,
+        index_type=args.index_type,
+        index_nlist=args.nlist,
+        index_storage=args.storage,
+        lexical_index=not args.no_lexical,
+        dedup_chunks=args.dedup,
+        dedup_threshold=args.dedup_threshold,
+        offline=args.offline,
+    )
     pipe = RagPipeline(cfg)
-    pipe.build_index(args.docs_dir)
+    report = pipe.build_index(
+        args.docs_dir,
+        incremental=args.incremental,
+        streaming=args.streaming,
+        progress=print_progress if args.streaming else None,
+    )
     print(f"Index built and saved to: {args.index_dir}")
+    print(
+        f"Files: {len(report['added'])} added, {len(report['changed'])} changed, "
+        f"{len(report['deleted'])} deleted, {len(report['skipped'])} skipped (unchanged). "
+        f"Embedded {report['embedded_chunks']} chunk(s), index holds {report['total_chunks']}."
+    )
+    if report.get("reprocessed"):
+        print(f"Re-processed {len(report['reprocessed'])} unchanged file(s) that shared duplicate chunks with changed ones")
+    if "dedup" in report:
+        print_dedup(report["dedup"])
+    if "embed_cache" in report:
+        c = report["embed_cache"]
+        print(f"Embedding cache: {c['hits']} hit(s), {c['misses']} miss(es), hit rate {c['hit_rate']:.1%}, {c['entries']}/{c['capacity']} entries")
+    if "embedding" in report:
+        e = report["embedding"]
+        threads = f" x {e['threads_per_worker']} thread(s)" if e["threads_per_worker"] else ""
+        print(f"Embedding: {e['chunks']} chunk(s) in {e['seconds']:.1f}s ({e['chunks_per_s']:.1f} chunks/s, {e['workers']} worker(s){threads})")
+    return pipe
 
 
 def cmd_query(args):
-    cfg = RagConfig(index_dir=args.index_dir)
+    cfg = RagConfig(
+        index_dir=args.index_dir,
+        nprobe=args.nprobe,
+        ef_search=args.ef_search,
+        retrieval_mode=args.mode,
+        offline=args.offline,
+        profile=args.profile,
+    )
     pipe = RagPipeline(cfg)
     pipe.load_index()
-    out = pipe.answer(args.question, top_k=args.top_k)
+    if args.stream:
+        stream_answer(pipe, args.question, args.top_k, args.filters)
+        return pipe
+    out = pipe.answer(args.question, top_k=args.top_k, filters=args.filters)
     print(json.dumps({
         "question": out["question"],
         "answer": out["answer"],
-        "matches": [{
-            "doc_id": m["doc_id"],
-            "chunk_id": m["chunk_id"],
-            "score": round(m["score"], 3),
-            "source_path": m.get("source_path")
-        } for m in out["passages"]]
+        "matches": format_matches(out["passages"]),
+        "context": out["context"],
+        **({"timings": out["timings"]} if "timings" in out else {}),
     }, indent=2, ensure_ascii=False))
+    return pipe
+
+
+def stream_answer(pipe, question, top_k, filters=None):
+    # Matches go first (as JSON), then answer text as it is generated, then timings.
+    for event in pipe.answer_stream(question, top_k=top_k, filters=filters):
+        if event["type"] == "passages":
+            print(json.dumps({"question": question, "matches": format_matches(event["passages"])}, indent=2, ensure_ascii=False))
+            print("Answer: ", end="", flush=True)
+        elif event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        else:
+            ttft = f"{event['ttft_s']:.2f}s" if event["ttft_s"] is not None else "n/a"
+            ctx = event["context"]
+            print(
+                f"\n[time to first token: {ttft}, total: {event['total_s']:.2f}s, "
+                f"context: {ctx['tokens']} tokens from {ctx['used']}/{ctx['candidates']} passages]",
+                file=sys.stderr,
+            )
+            if "timings" in event:
+                print(json.dumps({"timings": event["timings"]}), file=sys.stderr)
+
+
+def format_matches(passages):
+    return [{
+        "doc_id": m["doc_id"],
+        "chunk_id": m["chunk_id"],
+        "score": round(m["score"], 3),
+        "source_path": m.get("source_path"),
+        **({"shard": m["shard"]} if "shard" in m else {}),
+    } for m in passages]
+
+
+def parse_filters(value):
+    filters = json.loads(value)
+    if not isinstance(filters, dict):
+        raise argparse.ArgumentTypeError("--filters must be a JSON object")
+    try:
+        return validate_filters(filters)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def iter_question_batches(path, batch_size):
+    # Lines are {"question": ..., ...} objects (extra keys such as "id" are
+    # echoed back) or bare JSON strings.
+    batch = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            batch.append(item if isinstance(item, dict) else {"question": item})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def cmd_batch(args):
+    cfg = RagConfig(
+        index_dir=args.index_dir,
+        query_batch_size=args.batch_size,
+        retrieval_only=args.retrieve_only,
+        retrieval_mode=args.mode,
+        offline=args.offline,
+        profile=args.profile,
+    )
+    pipe = RagPipeline(cfg)
+    pipe.load_index()
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for batch in iter_question_batches(args.input, args.batch_size):
+            questions = [item["question"] for item in batch]
+            if args.retrieve_only:
+                with pipe.profile("retrieve") as timings:
+                    passages = pipe.retrieve_many(questions, top_k=args.top_k, filters=args.filters)
+                extra = {"timings": timings.as_dict()} if timings is not None else {}
+                results = [{"question": q, "passages": p, **extra} for q, p in zip(questions, passages)]
+            else:
+                results = pipe.answer_many(questions, top_k=args.top_k, filters=args.filters)
+            for item, res in zip(batch, results):
+                row = {**item, "matches": format_matches(res["passages"])}
+                if "answer" in res:
+                    row["answer"] = res["answer"]
+                    row["context_tokens"] = res["context"]["tokens"]
+                if "timings" in res:
+                    row["timings"] = res["timings"]  # per batch of --batch_size questions
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return pipe
+
+
+def cmd_serve(args):
+    import uvicorn
+    from src.rag.server import ServerConfig, create_app
+
+    cfg = RagConfig(
+        index_dir=args.index_dir,
+        retrieval_only=args.retrieval_only,
+        retrieval_mode=args.mode,
+        offline=args.offline,
+    )
+    server_cfg = ServerConfig(
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+        request_timeout_s=args.timeout,
+        index_check_interval_s=args.index_check_interval,
+    )
+    app = create_app(lambda: RagPipeline(cfg), server_cfg)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+def cmd_shard(args):
+    root = RagPipeline(RagConfig(index_dir=args.index_dir, offline=args.offline)).sharded_index()
+    if args.action == "list":
+        for e in root.entries():
+            print(f"{e['name']}\t{e['chunks']} chunk(s)\t{root.shard_dir(e)}")
+        return None
+    if args.action == "remove":
+        entry = root.remove_shard(args.name, delete_files=args.delete)
+        print(f"Removed shard {entry['name']}" + (f" and deleted {root.shard_dir(entry)}" if args.delete else ""))
+        return None
+    # Each shard is an ordinary index directory under <index_dir>/shards/<name>.
+    shard_dir = os.path.join(args.index_dir, "shards", args.name)
+    args.index_dir = shard_dir
+    pipe = cmd_build(args)
+    entry = root.add_shard(args.name, shard_dir)
+    print(f"Registered shard {entry['name']} ({entry['chunks']} chunk(s)) in {root.manifest_path}")
+    return pipe
+
+
+def cmd_docs(args):
+    # In-place changes to a built index; only the named files are embedded.
+    pipe = RagPipeline(RagConfig(
+        index_dir=args.index_dir,
+        compact_threshold=args.compact_threshold,
+        dedup_chunks=getattr(args, "dedup", False),
+        dedup_threshold=getattr(args, "dedup_threshold", 0.9),
+        offline=args.offline,
+    ))
+    if args.action == "delete":
+        for doc_id in args.doc_ids:
+            print(f"Deleted {pipe.delete_document(doc_id)} chunk(s) of {doc_id}")
+    elif args.action == "compact":
+        remap = pipe.compact_index()
+        print(f"Compacted {args.index_dir}: {int((remap >= 0).sum())} chunk(s) kept" if remap is not None else "Nothing to compact")
+    else:
+        if args.action == "update":
+            reports = [pipe.update_document(p, args.docs_dir) for p in args.files]
+        else:
+            reports = [pipe.add_documents(args.files, args.docs_dir)]
+        for r in reports:
+            print(f"Added: {len(r['added'])}, changed: {len(r['changed'])}, embedded chunks: {r['embedded_chunks']}, total chunks: {r['total_chunks']}")
+            if r.get("reprocessed"):
+                print(f"Re-added {len(r['reprocessed'])} file(s) that shared duplicate chunks with them")
+            if "dedup" in r:
+                print_dedup(r["dedup"])
+    pipe.index.wait_for_compaction()
+    print(f"Deleted share awaiting compaction: {pipe.index.tombstone_ratio():.1%}")
+    return pipe
+
+
+def cmd_snapshots(args):
+    # Every build or in-place change publishes a new snapshot of the index directory.
+    if args.action == "list":
+        for s in snapshots.list_snapshots(args.index_dir):
+            state = "current" if s["current"] else ("" if s["finished"] else "unfinished")
+            print(f"{s['name']}\t{s['bytes'] / 2**20:.1f} MB\t{state}".rstrip())
+    elif args.action == "use":
+        snapshots.switch(args.index_dir, args.name)
+        print(f"Published {args.name}; running readers switch to it on their next check")
+    else:
+        deleted = snapshots.collect_garbage(args.index_dir, args.keep, unfinished=args.unfinished)
+        print(f"Deleted {len(deleted)} snapshot(s)" + (f": {', '.join(deleted)}" if deleted else ""))
+    return None
+
+
+def print_startup_report(args, pipe):
+    report = {"command": args.cmd, "imports_s": round(IMPORT_SECONDS, 4), **pipe.startup_report()}
+    report["total_s"] = round(time.perf_counter() - _STARTED, 4)
+    print(json.dumps({"startup": report}, indent=2), file=sys.stderr)
+
+
+def cmd_convert(args):
+    cfg = RagConfig(index_dir=args.index_dir)
+    index = FaissIndex(
+        index_dir=cfg.index_dir,
+        faiss_index_filename=cfg.faiss_index_filename,
+        metadata_filename=cfg.metadata_filename,
+        chunk_store_prefix=cfg.chunk_store_prefix,
+    )
+    count = index.convert_legacy_metadata()
+    print(f"Converted {count} chunk(s) in {args.index_dir} to the binary chunk store")
 
 
 def main():
     parser = argparse.ArgumentParser(description="RAG Pipeline CLI")
     sub = parser.add_subparsers(dest="cmd")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--offline", action="store_true", help="Skip network probes and load models from the local HF cache only")
+    common.add_argument("--startup_report", action="store_true", help="Print component load timings to stderr when done")
+    retrieval = argparse.ArgumentParser(add_help=False)
+    retrieval.add_argument("--mode", default="dense", choices=("dense", "lexical", "hybrid"), help="Retrieval mode (hybrid = BM25 + dense fused with RRF)")
+    profiling = argparse.ArgumentParser(add_help=False)
+    profiling.add_argument("--profile", action="store_true", help="Add per-stage timings (ms) and token/cache counts to the output")
+    dedup = argparse.ArgumentParser(add_help=False)
+    dedup.add_argument("--dedup", action="store_true", help="Collapse near-duplicate chunks (MinHash/LSH) into one vector before embedding")
+    dedup.add_argument("--dedup_threshold", type=float, default=0.9, help="Estimated Jaccard similarity at which chunks collapse")
+    # Per-request in the server (QueryRequest.filters), so only query/batch take it.
+    filtering = argparse.ArgumentParser(add_help=False)
+    filtering.add_argument(
+        "--filters",
+        type=parse_filters,
+        default=None,
+        help='JSON metadata filter, e.g. \'{"doc_id": ["a.txt"], "source_path_prefix": "docs/hr/"}\'',
+    )
 
-    p_build = sub.add_parser("build", help="Build FAISS index from documents")
+    p_build = sub.add_parser("build", help="Build FAISS index from documents", parents=[common, dedup])
     p_build.add_argument("--docs_dir", required=True, help="Directory with .txt/.pdf files")
     p_build.add_argument("--index_dir", default="indexes", help="Directory to store index files")
+    p_build.add_argument("--incremental", action="store_true", help="Only re-process new/changed files (uses manifest.json)")
+    p_build.add_argument("--streaming", action="store_true", help="Ingest, embed and index in bounded-memory batches")
+    p_build.add_argument("--batch_size", type=int, default=256, help="Chunks per embed/index batch when streaming")
+    p_build.add_argument("--workers", type=int, default=0, help="Parse files in a pool of N processes (0/1 = sequential)")
+    p_build.add_argument("--index_type", default="flat", choices=INDEX_TYPES, help="FAISS index type")
+    p_build.add_argument("--nlist", type=int, default=0, help="IVF inverted lists (0 = ~4*sqrt(#chunks))")
+    p_build.add_argument("--storage", default="float32", choices=VECTOR_STORAGE, help="Vector storage; float16/int8/binary re-score a shortlist with exact vectors")
+    p_build.add_argument("--embed_cache_dir", default=None, help="Directory for the persistent embedding cache (disabled if omitted)")
+    p_build.add_argument("--embed_workers", type=int, default=0, help="Embed in a pool of N processes, one model copy each (0/1 = in-process)")
+    p_build.add_argument("--embed_threads", type=int, default=1, help="Torch threads per embedding worker process")
+    p_build.add_argument("--no_lexical", action="store_true", help="Skip building the BM25 index used by lexical/hybrid retrieval")
     p_build.set_defaults(func=cmd_build)
 
-    p_query = sub.add_parser("query", help="Query the index to answer a question")
+    p_query = sub.add_parser("query", help="Query the index to answer a question", parents=[common, retrieval, filtering, profiling])
     p_query.add_argument("--index_dir", default="indexes", help="Directory with index files")
     p_query.add_argument("--question", required=True, help="User question")
     p_query.add_argument("--top_k", type=int, default=5, help="Number of passages to retrieve")
+    p_query.add_argument("--stream", action="store_true", help="Print answer tokens as they are generated")
+    p_query.add_argument("--nprobe", type=int, default=None, help="IVF lists to probe (default: value saved with the index)")
+    p_query.add_argument("--ef_search", type=int, default=None, help="HNSW search depth (default: value saved with the index)")
     p_query.set_defaults(func=cmd_query)
 
+    p_batch = sub.add_parser("batch", help="Answer questions from a JSONL file, streaming JSONL results", parents=[common, retrieval, filtering, profiling])
+    p_batch.add_argument("--index_dir", default="indexes", help="Directory with index files")
+    p_batch.add_argument("--input", required=True, help='JSONL file with {"question": ...} objects or JSON strings')
+    p_batch.add_argument("--output", default="-", help="Output JSONL file ('-' for stdout)")
+    p_batch.add_argument("--top_k", type=int, default=5, help="Number of passages to retrieve")
+    p_batch.add_argument("--batch_size", type=int, default=64, help="Questions embedded and searched per batch")
+    p_batch.add_argument("--retrieve_only", action="store_true", help="Skip generation and only write matches")
+    p_batch.set_defaults(func=cmd_batch)
+
+    p_serve = sub.add_parser("serve", help="Run the HTTP query server (/retrieve, /answer, /health)", parents=[common, retrieval])
+    p_serve.add_argument("--index_dir", default="indexes", help="Directory with index files")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8000)
+    p_serve.add_argument("--max_batch_size", type=int, default=32, help="Requests merged per embed/search or generate batch")
+    p_serve.add_argument("--max_wait_ms", type=float, default=5.0, help="Max time a batch waits for more requests")
+    p_serve.add_argument("--max_queue", type=int, default=256, help="Queued requests per stage before returning 503")
+    p_serve.add_argument("--retrieval_only", action="store_true", help="Never load a generator; /answer returns 400")
+    p_serve.add_argument("--timeout", type=float, default=30.0, help="Default per-request timeout in seconds")
+    p_serve.add_argument("--index_check_interval", type=float, default=2.0, help="Seconds between checks for a newly published index snapshot (0 = never reload)")
+    p_serve.set_defaults(func=cmd_serve)
+
+    p_shard = sub.add_parser("shard", help="Manage a sharded index (one independently built index per shard)")
+    shard_sub = p_shard.add_subparsers(dest="action", required=True)
+    p_shard_add = shard_sub.add_parser("add", help="Build (or rebuild) a shard from a docs directory and register it", parents=[common, dedup])
+    p_shard_add.add_argument("--index_dir", default="indexes", help="Sharded index root (holds shards.json)")
+    p_shard_add.add_argument("--name", required=True, help="Shard name, e.g. the source collection")
+    p_shard_add.add_argument("--docs_dir", required=True, help="Directory with .txt/.pdf files for this shard")
+    p_shard_add.add_argument("--incremental", action="store_true", help="Only re-process new/changed files of this shard")
+    p_shard_add.add_argument("--streaming", action="store_true", help="Ingest, embed and index in bounded-memory batches")
+    p_shard_add.add_argument("--batch_size", type=int, default=256, help="Chunks per embed/index batch when streaming")
+    p_shard_add.add_argument("--workers", type=int, default=0, help="Parse files in a pool of N processes (0/1 = sequential)")
+    p_shard_add.add_argument("--index_type", default="flat", choices=INDEX_TYPES, help="FAISS index type")
+    p_shard_add.add_argument("--nlist", type=int, default=0, help="IVF inverted lists (0 = ~4*sqrt(#chunks))")
+    p_shard_add.add_argument("--storage", default="float32", choices=VECTOR_STORAGE, help="Vector storage; float16/int8/binary re-score a shortlist with exact vectors")
+    p_shard_add.add_argument("--embed_cache_dir", default=None, help="Directory for the persistent embedding cache (disabled if omitted)")
+    p_shard_add.add_argument("--embed_workers", type=int, default=0, help="Embed in a pool of N processes, one model copy each (0/1 = in-process)")
+    p_shard_add.add_argument("--embed_threads", type=int, default=1, help="Torch threads per embedding worker process")
+    p_shard_add.add_argument("--no_lexical", action="store_true", help="Skip building the BM25 index used by lexical/hybrid retrieval")
+    p_shard_remove = shard_sub.add_parser("remove", help="Unregister a shard", parents=[common])
+    p_shard_remove.add_argument("--index_dir", default="indexes", help="Sharded index root (holds shards.json)")
+    p_shard_remove.add_argument("--name", required=True)
+    p_shard_remove.add_argument("--delete", action="store_true", help="Also delete the shard's index directory")
+    p_shard_list = shard_sub.add_parser("list", help="List registered shards", parents=[common])
+    p_shard_list.add_argument("--index_dir", default="indexes", help="Sharded index root (holds shards.json)")
+    p_shard.set_defaults(func=cmd_shard)
+
+    p_docs = sub.add_parser("docs", help="Add, update or delete documents in a built index without a rebuild")
+    docs_sub = p_docs.add_subparsers(dest="action", required=True)
+    for action, help_text in (("add", "Embed files and append them (already indexed files are replaced)"), ("update", "Re-embed files that are already indexed")):
+        p_docs_add = docs_sub.add_parser(action, help=help_text, parents=[common, dedup])
+        p_docs_add.add_argument("--docs_dir", required=True, help="Docs directory the index was built from (doc ids are relative to it)")
+        p_docs_add.add_argument("files", nargs="+", help="Files under --docs_dir")
+    p_docs_delete = docs_sub.add_parser("delete", help="Tombstone documents by doc id", parents=[common])
+    p_docs_delete.add_argument("doc_ids", nargs="+", help="Doc ids (paths relative to the docs directory)")
+    docs_sub.add_parser("compact", help="Drop deleted chunks from the index files now", parents=[common])
+    for p in docs_sub.choices.values():
+        p.add_argument("--index_dir", default="indexes", help="Directory with index files")
+        p.add_argument("--compact_threshold", type=float, default=0.2, help="Compact once this share of chunks is deleted (0 = never)")
+    p_docs.set_defaults(func=cmd_docs)
+
+    p_snap = sub.add_parser("snapshots", help="List, roll back or garbage-collect the versioned snapshots of an index")
+    snap_sub = p_snap.add_subparsers(dest="action", required=True)
+    snap_sub.add_parser("list", help="List snapshots, marking the published one")
+    p_snap_use = snap_sub.add_parser("use", help="Publish an older snapshot again (roll back)")
+    p_snap_use.add_argument("name", help="Snapshot name as shown by `snapshots list`, e.g. v000003")
+    p_snap_gc = snap_sub.add_parser("gc", help="Delete old snapshots now")
+    p_snap_gc.add_argument("--keep", type=int, default=3, help="Snapshots to keep, the published one included")
+    p_snap_gc.add_argument("--unfinished", action="store_true", help="Also delete unfinished snapshots left by failed writes (no build may be running)")
+    for p in snap_sub.choices.values():
+        p.add_argument("--index_dir", default="indexes", help="Directory with index files")
+    p_snap.set_defaults(func=cmd_snapshots)
+
+    p_convert = sub.add_parser("convert", help="Convert a legacy metadata.json index to the binary chunk store")
+    p_convert.add_argument("--index_dir", default="indexes", help="Directory with index files")
+    p_convert.set_defaults(func=cmd_convert)
+
     args = parser.parse_args()
     if not hasattr(args, "func"):
         parser.print_help()
         return
-    args.func(args)
+    pipe = args.func(args)
+    if getattr(args, "startup_report", False) and pipe is not None:
+        print_startup_report(args, pipe)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+"""Per-stage timings of RagPipeline on deterministic synthetic corpora.
+
+Generates .txt/.pdf corpora (benchmarks/synthetic.py) at one or more scales
+and times ingest, chunking, embedding, index build, index load, search
+latency (dense/lexical/hybrid) and generation separately. By default a
+hashing embedder and an echo generator stand in for the models, so the suite
+runs offline; pass --embed_model / --generator_model to time cached models.
+
+    python benchmarks/pipeline_stages.py --scales tiny small --output results.json
+    python benchmarks/pipeline_stages.py --baseline benchmarks/baseline.json
+    python benchmarks/pipeline_stages.py --save_baseline benchmarks/baseline.json
+
+With --baseline the exit status is 1 when any stage is slower than the
+baseline by more than --tolerance (a ratio, default 0.5 = 50%).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import SCALES, EchoGenerator, HashEmbedder, sample_queries, write_corpus  # noqa: E402
+from src.rag.chunk import chunk_documents  # noqa: E402
+from src.rag.config import RagConfig  # noqa: E402
+from src.rag.ingest import iter_document_paths, iter_loaded  # noqa: E402
+from src.rag.pipeline import RagPipeline  # noqa: E402
+
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+
+
+def best_of(repeat: int, fn: Callable):
+    # Fastest of `repeat` runs (least disturbed by the rest of the machine) and its result.
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def percentiles(latencies: List[float]) -> Dict:
+    ms = np.asarray(latencies) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(ms, p)), 3) for p in (50, 95, 99)}
+
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def make_pipeline(args, index_dir: str) -> RagPipeline:
+    cfg = RagConfig(index_dir=index_dir, offline=True, index_type=args.index_type)
+    if args.embed_model:
+        cfg.embed_model_name = args.embed_model
+    if args.generator_model:
+        cfg.generator_backend, cfg.generator_model = "local", args.generator_model
+    pipe = RagPipeline(cfg)
+    if not args.embed_model:
+        pipe.embedder = HashEmbedder()
+    if not args.generator_model:
+        pipe.generator = EchoGenerator()
+    return pipe
+
+
+def run_scale(args, name: str, docs_dir: str, index_dir: str) -> Dict:
+    scale = SCALES[name]
+    if not os.path.isdir(docs_dir):
+        write_corpus(docs_dir, scale["docs"], scale["words"], seed=args.seed)
+    paths = sorted(iter_document_paths(docs_dir))
+    corpus_mb = sum(os.path.getsize(p) for p in paths) / 2**20
+    pipe = make_pipeline(args, index_dir)
+    cfg = pipe.cfg
+    results: Dict[str, Dict] = {}
+
+    seconds, loaded = best_of(args.repeat, lambda: list(iter_loaded(paths, docs_dir, **pipe._ingest_options())))
+    docs = [doc for _, doc in loaded if doc is not None]
+    results["ingest"] = {"docs": len(docs), "mb": round(corpus_mb, 2), "seconds": round(seconds, 4),
+                         "docs_per_s": rate(len(docs), seconds), "mb_per_s": rate(corpus_mb, seconds)}
+
+    seconds, chunks = best_of(args.repeat, lambda: chunk_documents(docs, cfg.chunk_size_words, cfg.chunk_overlap_words))
+    results["chunk"] = {"chunks": len(chunks), "seconds": round(seconds, 4), "chunks_per_s": rate(len(chunks), seconds)}
+
+    texts = [c["text"] for c in chunks]
+    pipe.embedder.encode(texts[:8])  # model load and warm-up are not throughput
+    seconds, vectors = best_of(args.repeat, lambda: pipe.embedder.encode(texts))
+    results["embed"] = {"chunks": len(texts), "seconds": round(seconds, 4), "chunks_per_s": rate(len(texts), seconds)}
+
+    started = time.perf_counter()
+    pipe.index.build(vectors, chunks)
+    pipe.index.save()
+    seconds = time.perf_counter() - started
+    results["index_build"] = {"chunks": len(chunks), "seconds": round(seconds, 4), "chunks_per_s": rate(len(chunks), seconds)}
+
+    def load():
+        fresh = make_pipeline(args, index_dir)
+        fresh.load_index()
+        return fresh
+
+    seconds, pipe = best_of(args.repeat, load)
+    results["index_load"] = {"seconds": round(seconds, 4)}
+
+    queries = sample_queries([d["text"] for d in docs], args.queries, seed=args.seed)
+    for mode in SEARCH_MODES:
+        pipe.retrieve(queries[0], args.top_k, mode=mode)  # warm-up
+        latencies = []
+        for q in queries:
+            started = time.perf_counter()
+            pipe.retrieve(q, args.top_k, mode=mode)
+            latencies.append(time.perf_counter() - started)
+        results[f"search_{mode}"] = {"queries": len(queries), **percentiles(latencies)}
+
+    # Generation on pre-retrieved passages: prompt packing plus the generator call.
+    retrieved = [(q, pipe.retrieve(q, args.top_k)) for q in queries[:args.gen_queries]]
+    pipe.generator.generate(pipe.prepare_prompt(*retrieved[0])[0])  # warm-up
+    latencies = []
+    for q, passages in retrieved:
+        started = time.perf_counter()
+        prompt, _, _ = pipe.prepare_prompt(q, passages)
+        pipe.generator.generate(prompt)
+        latencies.append(time.perf_counter() - started)
+    results["generate"] = {"queries": len(retrieved), **percentiles(latencies)}
+    return results
+
+
+def median_results(runs: List[Dict]) -> Dict:
+    # Per-metric median over several runs of run_scale.
+    return {
+        stage: {metric: round(float(np.median([r[stage][metric] for r in runs])), 4) if len(runs) > 1 else value
+                for metric, value in metrics.items()}
+        for stage, metrics in runs[0].items()
+    }
+
+
+def slowdown(metric: str, current: float, base: float) -> float:
+    # current/base as a time ratio (>1 = slower); None for metrics that are not timings.
+    if metric.endswith("_per_s"):
+        return base / current if current else float("inf")
+    if metric == "seconds" or metric.endswith("_ms"):
+        return current / base
+    return None
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, min_seconds: float, floor_ms: float) -> List[Dict]:
+    # Regressions: stage metrics worse than baseline by more than `tolerance`.
+    # Stages that ran under min_seconds in the baseline, latency increases under
+    # floor_ms and p99 (a couple of samples at the default query count) are
+    # within timer and scheduler noise and not compared.
+    regressions = []
+    for scale, stages in baseline["results"].items():
+        for stage, metrics in stages.items():
+            current = results["results"].get(scale, {}).get(stage)
+            if current is None or metrics.get("seconds", min_seconds) < min_seconds:
+                continue
+            for metric, base in metrics.items():
+                cur = current.get(metric)
+                if cur is None or not base or metric == "p99_ms":
+                    continue
+                ratio = slowdown(metric, cur, base)
+                if ratio is None or ratio <= 1 + tolerance:
+                    continue
+                if metric.endswith("_ms") and cur - base < floor_ms:
+                    continue
+                regressions.append({"scale": scale, "stage": stage, "metric": metric,
+                                    "baseline": base, "current": cur, "slowdown": round(ratio, 3)})
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--scales", nargs="+", default=["tiny", "small"], choices=list(SCALES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per throughput stage; the fastest is reported")
+    ap.add_argument("--runs", type=int, default=3, help="Run each scale this many times and report per-metric medians")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--gen_queries", type=int, default=20)
+    ap.add_argument("--top_k", type=int, default=5)
+    ap.add_argument("--index_type", default="flat")
+    ap.add_argument("--embed_model", default=None, help="Cached sentence-transformers model instead of the hashing stub")
+    ap.add_argument("--generator_model", default=None, help="Cached local generator model instead of the echo stub")
+    ap.add_argument("--corpus_dir", default=None, help="Keep generated corpora here between runs (default: temporary)")
+    ap.add_argument("--output", default=None, help="Write all results as one JSON document")
+    ap.add_argument("--baseline", default=None, help="Compare against this results file; exit 1 on regression")
+    ap.add_argument("--save_baseline", default=None, help="Write the results to this path as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown (0.5 = 50%%); shared machines swing by tens of percent between runs")
+    ap.add_argument("--min_seconds", type=float, default=0.05, help="Skip stages faster than this in the baseline")
+    ap.add_argument("--floor_ms", type=float, default=1.0, help="Ignore latency increases smaller than this")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="pipeline-bench-")
+    corpus_root = args.corpus_dir or os.path.join(work, "corpora")
+    results = {
+        "meta": {
+            "embedder": args.embed_model or "hash-stub",
+            "generator": args.generator_model or "echo-stub",
+            "index_type": args.index_type,
+            "seed": args.seed,
+            "runs": args.runs,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": {},
+    }
+    try:
+        for name in args.scales:
+            docs_dir = os.path.join(corpus_root, f"{name}-seed{args.seed}")
+            stages = median_results([run_scale(args, name, docs_dir, os.path.join(work, "index", name)) for _ in range(args.runs)])
+            results["results"][name] = stages
+            for stage, metrics in stages.items():
+                print(json.dumps({"scale": name, "stage": stage, **metrics}))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("embedder", "generator", "index_type", "seed", "queries", "top_k"):
+            if baseline.get("meta", {}).get(key) != results["meta"][key]:
+                print(f"Warning: baseline was recorded with {key}={baseline.get('meta', {}).get(key)!r}, "
+                      f"this run used {results['meta'][key]!r}", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds, args.floor_ms)
+        for r in regressions:
+            print(json.dumps({"regression": True, **r}), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} stage metric(s) regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
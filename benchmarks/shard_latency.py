@@ -0,0 +1,93 @@
+"""Search latency of a ShardedIndex versus shard count at a fixed corpus size.
+
+Uses random unit vectors instead of an embedding model, so it runs offline:
+
+    python benchmarks/shard_latency.py --chunks 200000 --shards 1 2 4 8
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag.index_faiss import FaissIndex  # noqa: E402
+from src.rag.sharded import ShardedIndex  # noqa: E402
+
+
+def make_shard(index_dir, index_type="flat"):
+    return FaissIndex(index_dir, "faiss.index", "metadata.json", index_type=index_type, lexical=False)
+
+
+def unit_vectors(rng, n, dim):
+    v = rng.standard_normal((n, dim)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def build(root, vectors, n_shards, index_type):
+    sharded = ShardedIndex(root, lambda d: make_shard(d, index_type))
+    for i, part in enumerate(np.array_split(np.arange(len(vectors)), n_shards)):
+        shard_dir = os.path.join(root, "shards", f"s{i}")
+        shard = make_shard(shard_dir, index_type)
+        shard.build(vectors[part], [{"doc_id": f"d{j}", "chunk_id": 0, "text": "", "source_path": None} for j in part])
+        shard.save()
+        sharded.add_shard(f"s{i}", shard_dir)
+    sharded.load()
+    return sharded
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--chunks", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=1, help="Queries per search_many call")
+    ap.add_argument("--top_k", type=int, default=5)
+    ap.add_argument("--index_type", default="flat")
+    ap.add_argument("--omp_threads", type=int, default=1, help="FAISS OpenMP threads per search (0 = FAISS default)")
+    args = ap.parse_args()
+
+    import faiss
+
+    if args.omp_threads:
+        faiss.omp_set_num_threads(args.omp_threads)
+    rng = np.random.default_rng(0)
+    vectors = unit_vectors(rng, args.chunks, args.dim)
+    queries = unit_vectors(rng, args.queries, args.dim)
+    for n_shards in args.shards:
+        root = tempfile.mkdtemp(prefix="shard-bench-")
+        try:
+            sharded = build(root, vectors, n_shards, args.index_type)
+            sharded.search_many(queries[:args.batch], args.top_k)  # warm-up
+            latencies = []
+            for start in range(0, len(queries), args.batch):
+                t = time.perf_counter()
+                sharded.search_many(queries[start:start + args.batch], args.top_k)
+                latencies.append(time.perf_counter() - t)
+            sharded.close()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        print(json.dumps({
+            "shards": n_shards,
+            "chunks": args.chunks,
+            "batch": args.batch,
+            "index_type": args.index_type,
+            "qps": round(len(queries) / sum(latencies), 1),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Deterministic synthetic corpora and offline model stubs for the benchmarks.
+
+The same seed and scale always produce byte-identical .txt/.pdf files, so
+timings from different runs (and machines) are measured on the same input.
+"""
+import os
+import random
+import zlib
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+# Corpus sizes by name; every PDF_EVERY-th file is written as a PDF.
+SCALES: Dict[str, Dict] = {
+    "tiny": {"docs": 20, "words": 400},
+    "small": {"docs": 200, "words": 800},
+    "medium": {"docs": 1000, "words": 1500},
+    "large": {"docs": 5000, "words": 2000},
+}
+PDF_EVERY = 5
+WORDS_PER_PDF_LINE = 12
+LINES_PER_PDF_PAGE = 45
+
+_SYLLABLES = ["ka", "lo", "mi", "ter", "an", "vo", "rix", "su", "del", "pa", "nor", "ul", "ze", "ba", "qui", "est"]
+
+
+def vocabulary(size: int = 5000, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    # Shuffled so the Zipf ranks in document_text are not alphabetical.
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def _sentences(rng: random.Random, vocab: List[str], weights: List[float], n_words: int) -> Iterator[str]:
+    # Zipf-distributed words, with the odd identifier ("err-1234") as BM25 bait.
+    left = n_words
+    while left > 0:
+        n = min(left, rng.randint(8, 20))
+        words = rng.choices(vocab, weights=weights, k=n)
+        if rng.random() < 0.1:
+            words[rng.randrange(n)] = f"err-{rng.randint(1000, 9999)}"
+        left -= n
+        yield " ".join(words).capitalize() + "."
+
+
+def document_text(index: int, n_words: int, vocab: List[str], seed: int = 0) -> str:
+    rng = random.Random(seed * 1_000_003 + index)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    paragraphs, sentences = [], []
+    for sentence in _sentences(rng, vocab, weights, n_words):
+        sentences.append(sentence)
+        if len(sentences) == 6:
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+    if sentences:
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def _pdf_object(number: int, body: bytes) -> bytes:
+    return b"%d 0 obj\n" % number + body + b"\nendobj\n"
+
+
+def write_pdf(path: str, text: str):
+    # Minimal PDF writer (Helvetica, one text stream per page); enough for
+    # pypdf's text extraction without needing a PDF library.
+    words = text.split()
+    lines = [" ".join(words[i:i + WORDS_PER_PDF_LINE]) for i in range(0, len(words), WORDS_PER_PDF_LINE)]
+    pages = [lines[i:i + LINES_PER_PDF_PAGE] for i in range(0, len(lines), LINES_PER_PDF_PAGE)] or [[]]
+    font_obj, pages_obj = 3, 2
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", font_obj: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for n, page in enumerate(pages):
+        page_obj, content_obj = 4 + 2 * n, 5 + 2 * n
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for line in page:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        ops.append("ET")
+        stream = zlib.compress("\n".join(ops).encode("latin-1", errors="replace"))
+        objects[content_obj] = b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_obj] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_obj
+        )
+        kids.append(b"%d 0 R" % page_obj)
+    objects[pages_obj] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % len(pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += _pdf_object(number, objects[number])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for number in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[number]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def write_corpus(docs_dir: str, docs: int, words: int, seed: int = 0) -> List[str]:
+    # Writes docs files (every PDF_EVERY-th one a PDF) spread over a few
+    # subdirectories; returns their paths in creation order.
+    vocab = vocabulary(seed=seed)
+    paths = []
+    for i in range(docs):
+        subdir = os.path.join(docs_dir, f"section{i % 4}")
+        os.makedirs(subdir, exist_ok=True)
+        text = document_text(i, words, vocab, seed)
+        if i % PDF_EVERY == PDF_EVERY - 1:
+            path = os.path.join(subdir, f"doc{i:05d}.pdf")
+            write_pdf(path, text)
+        else:
+            path = os.path.join(subdir, f"doc{i:05d}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        paths.append(path)
+    return paths
+
+
+def sample_queries(texts: List[str], n: int, seed: int = 0, words: int = 8) -> List[str]:
+    # Short word windows lifted from the corpus, so every query has real matches.
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        tokens = rng.choice(texts).split()
+        start = rng.randrange(max(1, len(tokens) - words))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+class HashEmbedder:
+    """Stand-in for EmbeddingModel: feature-hashed bag of words, L2-normalised.
+
+    Needs no model download, so the suite runs offline; throughput numbers
+    then measure the pipeline around the model rather than the model itself.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.cache = None
+
+    def load(self):
+        pass
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                out[i, zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class EchoGenerator:
+    """Stand-in generator: answers with the first words of the prompt's context."""
+
+    prompt_token_limit = 2048
+
+    def __init__(self, answer_words: int = 40):
+        self.answer_words = answer_words
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def generate(self, prompt: str, max_new_tokens: int = 256) -> str:
+        return " ".join(prompt.split()[:min(self.answer_words, max_new_tokens)])
+
+    def generate_many(self, prompts: List[str], max_new_tokens: int = 256) -> List[str]:
+        return [self.generate(p, max_new_tokens) for p in prompts]
+
+    def stream(self, prompt: str, max_new_tokens: int = 256) -> Iterator[str]:
+        for word in self.generate(prompt, max_new_tokens).split():
+            yield word + " "
@@ -0,0 +1,109 @@
+"""Recall@k, memory and latency of the vector storage options.
+
+Ground truth is an exact float32 search. The corpus is synthetic clustered
+unit vectors by default; pass --docs_dir to embed real documents instead:
+
+    python benchmarks/vector_storage.py --chunks 100000 --dim 384
+    python benchmarks/vector_storage.py --docs_dir data
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rag.index_faiss import VECTOR_STORAGE, FaissIndex  # noqa: E402
+
+
+def clustered_vectors(rng, centers, n):
+    v = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.standard_normal((n, centers.shape[1])).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def embedded_corpus(docs_dir, n_queries, rng):
+    from src.rag.config import RagConfig
+    from src.rag.pipeline import RagPipeline
+    from src.rag.ingest import load_corpus
+    from src.rag.chunk import chunk_documents
+
+    cfg = RagConfig()
+    pipe = RagPipeline(cfg)
+    chunks = chunk_documents(load_corpus(docs_dir), cfg.chunk_size_words, cfg.chunk_overlap_words)
+    vectors = pipe.embedder.encode([c["text"] for c in chunks])
+    # Queries: held-out chunk embeddings with a little noise.
+    picks = vectors[rng.choice(len(vectors), n_queries)]
+    queries = picks + 0.05 * rng.standard_normal(picks.shape).astype("float32")
+    return vectors, queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run(vectors, queries, storage, rescore_factor, top_k, index_type):
+    root = tempfile.mkdtemp(prefix="storage-bench-")
+    try:
+        params = {"storage": storage, "rescore_factor": rescore_factor}
+        idx = FaissIndex(root, "faiss.index", "metadata.json", index_type=index_type, index_params=params, lexical=False)
+        idx.build(vectors, [{"doc_id": str(i), "chunk_id": 0, "text": "", "source_path": None} for i in range(len(vectors))])
+        idx.save()
+        idx = FaissIndex(root, "faiss.index", "metadata.json", lexical=False)
+        idx.load()
+        index_bytes = os.path.getsize(idx.faiss_index_path)
+        exact_bytes = os.path.getsize(idx.vectors_path) if os.path.exists(idx.vectors_path) else 0
+        idx.search_many(queries[:1], top_k)  # warm-up
+        latencies, found = [], []
+        for q in queries:
+            t = time.perf_counter()
+            hits = idx.search_many(q[None, :], top_k)[0]
+            latencies.append(time.perf_counter() - t)
+            found.append([int(h["doc_id"]) for h in hits])
+        return found, index_bytes, exact_bytes, latencies
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--chunks", type=int, default=50_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top_k", type=int, default=10)
+    ap.add_argument("--index_type", default="flat")
+    ap.add_argument("--storage", nargs="+", default=list(VECTOR_STORAGE), choices=VECTOR_STORAGE)
+    ap.add_argument("--rescore_factors", type=int, nargs="+", default=[0, 4, 16], help="0 = no float32 re-scoring")
+    ap.add_argument("--docs_dir", default=None, help="Embed this corpus instead of synthetic vectors (needs the embedding model)")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.docs_dir:
+        vectors, queries = embedded_corpus(args.docs_dir, args.queries, rng)
+    else:
+        centers = rng.standard_normal((256, args.dim)).astype("float32")
+        vectors = clustered_vectors(rng, centers, args.chunks)
+        queries = clustered_vectors(rng, centers, args.queries)
+    top_k = min(args.top_k, len(vectors))
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :top_k]
+
+    for storage in args.storage:
+        for factor in (args.rescore_factors if storage != "float32" else [0]):
+            found, index_bytes, exact_bytes, latencies = run(vectors, queries, storage, factor, top_k, args.index_type)
+            recall = np.mean([len(set(f) & set(t)) / top_k for f, t in zip(found, truth.tolist())])
+            print(json.dumps({
+                "storage": storage,
+                "rescore_factor": factor,
+                "index_type": args.index_type,
+                "chunks": len(vectors),
+                f"recall@{top_k}": round(float(recall), 4),
+                "index_mb": round(index_bytes / 2**20, 2),
+                "bytes_per_chunk": round(index_bytes / len(vectors), 1),
+                "exact_sidecar_mb": round(exact_bytes / 2**20, 2),
+                "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            }))
+
+
+if __name__ == "__main__":
+    main()
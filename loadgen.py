@@ -0,0 +1,91 @@
+"""Load generator for the query server (`python app.py serve`).
+
+Example:
+    python loadgen.py --url http://127.0.0.1:8000 --endpoint retrieve --concurrency 32 --requests 2000
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+DEFAULT_QUESTIONS = [
+    "What is retrieval-augmented generation?",
+    "How are documents chunked?",
+    "Which embedding model is used?",
+    "How is the FAISS index persisted?",
+]
+
+
+def load_questions(path):
+    if not path:
+        return DEFAULT_QUESTIONS
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                out.append(item["question"] if isinstance(item, dict) else item)
+    return out
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput/latency of the RAG query server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["retrieve", "answer"], default="retrieve")
+    parser.add_argument("--questions", default=None, help="JSONL file of questions (default: built-in set)")
+    parser.add_argument("--requests", type=int, default=500, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--top_k", type=int, default=5)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    url = f"{args.url.rstrip('/')}/{args.endpoint}"
+    session = requests.Session()
+
+    def one(i):
+        body = {"question": questions[i % len(questions)], "top_k": args.top_k}
+        t0 = time.perf_counter()
+        try:
+            status = session.post(url, json=body, timeout=120).status_code
+        except requests.RequestException:
+            status = -1
+        return status, time.perf_counter() - t0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    ok = [lat for status, lat in results if status == 200]
+    codes = {}
+    for status, _ in results:
+        codes[status] = codes.get(status, 0) + 1
+    print(json.dumps({
+        "endpoint": args.endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "status_codes": codes,
+        "latency_ms": {
+            "mean": round(statistics.mean(ok) * 1000, 2) if ok else None,
+            "p50": round(percentile(ok, 50) * 1000, 2),
+            "p95": round(percentile(ok, 95) * 1000, 2),
+            "p99": round(percentile(ok, 99) * 1000, 2),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+
+class MicroBatcher:
+    """Background worker that coalesces concurrent requests into batches.
+
+    ``submit`` returns a Future. The worker takes the first waiting item, then
+    keeps collecting until ``max_batch_size`` items are queued or ``max_wait_ms``
+    has passed, and hands the whole batch to ``run_batch`` (which must return one
+    result per item, in order).
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue: int = 0,
+        name: str = "micro-batcher",
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> Future:
+        # With a bounded queue, block=False raises queue.Full as backpressure.
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        fut: Future = Future()
+        self._queue.put((item, fut), block=block, timeout=timeout)
+        return fut
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> List:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                nxt = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                self._queue.put(None)
+                break
+            batch.append(nxt)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            # Requests cancelled while queued (e.g. timed out) are dropped.
+            batch = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
@@ -0,0 +1,165 @@
+import json
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+# Keeps identifiers such as "err-1234", "v2.3.1" or "part_no" as one token.
+TOKEN_RE = re.compile(r"\w+(?:[-.]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Builder:
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self._terms = array("i")
+        self._docs = array("i")
+        self._tfs = array("i")
+        self._doc_len = array("i")
+
+    def add(self, texts: Iterable[str]):
+        for text in texts:
+            doc = len(self._doc_len)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                self._terms.append(term_id)
+                self._docs.append(doc)
+                self._tfs.append(tf)
+            self._doc_len.append(sum(counts.values()))
+
+    def finish(self) -> "BM25Index":
+        terms = np.frombuffer(self._terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")  # keeps doc order inside each posting list
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=indptr[1:])
+        return BM25Index(
+            self.vocab,
+            indptr,
+            np.frombuffer(self._docs, dtype=np.int32)[order],
+            np.frombuffer(self._tfs, dtype=np.int32)[order].astype(np.float32),
+            np.frombuffer(self._doc_len, dtype=np.int32).astype(np.float32),
+        )
+
+
+class BM25Index:
+    """Okapi BM25 over chunk texts, stored as CSR postings (term -> doc ids, tfs)."""
+
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, docs: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        n = len(doc_len)
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n else 1.0
+        # Per-document length normalisation term, precomputed once.
+        self._norm = (k1 * (1.0 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        builder = BM25Builder()
+        builder.add(texts)
+        return builder.finish()
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def _posting_terms(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.indptr))
+
+    def _from_postings(self, vocab: Dict[str, int], terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray) -> "BM25Index":
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+        return BM25Index(vocab, indptr, docs[order], tfs[order], doc_len, k1=self.k1, b=self.b)
+
+    def extend(self, texts: Iterable[str]) -> "BM25Index":
+        # New index with texts appended as documents len(self), len(self)+1, ...
+        # Only the new texts are tokenized; existing postings are merged as arrays.
+        added = BM25Index.build(texts)
+        vocab = dict(self.vocab)
+        remap = np.array([vocab.setdefault(t, len(vocab)) for t in sorted(added.vocab, key=added.vocab.get)], dtype=np.int64)
+        return self._from_postings(
+            vocab,
+            np.concatenate([self._posting_terms(), remap[added._posting_terms()]]),
+            np.concatenate([self.docs, added.docs + len(self)]).astype(np.int32),
+            np.concatenate([self.tfs, added.tfs]),
+            np.concatenate([self.doc_len, added.doc_len]),
+        )
+
+    def select(self, keep: np.ndarray) -> "BM25Index":
+        # New index over the documents where keep is True, renumbered in order.
+        new_doc = np.cumsum(keep) - 1
+        hit = keep[self.docs]
+        return self._from_postings(
+            self.vocab,
+            self._posting_terms()[hit],
+            new_doc[self.docs[hit]].astype(np.int32),
+            self.tfs[hit],
+            self.doc_len[keep],
+        )
+
+    def search(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # mask: optional boolean array over documents; False rows never match.
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            docs, tfs = self.docs[lo:hi], self.tfs[lo:hi]
+            scores[docs] += self.idf[t] * tfs * (self.k1 + 1.0) / (tfs + self._norm[docs])
+        if mask is not None:
+            scores[~mask] = 0.0
+        hit = np.flatnonzero(scores)
+        if len(hit) > top_k:
+            hit = hit[np.argpartition(-scores[hit], top_k - 1)[:top_k]]
+        hit = hit[np.argsort(-scores[hit], kind="stable")]
+        return scores[hit], hit
+
+    def save(self, prefix: str):
+        # Both files are replaced rather than rewritten, so a copy hard-linked
+        # into another index snapshot is never changed.
+        with open(prefix + ".npz.tmp", "wb") as f:
+            np.savez(f, indptr=self.indptr, docs=self.docs, tfs=self.tfs, doc_len=self.doc_len,
+                     params=np.array([self.k1, self.b], dtype=np.float64))
+        terms = [""] * len(self.vocab)
+        for term, i in self.vocab.items():
+            terms[i] = term
+        with open(prefix + ".vocab.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        for ext in (".npz", ".vocab.json"):
+            os.replace(prefix + ext + ".tmp", prefix + ext)
+
+    @classmethod
+    def load(cls, prefix: str) -> "BM25Index":
+        with np.load(prefix + ".npz") as data:
+            arrays = {k: data[k] for k in data.files}
+        with open(prefix + ".vocab.json", "r", encoding="utf-8") as f:
+            vocab = {term: i for i, term in enumerate(json.load(f))}
+        k1, b = arrays["params"].tolist()
+        return cls(vocab, arrays["indptr"], arrays["docs"], arrays["tfs"], arrays["doc_len"], k1=k1, b=b)
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return os.path.exists(prefix + ".npz") and os.path.exists(prefix + ".vocab.json")
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda kv: -kv[1])
@@ -1,4 +1,10 @@
-from typing import Dict, List
+import re
+from collections import deque
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+_WORD_RE = re.compile(r"\S+")
 
 
 def chunk_text_words(text: str, chunk_size_words: int, overlap_words: int) -> List[str]:
@@ -17,18 +23,86 @@ def chunk_text_words(text: str, chunk_size_words: int, overlap_words: int) -> Li
     return chunks
 
 
-def chunk_documents(docs: List[Dict], chunk_size_words: int, overlap_words: int) -> List[Dict]:
-    out: List[Dict] = []
-    for d in docs:
-        chunks = chunk_text_words(d.get("text", ""), chunk_size_words, overlap_words)
-        for i, ch in enumerate(chunks):
-            out.append({
-                "doc_id": d["id"],
-                "chunk_id": i,
-                "text": ch,
-                "source_path": d.get("source_path"),
-            })
-    return out
+def normalize_space(text: str) -> str:
+    return " ".join(text.split())
+
+
+def iter_word_spans(text: str, chunk_size_words: int, overlap_words: int) -> Iterator[Tuple[int, int]]:
+    # Same word windows as chunk_text_words, as (start char, end char) offsets
+    # into text. Single pass; only the word offsets of the current window are kept.
+    step = max(1, chunk_size_words - overlap_words)
+    window: deque = deque()
+    fresh = 0  # words not yet covered by an emitted window
+    for m in _WORD_RE.finditer(text):
+        window.append((m.start(), m.end()))
+        fresh += 1
+        if len(window) == chunk_size_words:
+            yield window[0][0], window[-1][1]
+            for _ in range(min(step, len(window))):
+                window.popleft()
+            fresh = 0
+    if fresh:
+        yield window[0][0], window[-1][1]
+
+
+def chunk_spans(docs: List[Dict], chunk_size_words: int, overlap_words: int) -> List[Tuple[int, int, int]]:
+    return [
+        (i, start, end)
+        for i, d in enumerate(docs)
+        for start, end in iter_word_spans(d.get("text", ""), chunk_size_words, overlap_words)
+    ]
+
 
+class Chunk(Mapping):
+    """A chunk stored as a character span of its document's text.
 
+    Reads like the chunk dicts used everywhere else, but "text" is sliced from
+    the document on access, so overlapping windows share one copy of the text.
+    Like chunk_text_words, "text" joins the window's words with single spaces;
+    only the stored span keeps the document's original whitespace.
+    Further fields (e.g. "duplicates" from dedup) live in ``extra``.
+    """
 
+    __slots__ = ("doc", "chunk_id", "start", "end", "extra")
+    FIELDS = ("doc_id", "chunk_id", "text", "source_path")
+
+    def __init__(self, doc: Dict, chunk_id: int, start: int, end: int, extra: Optional[Dict] = None):
+        self.doc = doc
+        self.chunk_id = chunk_id
+        self.start = start
+        self.end = end
+        self.extra = extra
+
+    def __getitem__(self, key: str):
+        if key == "text":
+            return normalize_space(self.doc["text"][self.start:self.end])
+        if key == "chunk_id":
+            return self.chunk_id
+        if key == "doc_id":
+            return self.doc["id"]
+        if key == "source_path":
+            return self.doc.get("source_path")
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.extra:
+            return iter(self.FIELDS + tuple(self.extra))
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.doc['id']!r}#{self.chunk_id}, {self.start}:{self.end})"
+
+
+def chunk_documents(docs: List[Dict], chunk_size_words: int, overlap_words: int) -> List[Chunk]:
+    out: List[Chunk] = []
+    chunk_ids: Dict[int, int] = {}
+    for i, start, end in chunk_spans(docs, chunk_size_words, overlap_words):
+        chunk_id = chunk_ids.get(i, 0)
+        chunk_ids[i] = chunk_id + 1
+        out.append(Chunk(docs[i], chunk_id, start, end))
+    return out
@@ -0,0 +1,341 @@
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .chunk import Chunk, normalize_space
+
+
+# One fixed-size row per chunk. Text and any extra chunk fields (JSON) live in
+# the blob; doc_id/source_path pairs are interned into the docs table. For span
+# chunks (chunk.Chunk) the document text is written to the blob once and each
+# row's text offset/length points inside it, so window overlap is not repeated.
+# Such docs table entries carry the blob offset/length of the full text as well.
+ROW_DTYPE = np.dtype([
+    ("text_offset", "<u8"),
+    ("text_len", "<u4"),
+    ("doc", "<u4"),
+    ("chunk_id", "<u4"),
+    ("extra_offset", "<u8"),
+    ("extra_len", "<u4"),
+])
+CORE_FIELDS = ("doc_id", "chunk_id", "text", "source_path")
+
+
+def store_paths(prefix: str) -> Tuple[str, str, str]:
+    return prefix + ".rows", prefix + ".blob", prefix + ".docs.json"
+
+
+def fields_path(prefix: str) -> str:
+    # Postings of the scalar extra fields (value -> rows), for metadata filters.
+    # Optional: stores written before it existed are filtered by decoding rows.
+    return prefix + ".fields.npz"
+
+
+def _is_scalar(value) -> bool:
+    return value is not None and not isinstance(value, (list, dict))
+
+
+def _write_fields(path: str, fields: Dict[str, Dict[object, List[int]]]):
+    values, arrays = {}, {}
+    for i, (name, postings) in enumerate(sorted(fields.items())):
+        values[name] = list(postings)
+        lists = [np.sort(np.asarray(p, dtype=np.int64)) for p in postings.values()]
+        arrays[f"indptr{i}"] = np.cumsum([0] + [len(p) for p in lists], dtype=np.int64)
+        arrays[f"rows{i}"] = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+    header = np.frombuffer(json.dumps(values, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+    with open(path, "wb") as f:
+        np.savez(f, header=header, **arrays)
+
+
+def read_fields(prefix: str) -> Optional[Dict[str, Dict[object, np.ndarray]]]:
+    path = fields_path(prefix)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        values = json.loads(data["header"].tobytes().decode("utf-8"))
+        fields = {}
+        for i, (name, keys) in enumerate(values.items()):
+            indptr, rows = data[f"indptr{i}"], data[f"rows{i}"]
+            fields[name] = {v: rows[indptr[j]:indptr[j + 1]] for j, v in enumerate(keys)}
+    return fields
+
+
+def store_exists(prefix: str) -> bool:
+    return all(os.path.exists(p) for p in store_paths(prefix))
+
+
+class ChunkStoreWriter:
+    def __init__(self, prefix: str, append: bool = False):
+        # append=True adds rows to an existing store in place (in-place document
+        # updates); new chunks always get new docs table entries, so a re-added
+        # document never shares an entry with its deleted rows.
+        self.prefix = prefix
+        self.append_mode = append
+        self._paths = store_paths(prefix)
+        self._docs: List[List] = []
+        self._start = (0, 0)
+        self._fields: Optional[Dict[str, Dict[object, List[int]]]] = {}
+        if append:
+            with open(self._paths[2], "r", encoding="utf-8") as f:
+                self._docs = json.load(f)
+            self._start = (os.path.getsize(self._paths[0]), os.path.getsize(self._paths[1]))
+            # Postings can only be extended if the store already has them.
+            stored = read_fields(prefix)
+            self._fields = None if stored is None else {
+                name: {v: rows.tolist() for v, rows in postings.items()} for name, postings in stored.items()
+            }
+            self._rows = open(self._paths[0], "ab")
+            self._blob = open(self._paths[1], "ab")
+        else:
+            self._rows = open(self._paths[0] + ".tmp", "wb")
+            self._blob = open(self._paths[1] + ".tmp", "wb")
+        self._offset = self._start[1]
+        self._doc_ids: Dict[Tuple, int] = {}
+        # doc number -> [char cursor, byte offset of that char in the blob]
+        self._cursors: Dict[int, List[int]] = {}
+        self._late_extras: Dict[int, Dict] = {}
+        self._first_row = self._start[0] // ROW_DTYPE.itemsize
+        self.count = 0
+
+    def _put(self, data: bytes) -> int:
+        offset = self._offset
+        self._blob.write(data)
+        self._offset += len(data)
+        return offset
+
+    def _put_extra(self, extra: Dict) -> Tuple[int, int]:
+        data = json.dumps(extra, ensure_ascii=False).encode("utf-8")
+        return self._put(data), len(data)
+
+    def _index_extra(self, row: int, extra: Dict, remove: bool = False):
+        if self._fields is None:
+            return
+        for name, value in extra.items():
+            if not _is_scalar(value):
+                continue
+            postings = self._fields.setdefault(name, {})
+            if remove:
+                postings[value].remove(row)
+                if not postings[value]:
+                    del postings[value]
+            else:
+                postings.setdefault(value, []).append(row)
+
+    def set_extra(self, row: int, extra: Dict):
+        # Replaces the extra fields of a row this writer already appended
+        # (numbered from 0); applied on close(). Used for duplicate references
+        # found after their chunk was flushed in a streaming build.
+        self._late_extras[row] = extra
+
+    def append(self, chunks: Iterable[Dict]):
+        rows = []
+        for c in chunks:
+            key = (c["doc_id"], c.get("source_path"))
+            doc = self._doc_ids.get(key)
+            if doc is None:
+                doc = self._doc_ids[key] = len(self._docs)
+                self._docs.append(list(key))
+            extra_offset, extra_len = 0, 0
+            if isinstance(c, Chunk):
+                text_offset, text_len = self._span(doc, c)
+                extra = c.extra
+            else:
+                text = c.get("text", "").encode("utf-8")
+                text_offset, text_len = self._put(text), len(text)
+                extra = {k: v for k, v in c.items() if k not in CORE_FIELDS}
+            if extra:
+                extra_offset, extra_len = self._put_extra(extra)
+                self._index_extra(self._first_row + self.count + len(rows), extra)
+            rows.append((text_offset, text_len, doc, c["chunk_id"], extra_offset, extra_len))
+        if rows:
+            np.array(rows, dtype=ROW_DTYPE).tofile(self._rows)
+            self.count += len(rows)
+
+    def _span(self, doc: int, c: Chunk) -> Tuple[int, int]:
+        text = c.doc["text"]
+        cursor = self._cursors.get(doc)
+        if cursor is None:
+            data = text.encode("utf-8")
+            cursor = self._cursors[doc] = [0, self._put(data)]
+            self._docs[doc] += [cursor[1], len(data)]
+        if c.start < cursor[0]:
+            cursor[0], cursor[1] = 0, self._docs[doc][2]
+        # Chunks arrive in document order, so char->byte offsets advance incrementally.
+        cursor[1] += len(text[cursor[0]:c.start].encode("utf-8"))
+        cursor[0] = c.start
+        return cursor[1], len(text[c.start:c.end].encode("utf-8"))
+
+    def _apply_late_extras(self):
+        self._rows.flush()
+        self._blob.flush()
+        suffix = "" if self.append_mode else ".tmp"
+        rows = np.memmap(self._paths[0] + suffix, dtype=ROW_DTYPE, mode="r+")
+        with open(self._paths[1] + suffix, "rb") as blob:
+            for row, extra in sorted(self._late_extras.items()):
+                row += self._first_row
+                if rows["extra_len"][row]:
+                    # The replaced fields leave the postings again.
+                    blob.seek(int(rows["extra_offset"][row]))
+                    self._index_extra(row, json.loads(blob.read(int(rows["extra_len"][row])).decode("utf-8")), remove=True)
+                offset, length = self._put_extra(extra)
+                self._index_extra(row, extra)
+                rows["extra_offset"][row] = offset
+                rows["extra_len"][row] = length
+        rows.flush()
+        del rows
+
+    def close(self):
+        if self._late_extras:
+            self._apply_late_extras()
+        self._rows.close()
+        self._blob.close()
+        with open(self._paths[2] + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._docs, f, ensure_ascii=False)
+        replaced = list(self._paths if not self.append_mode else self._paths[2:])
+        if self._fields is not None:
+            _write_fields(fields_path(self.prefix) + ".tmp", self._fields)
+            replaced.append(fields_path(self.prefix))
+        for path in replaced:
+            os.replace(path + ".tmp", path)
+
+    def abort(self):
+        self._rows.close()
+        self._blob.close()
+        if self.append_mode:
+            # Cut the appended bytes off again; the docs table was not rewritten.
+            for path, size in zip(self._paths[:2], self._start):
+                os.truncate(path, size)
+            return
+        for path in self._paths[:2]:
+            os.remove(path + ".tmp")
+
+
+def write_store(prefix: str, chunks: Iterable[Dict]) -> int:
+    writer = ChunkStoreWriter(prefix)
+    try:
+        writer.append(chunks)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.count
+
+
+def _memmap(path: str, dtype) -> np.ndarray:
+    # np.memmap refuses zero-length files.
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view of the chunks written by ChunkStoreWriter.
+
+    Behaves like a list of chunk dicts, but a row is only decoded when it is
+    indexed, so opening the store costs the same for 1k or 10M chunks.
+    ``length`` limits the view to the first rows (e.g. the rows a FAISS
+    index holds).
+    """
+
+    def __init__(self, prefix: str, length: Optional[int] = None):
+        rows_path, blob_path, docs_path = store_paths(prefix)
+        self.prefix = prefix
+        self.rows = _memmap(rows_path, ROW_DTYPE)[:length]
+        self.blob = _memmap(blob_path, np.uint8)
+        with open(docs_path, "r", encoding="utf-8") as f:
+            self.docs: List[List] = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _decode(self, i: int) -> Dict:
+        r = self.rows[i]
+        off, n = int(r["text_offset"]), int(r["text_len"])
+        entry = self.docs[int(r["doc"])]
+        text = self.blob[off:off + n].tobytes().decode("utf-8")
+        chunk = {
+            "doc_id": entry[0],
+            "chunk_id": int(r["chunk_id"]),
+            # Span rows point into the document text: served like Chunk["text"].
+            "text": normalize_space(text) if len(entry) >= 4 else text,
+            "source_path": entry[1],
+        }
+        if r["extra_len"]:
+            off, n = int(r["extra_offset"]), int(r["extra_len"])
+            chunk.update(json.loads(self.blob[off:off + n].tobytes().decode("utf-8")))
+        return chunk
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Dict, List[Dict]]:
+        if isinstance(i, slice):
+            return [self._decode(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return self._decode(i)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self._decode(i)
+
+    def span_chunks(self, start: int, end: int) -> List[Dict]:
+        # Rows [start, end) as span Chunks sharing one decoded text per document
+        # (for re-saving without duplicating overlap); rows written from plain
+        # chunk dicts are returned decoded.
+        out: List[Dict] = []
+        doc, cur = -1, None
+        for i in range(start, end):
+            r = self.rows[i]
+            n = int(r["doc"])
+            entry = self.docs[n]
+            if len(entry) < 4:
+                out.append(self._decode(i))
+                continue
+            if n != doc:
+                base, size = entry[2], entry[3]
+                data = self.blob[base:base + size].tobytes()
+                cur = {"doc": {"id": entry[0], "source_path": entry[1], "text": data.decode("utf-8")}, "byte": 0, "char": 0}
+                doc = n
+            off = int(r["text_offset"]) - entry[2]
+            if off < cur["byte"]:
+                cur["byte"], cur["char"] = 0, 0
+            cur["char"] += len(data[cur["byte"]:off].decode("utf-8"))
+            cur["byte"] = off
+            length = len(data[off:off + int(r["text_len"])].decode("utf-8"))
+            extra = None
+            if r["extra_len"]:
+                e_off, e_len = int(r["extra_offset"]), int(r["extra_len"])
+                extra = json.loads(self.blob[e_off:e_off + e_len].tobytes().decode("utf-8"))
+            out.append(Chunk(cur["doc"], int(r["chunk_id"]), cur["char"], cur["char"] + length, extra))
+        return out
+
+    def doc_ids(self) -> List[str]:
+        return sorted({d[0] for d in self.docs})
+
+    def field_postings(self) -> Optional[Dict[str, Dict[object, np.ndarray]]]:
+        """Scalar extra field -> value -> sorted rows, as recorded by the writer.
+
+        None if the store was written without postings (see ``fields_path``).
+        """
+        fields = read_fields(self.prefix)
+        if fields is None:
+            return None
+        # Rows past a view limited by ``length`` are cut off.
+        n = len(self)
+        return {name: {v: r[:np.searchsorted(r, n)] for v, r in p.items()} for name, p in fields.items()}
+
+    def close(self):
+        # Drop the mappings so the files can be replaced (required on Windows).
+        self.rows = np.zeros(0, dtype=ROW_DTYPE)
+        self.blob = np.zeros(0, dtype=np.uint8)
+
+
+def convert_metadata_json(metadata_path: str, prefix: str, remove_json: bool = True) -> int:
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    count = write_store(prefix, chunks)
+    if remove_json:
+        os.remove(metadata_path)
+    return count
@@ -4,14 +4,54 @@ from dataclasses import dataclass
 @dataclass
 class RagConfig:
     embed_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embed_cache_dir: str = None  # e.g. ".cache/embeddings"; None disables the cache
+    embed_cache_max_entries: int = 200_000
+    embed_batch_size: int = 64  # texts per model forward pass
+    embed_workers: int = 0  # >1 encodes large batches in a pool of processes, one model copy each
+    embed_threads_per_worker: int = 1  # torch/OpenMP threads pinned in each embedding worker
     chunk_size_words: int = 300
     chunk_overlap_words: int = 60
+    dedup_chunks: bool = False  # collapse near-duplicate chunks (MinHash/LSH) into one vector before embedding
+    dedup_threshold: float = 0.9  # estimated Jaccard similarity of word 3-gram shingles at which chunks collapse
     top_k: int = 5
+    retrieval_mode: str = "dense"  # dense | lexical | hybrid (BM25 + dense, fused with RRF)
+    hybrid_candidates: int = 50  # candidates taken from each retriever before fusion
+    rrf_k: int = 60  # reciprocal rank fusion constant
+    context_token_budget: int = None  # prompt context tokens; None = fill the generator's window, 0 = no packing
+    context_dedup_threshold: float = 0.8  # drop a passage if this share of its words is already packed from its doc
+    context_min_passage_tokens: int = 32  # trim a passage to fit only if at least this many tokens remain
+    query_batch_size: int = 64  # questions embedded/searched per call in retrieve_many/answer_many
+    build_batch_size: int = 256  # chunks per embed/index batch in streaming builds
+    ingest_workers: int = 0  # >1 parses files in a process pool
+    ingest_max_in_flight: int = 0  # files submitted ahead of the consumer; 0 = 2 * workers
+    pdf_pages_per_task: int = 64  # page-range size when splitting large PDFs across workers
     index_dir: str = "indexes"
-    metadata_filename: str = "metadata.json"
+    index_type: str = "flat"  # flat | ivf_flat | ivf_pq | hnsw | opq_ivf_pq
+    index_nlist: int = 0  # IVF lists; 0 = ~4*sqrt(n)
+    index_pq_m: int = 16  # PQ sub-quantizers (must divide the embedding dim)
+    index_pq_nbits: int = 8
+    index_hnsw_m: int = 32
+    index_train_sample_size: int = 100_000
+    index_storage: str = "float32"  # float32 | float16 | int8 | binary (quantized kinds keep exact vectors on disk for re-scoring)
+    index_rescore_factor: int = 4  # quantized storage and PQ types re-score top_k * factor candidates with float32; 0 = off
+    lexical_index: bool = True  # build the BM25 index (bm25.npz) alongside FAISS
+    compact_threshold: float = 0.2  # share of deleted chunks that triggers a background compaction; 0 = never
+    snapshot_keep: int = 3  # index snapshots kept on disk after each publish, the live one included; 0 = keep all
+    nprobe: int = None  # IVF lists probed per query; None = value saved with the index
+    ef_search: int = None  # HNSW search depth; None = value saved with the index
+    metadata_filename: str = "metadata.json"  # legacy JSON metadata, read if no chunk store exists
+    chunk_store_prefix: str = "chunks"  # chunks.rows / chunks.blob / chunks.docs.json / chunks.fields.npz
     faiss_index_filename: str = "faiss.index"
+    manifest_filename: str = "manifest.json"
+    shards_filename: str = "shards.json"  # present in index_dir => sharded index (one FaissIndex dir per shard)
+    shard_search_workers: int = 0  # threads for parallel shard search; 0 = one per shard
+    retrieval_only: bool = False  # never load a generator; answer() raises
+    offline: bool = False  # no network probes, models from the local HF cache only (also via HF_HUB_OFFLINE=1)
     generator_backend: str = "auto"  # auto | local | openai
     generator_model: str = "google/flan-t5-small"  # default local model
+    generator_batch_size: int = 8  # prompts per padded local generation batch
+    generator_max_wait_ms: float = 10.0  # how long the local engine waits to fill a batch
+    profile: bool = False  # attach per-stage "timings" (ms) and token/cache counts to answers
 
 
 
@@ -0,0 +1,151 @@
+"""Near-duplicate chunk detection between chunking and embedding.
+
+Chunks are compared by MinHash signatures of their word shingles; LSH bands
+bucket the signatures so each chunk is only checked against likely matches.
+The first chunk of a group is kept and embedded, the others are dropped and
+recorded on it as source references under "duplicates".
+"""
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .chunk import Chunk
+
+DUPLICATES_KEY = "duplicates"
+_SHINGLE_PRIME = np.uint64(0x100000001B3)
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over chunk texts.
+
+    Two texts count as near-duplicates when their estimated Jaccard
+    similarity (share of equal signature values) over lowercased
+    ``shingle_words``-word shingles is at least ``threshold``.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16, shingle_words: int = 3, seed: int = 0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_words = shingle_words
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash family: h(x) = (a*x + b) mod 2^64 >> 32, a odd.
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self._word_hashes: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, List[Any]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Any, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        cache = self._word_hashes
+        words = text.lower().split()
+        hashes = np.empty(len(words), dtype=np.uint64)
+        for i, w in enumerate(words):
+            h = cache.get(w)
+            if h is None:
+                h = cache[w] = zlib.crc32(w.encode("utf-8"))
+            hashes[i] = h
+        k = min(self.shingle_words, len(words))
+        if k == 0:
+            return np.zeros(1, dtype=np.uint64)
+        n = len(words) - k + 1
+        shingles = hashes[:n].copy()
+        for j in range(1, k):
+            shingles = shingles * _SHINGLE_PRIME + hashes[j:j + n]
+        return np.unique(shingles)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self._shingles(text)
+        values = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in np.split(sig, self.bands)]
+
+    def query(self, sig: np.ndarray) -> Optional[Any]:
+        # Key of the first registered text similar enough to sig, or None.
+        seen = set()
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            for candidate in bucket.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self._signatures[candidate] == sig) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, key: Any, sig: np.ndarray):
+        self._signatures[key] = sig
+        for bucket, band in zip(self._buckets, self._band_keys(sig)):
+            bucket.setdefault(band, []).append(key)
+
+    def find(self, key: Any, text: str) -> Optional[Any]:
+        # Key of the registered near-duplicate of text; if there is none, text
+        # is registered under key and None is returned.
+        sig = self.signature(text)
+        match = self.query(sig)
+        if match is None:
+            self.add(key, sig)
+        return match
+
+
+def find_duplicates(texts: Sequence[str], near: NearDuplicateIndex, order: Optional[Iterable[int]] = None) -> np.ndarray:
+    """reps[i] == i for texts that are kept, else the position of the kept
+    text they duplicate. Texts are registered in ``order`` (default: as
+    given), so earlier ones win."""
+    reps = np.arange(len(texts))
+    for i in (range(len(texts)) if order is None else order):
+        match = near.find(i, texts[i])
+        if match is not None:
+            reps[i] = match
+    return reps
+
+
+def source_ref(chunk: Dict) -> Dict:
+    return {"doc_id": chunk["doc_id"], "chunk_id": chunk["chunk_id"], "source_path": chunk.get("source_path")}
+
+
+def with_duplicates(chunk: Dict, refs: List[Dict]) -> Dict:
+    # Copy of chunk whose "duplicates" field is refs (dropped when empty).
+    if isinstance(chunk, Chunk):
+        extra = {k: v for k, v in (chunk.extra or {}).items() if k != DUPLICATES_KEY}
+        if refs:
+            extra[DUPLICATES_KEY] = refs
+        return Chunk(chunk.doc, chunk.chunk_id, chunk.start, chunk.end, extra or None)
+    out = {k: v for k, v in chunk.items() if k != DUPLICATES_KEY}
+    if refs:
+        out[DUPLICATES_KEY] = refs
+    return out
+
+
+def drop_references(chunk: Dict, doc_ids: set) -> Dict:
+    # Removes references to doc_ids (documents being re-chunked or deleted).
+    refs = chunk.get(DUPLICATES_KEY)
+    if not refs or not any(r["doc_id"] in doc_ids for r in refs):
+        return chunk
+    return with_duplicates(chunk, [r for r in refs if r["doc_id"] not in doc_ids])
+
+
+def collapse(chunks: Sequence[Dict], reps: np.ndarray) -> List[Optional[Dict]]:
+    """Aligned with chunks: None for a collapsed chunk, the chunk for a kept
+    one, carrying the references of everything collapsed into it (including
+    the references those chunks carried themselves)."""
+    refs: Dict[int, List[Dict]] = {}
+    for i, rep in enumerate(reps.tolist()):
+        if rep != i:
+            refs.setdefault(rep, []).extend([source_ref(chunks[i])] + list(chunks[i].get(DUPLICATES_KEY) or []))
+    out: List[Optional[Dict]] = []
+    for i, (c, rep) in enumerate(zip(chunks, reps.tolist())):
+        if rep != i:
+            out.append(None)
+        elif i in refs:
+            out.append(with_duplicates(c, list(c.get(DUPLICATES_KEY) or []) + refs[i]))
+        else:
+            out.append(c)
+    return out
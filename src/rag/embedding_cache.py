@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no writer lock
+    fcntl = None
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def text_key(model_name: str, text: str) -> int:
+    digest = hashlib.blake2b(f"{model_name}\0{normalize_text(text)}".encode("utf-8"), digest_size=8).digest()
+    # 0 marks an empty slot in the key table.
+    return int.from_bytes(digest, "little") or 1
+
+
+def cache_path(cache_dir: str, model_name: str) -> str:
+    slug = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, slug)
+
+
+class EmbeddingCache:
+    """Content-addressed store of embeddings for one model.
+
+    Layout under ``<cache_dir>/<model slug>/``: ``vectors.f32`` (capacity x dim
+    float32), ``keys.u64`` (text hash per slot, 0 = free) and ``access.u64``
+    (last-use tick per slot, used for LRU eviction), all memory-mapped, plus a
+    small ``meta.json``. One process at a time writes a cache, holding an
+    exclusive lock on ``<model slug>.lock``; others open it read-only and
+    neither add entries nor update access ticks.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_entries: int = 200_000):
+        self.model_name = model_name
+        self.dim = dim
+        self.capacity = max_entries
+        self.path = cache_path(cache_dir, model_name)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = self._acquire_lock()
+        self.read_only = self._lock is None
+        self._open()
+
+    def _acquire_lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock = open(self.path + ".lock", "a+b")
+        if fcntl is None:
+            return lock
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            print(f"Note: embedding cache {self.path} is in use by another process; opening it read-only")
+            return None
+        return lock
+
+    def close(self):
+        for name in ("keys", "access", "vectors"):
+            setattr(self, name, np.zeros((0,) + getattr(self, name).shape[1:], dtype=getattr(self, name).dtype))
+        if self._lock is not None:
+            self._lock.close()  # releases the flock
+            self._lock = None
+
+    @staticmethod
+    def stored_dim(cache_dir: str, model_name: str) -> Optional[int]:
+        """Embedding dimension recorded by an existing cache, if any."""
+        try:
+            with open(os.path.join(cache_path(cache_dir, model_name), "meta.json"), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return stored.get("dim") if stored.get("model_name") == model_name else None
+
+    def _open(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        meta = {"model_name": self.model_name, "dim": self.dim, "capacity": self.capacity, "tick": 0}
+        mode = "w+"
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if all(stored.get(k) == meta[k] for k in ("model_name", "dim", "capacity")):
+                meta, mode = stored, "r+"
+            elif not self.read_only:
+                # Layout changed (new cap or model dim): start over.
+                shutil.rmtree(self.path)
+        self._meta_path = meta_path
+        self._tick = meta["tick"]
+        if self.read_only and mode == "w+":
+            # Nothing usable to read: behave as an empty cache.
+            self.keys = np.zeros(0, dtype="uint64")
+            self.access = np.zeros(0, dtype="uint64")
+            self.vectors = np.zeros((0, self.dim), dtype="float32")
+        else:
+            if self.read_only:
+                mode = "r"
+            os.makedirs(self.path, exist_ok=True)
+            self.keys = np.memmap(os.path.join(self.path, "keys.u64"), dtype="uint64", mode=mode, shape=(self.capacity,))
+            self.access = np.memmap(os.path.join(self.path, "access.u64"), dtype="uint64", mode=mode, shape=(self.capacity,))
+            self.vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype="float32", mode=mode, shape=(self.capacity, self.dim))
+        occupied = np.flatnonzero(self.keys)
+        self._slots: Dict[int, int] = dict(zip(self.keys[occupied].tolist(), occupied.tolist()))
+        self._free: List[int] = np.flatnonzero(self.keys == 0)[::-1].tolist()
+        if not self.read_only:
+            self._write_meta()
+
+    def _write_meta(self):
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim, "capacity": self.capacity, "tick": self._tick}, f)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "read_only": self.read_only,
+        }
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int], List[int]]:
+        """Return ``(vectors, keys, missing)``; rows listed in ``missing`` are zeros."""
+        keys = [text_key(self.model_name, t) for t in texts]
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        hit_rows, hit_slots, missing = [], [], []
+        for i, k in enumerate(keys):
+            slot = self._slots.get(k)
+            if slot is None:
+                missing.append(i)
+            else:
+                hit_rows.append(i)
+                hit_slots.append(slot)
+        if hit_rows and self.read_only:
+            # The writer may have evicted and reused a slot since we opened:
+            # the key is cleared before the vector is overwritten, so checking
+            # it after the read catches that.
+            vectors = self.vectors[hit_slots]
+            live = self.keys[hit_slots] == np.array([keys[i] for i in hit_rows], dtype="uint64")
+            missing = sorted(missing + [r for r, ok in zip(hit_rows, live) if not ok])
+            hit_rows = [r for r, ok in zip(hit_rows, live) if ok]
+            out[hit_rows] = vectors[live]
+        elif hit_rows:
+            out[hit_rows] = self.vectors[hit_slots]
+            self._tick += 1
+            self.access[hit_slots] = self._tick
+        self.hits += len(hit_rows)
+        self.misses += len(missing)
+        return out, keys, missing
+
+    def _evict(self, n: int):
+        occupied = np.flatnonzero(self.keys)
+        n = min(n, len(occupied))
+        if n <= 0:
+            return
+        victims = occupied[np.argpartition(self.access[occupied], n - 1)[:n]]
+        for slot in victims.tolist():
+            del self._slots[int(self.keys[slot])]
+            self.keys[slot] = 0
+            self._free.append(slot)
+        self.evictions += n
+
+    def put(self, keys: Sequence[int], vectors: np.ndarray):
+        if self.read_only:
+            return
+        fresh = {}
+        for k, v in zip(keys, vectors):
+            if k not in self._slots:
+                fresh[k] = v
+        if not fresh:
+            return
+        items = list(fresh.items())[-self.capacity:]
+        if len(items) > len(self._free):
+            self._evict(len(items) - len(self._free))
+        self._tick += 1
+        slots = [self._free.pop() for _ in items]
+        self.vectors[slots] = np.stack([v for _, v in items]).astype("float32")
+        self.keys[slots] = np.array([k for k, _ in items], dtype="uint64")
+        self.access[slots] = self._tick
+        for (k, _), slot in zip(items, slots):
+            self._slots[k] = slot
+
+    def flush(self):
+        if self.read_only:
+            return
+        self.vectors.flush()
+        self.keys.flush()
+        self.access.flush()
+        self._write_meta()
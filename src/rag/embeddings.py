@@ -1,15 +1,179 @@
-from typing import Iterable, List
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from . import metrics
+from .embedding_cache import EmbeddingCache, text_key
+
+
+# Per-process model used by the embedding worker pool.
+_worker_model = None
+
+
+def _init_worker(model_name: str, offline: bool, threads: int):
+    global _worker_model
+    # Pin the thread pools before torch is imported in this (spawned) process.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu", local_files_only=offline)
+
+
+def _encode_in_worker(texts: List[str], batch_size: int) -> np.ndarray:
+    emb = _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    return emb.astype("float32")
 
 
 class EmbeddingModel:
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: Optional[str] = None,
+        cache_max_entries: int = 200_000,
+        offline: bool = False,
+        batch_size: int = 64,
+        workers: int = 0,
+        threads_per_worker: int = 1,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        # workers > 1 spreads large encode calls over a process pool, each
+        # process holding its own model copy with threads_per_worker threads.
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.stats = {"chunks": 0, "seconds": 0.0}
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.offline = offline
+        self._model = None
+        # Known from the loaded model, the cache's meta.json or the first
+        # pooled encode, so a pooled build never loads the model here.
+        self.dim: Optional[int] = None
+        self.load_seconds: Optional[float] = None
+        self.cache: Optional[EmbeddingCache] = None
 
-    def encode(self, texts: Iterable[str]) -> np.ndarray:
-        emb = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
-        return emb.astype("float32")
+    def load(self):
+        # sentence-transformers (and torch) are imported on first use only.
+        if self._model is None:
+            started = time.perf_counter()
+            from sentence_transformers import SentenceTransformer
 
+            self._model = SentenceTransformer(self.model_name, local_files_only=self.offline)
+            self.load_seconds = time.perf_counter() - started
+            self.dim = self._model.get_sentence_embedding_dimension()
+            self._open_cache()
+        return self._model
 
+    def _open_cache(self):
+        if self.cache_dir and self.cache is None and self.dim:
+            self.cache = EmbeddingCache(self.cache_dir, self.model_name, self.dim, max_entries=self.cache_max_entries)
 
+    @property
+    def model(self):
+        return self.load()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: forking a process that already runs torch threads can deadlock.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.offline, self.threads_per_worker),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.cache is not None:
+            # Lets another process write the cache; reopened on the next encode().
+            self.cache.close()
+            self.cache = None
+
+    def _encode_parallel(self, texts: List[str]) -> np.ndarray:
+        # Similar lengths share a batch (less padding); rows are scattered back
+        # to their original positions as batches finish.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        batches = [order[s:s + self.batch_size] for s in range(0, len(order), self.batch_size)]
+        pool = self._get_pool()
+        futures = [pool.submit(_encode_in_worker, [texts[i] for i in b], self.batch_size) for b in batches]
+        out = None
+        for b, fut in zip(batches, futures):
+            emb = fut.result()
+            if out is None:
+                out = np.empty((len(texts), emb.shape[1]), dtype="float32")
+                self.dim = emb.shape[1]
+            out[b] = emb
+        return out
+
+    def _pooled(self, n: int) -> bool:
+        return self.workers > 1 and n > self.batch_size
+
+    def _encode(self, texts: List[str], pooled: bool) -> np.ndarray:
+        started = time.perf_counter()
+        if pooled:
+            emb = self._encode_parallel(texts)
+        else:
+            # sentence-transformers length-sorts within a call already.
+            emb = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+            emb = emb.astype("float32")
+        self.stats["chunks"] += len(texts)
+        self.stats["seconds"] += time.perf_counter() - started
+        return emb
+
+    def throughput(self) -> Dict:
+        seconds = self.stats["seconds"]
+        return {
+            "chunks": self.stats["chunks"],
+            "seconds": round(seconds, 3),
+            "chunks_per_s": round(self.stats["chunks"] / seconds, 1) if seconds else 0.0,
+            "workers": max(1, self.workers),
+            "threads_per_worker": self.threads_per_worker if self.workers > 1 else None,
+            "batch_size": self.batch_size,
+        }
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        if self.dim is None and self.cache_dir:
+            self.dim = EmbeddingCache.stored_dim(self.cache_dir, self.model_name)
+        # Cache misses of a pooled call go to the pool too, however few.
+        pooled = self._pooled(len(texts))
+        if not pooled:
+            self.load()
+        self._open_cache()
+        if self.cache is None or not texts:
+            emb = self._encode(texts, pooled)
+            # A first pooled call learns the dimension from its results.
+            self._open_cache()
+            if self.cache is not None and texts:
+                self.cache.put([text_key(self.model_name, t) for t in texts], emb)
+                self.cache.flush()
+            return emb
+        out, keys, missing = self.cache.lookup(texts)
+        metrics.count("embed_cache_hits", len(texts) - len(missing))
+        metrics.count("embed_cache_misses", len(missing))
+        if missing:
+            # Identical texts inside one batch only go through the model once.
+            first = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            uniq = list(first.values())
+            emb = self._encode([texts[i] for i in uniq], pooled)
+            by_key = dict(zip((keys[i] for i in uniq), emb))
+            out[missing] = np.stack([by_key[keys[i]] for i in missing])
+            self.cache.put([keys[i] for i in uniq], emb)
+            self.cache.flush()
+        return out
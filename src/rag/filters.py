@@ -0,0 +1,133 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .chunk_store import CORE_FIELDS, ChunkStore
+
+
+# Filter keys with special meaning; any other key is matched against chunk
+# fields (e.g. {"page": [1, 2]} for chunks carrying a "page" field).
+DOC_ID_KEY = "doc_id"
+PATH_PREFIX_KEY = "source_path_prefix"
+
+
+def _as_list(value: Any) -> List:
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+def validate_filters(filters: Any) -> Optional[Dict]:
+    """Checks a filter from an untrusted source (CLI, HTTP) and returns it.
+
+    Raises ValueError unless it is a dict whose ``doc_id`` and
+    ``source_path_prefix`` values are strings (or lists of strings) and whose
+    other values are scalars (or lists of scalars).
+    """
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    for key, value in filters.items():
+        if not isinstance(key, str):
+            raise ValueError(f"filter keys must be strings, got {key!r}")
+        allowed = (str,) if key in (DOC_ID_KEY, PATH_PREFIX_KEY) else (str, int, float, bool)
+        kind = "strings" if allowed == (str,) else "strings, numbers or booleans"
+        values = value if isinstance(value, list) else [value]
+        if not all(isinstance(v, allowed) for v in values):
+            raise ValueError(f"filter {key!r} must be one of or a list of {kind}")
+    return filters
+
+
+class MetadataIndex:
+    """Per-field inverted index over chunk positions, used to turn a filter into
+    an ID bitmap for FAISS ``IDSelectorBitmap``.
+
+    Filters are dicts: ``doc_id`` (one id or a list), ``source_path_prefix``
+    (one prefix or a list), and any other key as an exact match (or list of
+    accepted values) on a chunk field. Keys are ANDed, list values ORed.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = len(chunks)
+        self._stored: Optional[Dict[str, Dict[Any, np.ndarray]]] = None
+        if isinstance(chunks, ChunkStore):
+            docs = [tuple(d[:2]) for d in chunks.docs]
+            doc_col = np.asarray(chunks.rows["doc"], dtype=np.int64)
+            # Postings of the extra fields, written with the store.
+            self._stored = chunks.field_postings()
+        else:
+            ids: Dict[tuple, int] = {}
+            doc_col = np.fromiter(
+                (ids.setdefault((c["doc_id"], c.get("source_path")), len(ids)) for c in chunks),
+                dtype=np.int64,
+                count=self.size,
+            )
+            docs = list(ids)
+        self.docs = docs
+        # CSR postings: doc number -> chunk positions.
+        self._doc_order = np.argsort(doc_col, kind="stable")
+        self._doc_indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_col, minlength=len(docs)), out=self._doc_indptr[1:])
+        self._fields: Dict[str, Dict[Any, np.ndarray]] = {}
+
+    def _docs_matching(self, filters: Dict) -> Optional[np.ndarray]:
+        selected = None
+        if DOC_ID_KEY in filters:
+            wanted = set(_as_list(filters[DOC_ID_KEY]))
+            selected = np.array([d[0] in wanted for d in self.docs], dtype=bool)
+        if PATH_PREFIX_KEY in filters:
+            prefixes = tuple(_as_list(filters[PATH_PREFIX_KEY]))
+            hit = np.array([bool(d[1]) and d[1].startswith(prefixes) for d in self.docs], dtype=bool)
+            selected = hit if selected is None else selected & hit
+        return selected
+
+    def _field_index(self, field: str) -> Dict[Any, np.ndarray]:
+        # value -> sorted chunk positions. Chunk lists and stores written
+        # without postings are decoded on first use of a field.
+        if self._stored is not None and field not in CORE_FIELDS:
+            return self._stored.get(field, {})
+        index = self._fields.get(field)
+        if index is None:
+            if field == "chunk_id" and isinstance(self.chunks, ChunkStore):
+                values: Iterable = np.asarray(self.chunks.rows["chunk_id"]).tolist()
+            else:
+                values = (c.get(field) for c in self.chunks)
+            lists: Dict[Any, List[int]] = {}
+            for i, v in enumerate(values):
+                if v is not None and not isinstance(v, (list, dict)):
+                    lists.setdefault(v, []).append(i)
+            index = self._fields[field] = {v: np.array(p, dtype=np.int64) for v, p in lists.items()}
+        return index
+
+    def mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        # Boolean mask over chunk positions, or None when nothing is filtered.
+        if not filters:
+            return None
+        mask = None
+        docs = self._docs_matching(filters)
+        if docs is not None:
+            mask = np.zeros(self.size, dtype=bool)
+            for d in np.flatnonzero(docs):
+                mask[self._doc_order[self._doc_indptr[d]:self._doc_indptr[d + 1]]] = True
+        for field, value in filters.items():
+            if field in (DOC_ID_KEY, PATH_PREFIX_KEY):
+                continue
+            index = self._field_index(field)
+            hit = np.zeros(self.size, dtype=bool)
+            for v in _as_list(value):
+                positions = index.get(v)
+                if positions is not None:
+                    hit[positions] = True
+            mask = hit if mask is None else mask & hit
+        return mask
+
+
+def id_selector(mask: np.ndarray):
+    # Keeps the packed bitmap alive on the selector (FAISS only holds a pointer).
+    import faiss
+
+    bits = np.packbits(mask, bitorder="little")
+    # n is the bitmap length in bytes; IDs past it are rejected, not read.
+    selector = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+    selector.bitmap_array = bits
+    return selector
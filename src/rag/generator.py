@@ -1,7 +1,11 @@
 import os
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
 
-from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+from . import metrics
+from .batching import MicroBatcher
 
 
 def build_prompt(question: str, context_bullets: str) -> str:
@@ -12,9 +16,34 @@ def build_prompt(question: str, context_bullets: str) -> str:
     )
 
 
+def _first_token_clock():
+    # Stopping criterion that never stops but notes when the first new token
+    # exists, splitting model.generate into prefill and decode time.
+    import torch
+    from transformers import StoppingCriteria
+
+    class FirstTokenClock(StoppingCriteria):
+        first = None
+
+        def __call__(self, input_ids, scores, **kwargs):
+            if self.first is None:
+                self.first = time.perf_counter()
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    return FirstTokenClock()
+
+
 class LocalGenerator:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, batch_size: int = 8, max_wait_ms: float = 10.0, offline: bool = False):
+        # transformers/torch are imported here rather than at module level so
+        # that importing the pipeline stays cheap for retrieval-only use.
+        from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+
         self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.offline = offline
+        self._engine = None
         
         # Get HuggingFace token from environment or cache
         from huggingface_hub.utils import HfFolder
@@ -34,9 +63,10 @@ class LocalGenerator:
         try:
             import requests
             
-            # First check connectivity
+            # First check connectivity (skipped offline: only the local HF cache is used)
             try:
-                requests.get("https://huggingface.co", timeout=5)
+                if not offline:
+                    requests.get("https://huggingface.co", timeout=5)
             except Exception as conn_err:
                 raise ValueError(
                     f"❌ Cannot connect to HuggingFace.co\n\n"
@@ -54,7 +84,8 @@ class LocalGenerator:
             token_param = hf_token if hf_token else None
             self.tokenizer = AutoTokenizer.from_pretrained(
                 model_name,
-                token=token_param  # None for public models, token for gated models
+                token=token_param,  # None for public models, token for gated models
+                local_files_only=offline,
             )
         except ValueError as ve:
             # Re-raise our custom network errors
@@ -109,7 +140,8 @@ class LocalGenerator:
                 token_param = self.hf_token if self.hf_token else None
                 self.model = AutoModelForCausalLM.from_pretrained(
                     model_name,
-                    token=token_param
+                    token=token_param,
+                    local_files_only=offline,
                 )
             except Exception as e:
                 error_msg = str(e)
@@ -128,6 +160,8 @@ class LocalGenerator:
             # Set pad_token if not present
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            # Decoder-only models continue from the last position, so batches pad on the left.
+            self.tokenizer.padding_side = "left"
             self.is_causal = True
         else:
             # Use Seq2SeqLM for encoder-decoder models (flan-t5, etc.)
@@ -136,29 +170,140 @@ class LocalGenerator:
                 token_param = self.hf_token if self.hf_token else None
                 self.model = AutoModelForSeq2SeqLM.from_pretrained(
                     model_name,
-                    token=token_param
+                    token=token_param,
+                    local_files_only=offline,
                 )
             except Exception as e:
                 raise ValueError(f"Failed to load model {model_name}. Error: {e}")
             self.is_causal = False
 
-    def generate(self, prompt: str, max_new_tokens: int = 256) -> str:
-        if self.is_causal:
-            # For decoder-only models, use text generation pipeline
-            pipe = pipeline("text-generation", model=self.model, tokenizer=self.tokenizer)
-            outputs = pipe(
-                prompt,
+        self.model.eval()
+
+    @property
+    def engine(self) -> MicroBatcher:
+        # Started on first use; concurrent generate() callers share its batches.
+        if self._engine is None:
+            self._engine = MicroBatcher(
+                self._run_requests,
+                max_batch_size=self.batch_size,
+                max_wait_ms=self.max_wait_ms,
+                name="local-generator",
+            )
+        return self._engine
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    @property
+    def prompt_token_limit(self) -> int:
+        # model_max_length is a huge sentinel when the tokenizer does not declare one.
+        window = self.tokenizer.model_max_length
+        if not window or window > 1_000_000:
+            window = getattr(self.model.config, "max_position_embeddings", None) or 2048
+        # Causal models share the window with the (default 256) generated tokens.
+        return window - (256 if self.is_causal else 0)
+
+    def _generate_batch(self, prompts: List[str], max_new_tokens: int) -> List[str]:
+        import torch
+
+        with metrics.span("tokenize"):
+            enc = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        profiling = metrics.current() is not None
+        clock = None
+        if profiling:
+            from transformers import StoppingCriteriaList
+
+            clock = _first_token_clock()
+        started = time.perf_counter()
+        with torch.inference_mode():
+            out = self.model.generate(
+                **enc,
                 max_new_tokens=max_new_tokens,
                 do_sample=False,
-                return_full_text=False,
                 pad_token_id=self.tokenizer.pad_token_id,
+                **({"stopping_criteria": StoppingCriteriaList([clock])} if clock is not None else {}),
             )
-            return outputs[0]["generated_text"].strip()
-        else:
-            # For encoder-decoder models, use text2text generation
-            pipe = pipeline("text2text-generation", model=self.model, tokenizer=self.tokenizer)
-            out = pipe(prompt, max_new_tokens=max_new_tokens, do_sample=False)
-            return out[0]["generated_text"].strip()
+        if self.is_causal:
+            # Keep only the continuation (return_full_text=False).
+            out = out[:, enc["input_ids"].shape[1]:]
+        if profiling:
+            ended = time.perf_counter()
+            first = clock.first or ended
+            timings = metrics.current()
+            timings.add("prefill", first - started)
+            timings.add("decode", ended - first)
+            timings.count("prompt_tokens", int(enc["attention_mask"].sum()))
+            timings.count("generated_tokens", int((out != self.tokenizer.pad_token_id).sum()))
+        with metrics.span("detokenize"):
+            return [t.strip() for t in self.tokenizer.batch_decode(out, skip_special_tokens=True)]
+
+    def _run_requests(self, requests: List[Tuple]) -> List[str]:
+        # Items are (prompt, max_new_tokens, caller's Timings or None); a
+        # profiled caller receives the spans and token counts of its batch.
+        results: List[str] = [""] * len(requests)
+        by_budget: Dict[int, List[int]] = {}
+        for i, request in enumerate(requests):
+            by_budget.setdefault(request[1], []).append(i)
+        for max_new_tokens, rows in by_budget.items():
+            # Prompts of one generate_many() call share their caller's Timings.
+            callers = list({id(t): t for t in (requests[i][2] for i in rows if len(requests[i]) > 2) if t is not None}.values())
+            batch = metrics.Timings() if callers else None
+            with metrics.recording(batch):
+                texts = self._generate_batch([requests[i][0] for i in rows], max_new_tokens)
+            for timings in callers:
+                timings.merge(batch)
+                timings.count("batch_size", len(rows))
+            for i, text in zip(rows, texts):
+                results[i] = text
+        return results
+
+    def generate(self, prompt: str, max_new_tokens: int = 256) -> str:
+        # Runs on the engine thread, so the caller's Timings travel with the request.
+        return self.engine.submit((prompt, max_new_tokens, metrics.current())).result()
+
+    def generate_many(self, prompts: List[str], max_new_tokens: int = 256) -> List[str]:
+        # Queued together, so the engine batches them (with any concurrent generate() calls).
+        timings = metrics.current()
+        futures = [self.engine.submit((prompt, max_new_tokens, timings)) for prompt in prompts]
+        return [f.result() for f in futures]
+
+    def stream(self, prompt: str, max_new_tokens: int = 256) -> Iterator[str]:
+        # generate() runs in a worker thread and pushes decoded text pieces
+        # into the streamer as tokens are produced.
+        import torch
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        enc = self.tokenizer([prompt], return_tensors="pt")
+        errors: List[BaseException] = []
+
+        def run():
+            try:
+                with torch.inference_mode():
+                    self.model.generate(
+                        **enc,
+                        max_new_tokens=max_new_tokens,
+                        do_sample=False,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        streamer=streamer,
+                    )
+            except BaseException as e:
+                errors.append(e)
+                streamer.end()
+
+        worker = threading.Thread(target=run, name="local-generator-stream", daemon=True)
+        worker.start()
+        for piece in streamer:
+            if piece:
+                yield piece
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.close()
+            self._engine = None
 
 
 class OpenAIGenerator:
@@ -167,15 +312,55 @@ class OpenAIGenerator:
 
         self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
         self.model = model
+        self.prompt_token_limit = 128_000 - 400
+        try:
+            import tiktoken
+
+            self._encoding = tiktoken.encoding_for_model(model)
+        except Exception:
+            self._encoding = None
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is None:
+            return len(text) // 4 + 1  # rough estimate without tiktoken
+        return len(self._encoding.encode(text))
 
     def generate(self, prompt: str, max_tokens: int = 400) -> str:
+        with metrics.span("openai"):
+            resp = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=max_tokens,
+            )
+        if resp.usage is not None:
+            metrics.count("prompt_tokens", resp.usage.prompt_tokens)
+            metrics.count("generated_tokens", resp.usage.completion_tokens)
+        return resp.choices[0].message.content.strip()
+
+    def stream(self, prompt: str, max_tokens: int = 400) -> Iterator[str]:
         resp = self.client.chat.completions.create(
             model=self.model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
             max_tokens=max_tokens,
+            stream=True,
         )
-        return resp.choices[0].message.content.strip()
+        for event in resp:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    def generate_many(self, prompts: List[str], max_tokens: int = 400, concurrency: int = 8) -> List[str]:
+        # Requests are network-bound, so overlap them on a small thread pool
+        # (pool threads do not inherit the caller's profiling context).
+        timings = metrics.current()
+
+        def run(prompt: str) -> str:
+            with metrics.recording(timings):
+                return self.generate(prompt, max_tokens=max_tokens)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(run, prompts))
 
 
 
@@ -1,55 +1,931 @@
 import json
+import math
 import os
-from typing import Dict, List
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
 
-import faiss
 import numpy as np
 
+from . import snapshots
+from .bm25 import BM25Builder, BM25Index
+from .chunk_store import ROW_DTYPE, ChunkStore, ChunkStoreWriter, convert_metadata_json, store_exists, store_paths, write_store
+from .filters import MetadataIndex, id_selector
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "opq_ivf_pq")
+# How vectors are held in the index. Everything but float32 keeps an exact copy
+# in a memory-mapped sidecar (vectors.f32) used to re-score the shortlist.
+VECTOR_STORAGE = ("float32", "float16", "int8", "binary")
+DEFAULT_INDEX_PARAMS = {
+    "nlist": 0,  # 0 = ~4*sqrt(n) inverted lists, derived from the training sample
+    "pq_m": 16,
+    "pq_nbits": 8,
+    "hnsw_m": 32,
+    "hnsw_ef_construction": 200,
+    "train_sample_size": 100_000,
+    "nprobe": 16,
+    "ef_search": 64,
+    "storage": "float32",
+    "rescore_factor": 4,  # shortlist = top_k * factor for quantized storage and PQ types; 0 = no re-scoring
+}
+INFO_FILENAME = "index_info.json"
+BM25_PREFIX = "bm25"  # bm25.npz (postings) + bm25.vocab.json
+VECTORS_FILENAME = "vectors.f32"
+TOMBSTONES_FILENAME = "tombstones.i64"  # stable IDs of deleted chunks awaiting compaction
+
+
+def _faiss():
+    # Imported on first use so CLI/UI startup does not pay for it.
+    import faiss
+
+    return faiss
+
+
+def _is_ivf(index_type: str) -> bool:
+    return "ivf" in index_type
+
+
+def _needs_training(index_type: str, storage: str = "float32") -> bool:
+    # int8 scalar quantization learns per-dimension ranges from a sample.
+    return _is_ivf(index_type) or storage == "int8"
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    # One sign bit per dimension, packed 8 per byte (Hamming codes for IndexBinaryFlat).
+    return np.packbits(vectors > 0, axis=1)
+
+
+def with_ids(index):
+    # Wraps an empty index so vectors are added under explicit 64-bit chunk IDs.
+    faiss = _faiss()
+    if isinstance(index, faiss.IndexBinary):
+        return faiss.IndexBinaryIDMap2(index)
+    return faiss.IndexIDMap2(index)
+
+
+class _ReadWriteLock:
+    # Searches share the index; in-place updates and compaction swaps need it
+    # alone. Waiting writers go first so a steady query load cannot starve them.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+def create_index(index_type: str, train_vectors: np.ndarray, params: Dict):
+    # Returns (trained empty index, index_type actually used). Tiny corpora that
+    # cannot train the requested quantizers fall back to an exact flat index.
+    faiss = _faiss()
+    n, dim = train_vectors.shape
+    storage = params.get("storage", "float32")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index_type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+    if storage not in VECTOR_STORAGE:
+        raise ValueError(f"Unknown storage {storage!r}; expected one of {', '.join(VECTOR_STORAGE)}")
+    if storage != "float32" and "pq" in index_type:
+        raise ValueError(f"{index_type} already compresses vectors; use storage='float32' with it")
+    if storage == "binary":
+        if index_type != "flat":
+            raise ValueError("binary storage is only available with index_type='flat'")
+        if dim % 8:
+            raise ValueError(f"binary storage needs a vector dimension divisible by 8, got {dim}")
+        return faiss.IndexBinaryFlat(dim), index_type
+    if "pq" in index_type:
+        if dim % params["pq_m"]:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the vector dimension {dim}")
+        if n < 2 ** params["pq_nbits"]:
+            print(f"Warning: {n} vectors are too few to train {index_type}; using a flat index")
+            index_type = "flat"
+    nlist = params["nlist"] or int(4 * math.sqrt(n))
+    nlist = max(1, min(nlist, n))
+
+    codec = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}[storage]
+    pq = f"PQ{params['pq_m']}x{params['pq_nbits']}"
+    desc = {
+        "flat": codec,
+        "hnsw": f"HNSW{params['hnsw_m']},{codec}",
+        "ivf_flat": f"IVF{nlist},{codec}",
+        "ivf_pq": f"IVF{nlist},{pq}",
+        "opq_ivf_pq": f"OPQ{params['pq_m']},IVF{nlist},{pq}",
+    }[index_type]
+    if desc == "Flat":
+        return faiss.IndexFlatIP(dim), index_type
+    index = faiss.index_factory(dim, desc, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params["hnsw_ef_construction"]
+    if not index.is_trained:
+        sample = train_vectors
+        if n > params["train_sample_size"]:
+            rows = np.random.default_rng(0).choice(n, params["train_sample_size"], replace=False)
+            sample = train_vectors[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample, dtype="float32"))
+    return index, index_type
+
 
 class FaissIndex:
-    def __init__(self, index_dir: str, faiss_index_filename: str, metadata_filename: str):
+    def __init__(
+        self,
+        index_dir: str,
+        faiss_index_filename: str,
+        metadata_filename: str,
+        index_type: str = "flat",
+        index_params: Optional[Dict] = None,
+        chunk_store_prefix: str = "chunks",
+        lexical: bool = True,
+        compact_threshold: float = 0.2,
+        keep_snapshots: int = 3,
+    ):
+        # index_dir holds versioned snapshots (see snapshots.py). self.dir is
+        # the one this object reads and writes: the published snapshot after
+        # load(), a new one while a write is in progress, or index_dir itself
+        # for indexes saved before snapshots.
         self.index_dir = index_dir
-        self.faiss_index_path = os.path.join(index_dir, faiss_index_filename)
-        self.metadata_path = os.path.join(index_dir, metadata_filename)
+        self.dir = snapshots.resolve(index_dir)
+        self.faiss_index_filename = faiss_index_filename
+        # metadata.json is only read for indexes built before the chunk store.
+        self.metadata_filename = metadata_filename
+        self.chunk_store_prefix = chunk_store_prefix
+        # Snapshots kept on disk after each publish, the published one included (0 = all).
+        self.keep_snapshots = keep_snapshots
+        # Build a BM25 index next to the vectors for lexical/hybrid retrieval.
+        self.lexical = lexical
+        self.bm25: Optional[BM25Index] = None
+        self._bm25_builder: Optional[BM25Builder] = None
+        # configured_type is what builds ask for; index_type is what the
+        # current index actually is (after fallbacks or load()).
+        self.configured_type = index_type
+        self.index_type = index_type
+        self.params = {**DEFAULT_INDEX_PARAMS, **(index_params or {})}
         self.index = None
         self.chunks: List[Dict] = []
+        self._stream: Optional[ChunkStoreWriter] = None
+        self._stream_previous: Optional[str] = None
+        self._untrained: List[np.ndarray] = []
+        # Exact float32 vectors kept next to a quantized index: in-memory parts
+        # while building, a read-only memmap of vectors.f32 after load().
+        self._exact: List[np.ndarray] = []
+        self._exact_file = None
+        self._metadata: Optional[MetadataIndex] = None
+        # Stable chunk IDs: vectors live in an ID-mapped index and _ids[row] is
+        # the ID of chunk row `row` (ascending, since IDs are handed out in
+        # append order). None for indexes saved before IDs existed, whose
+        # FAISS labels are the rows themselves.
+        self._ids: Optional[np.ndarray] = None
+        self.next_id = 0
+        # Deleted rows stay in every file until compact(); searches skip them.
+        self._deleted: Optional[np.ndarray] = None
+        self._live_selector = None
+        # Compaction starts in a background thread once this share of rows is deleted (0 = never).
+        self.compact_threshold = compact_threshold
+        # Called with the old row -> new row map (-1 = dropped) after each compaction.
+        self.on_compact: Optional[Callable[[np.ndarray], None]] = None
+        self.write_lock = threading.RLock()
+        self._rw = _ReadWriteLock()
+        self._compactor: Optional[threading.Thread] = None
+
+    @property
+    def faiss_index_path(self) -> str:
+        return os.path.join(self.dir, self.faiss_index_filename)
+
+    @property
+    def metadata_path(self) -> str:
+        return os.path.join(self.dir, self.metadata_filename)
+
+    @property
+    def store_prefix(self) -> str:
+        return os.path.join(self.dir, self.chunk_store_prefix)
+
+    @property
+    def info_path(self) -> str:
+        return os.path.join(self.dir, INFO_FILENAME)
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.dir, VECTORS_FILENAME)
+
+    @property
+    def bm25_prefix(self) -> str:
+        return os.path.join(self.dir, BM25_PREFIX)
+
+    @property
+    def tombstones_path(self) -> str:
+        return os.path.join(self.dir, TOMBSTONES_FILENAME)
+
+    @property
+    def storage(self) -> str:
+        return self.params["storage"]
+
+    def _append_heads(self) -> Dict[str, Optional[int]]:
+        # The files an in-place update appends to are copied into the new
+        # snapshot (up to the rows this index reads) rather than shared.
+        # With faiss.index and bm25.npz rewritten as a whole on every commit
+        # as well, an update costs O(corpus) I/O, not O(new chunks).
+        rows, blob = (os.path.basename(p) for p in store_paths(self.chunk_store_prefix)[:2])
+        heads: Dict[str, Optional[int]] = {rows: self.index.ntotal * ROW_DTYPE.itemsize, blob: None}
+        if os.path.exists(self.vectors_path):
+            heads[VECTORS_FILENAME] = self.index.ntotal * self.index.d * 4
+        return heads
+
+    @contextmanager
+    def _snapshot(self, fork: bool = False, appending: bool = False):
+        # Points self.dir at a new unpublished snapshot for the with-block.
+        # fork=True starts it from the current files (hard links, except for
+        # the files appended to when appending=True; see _append_heads). A
+        # failed block removes the snapshot and restores self.dir.
+        previous = self.dir
+        path = snapshots.create(self.index_dir)
+        try:
+            if fork:
+                snapshots.fork(previous, path, heads=self._append_heads() if appending else None)
+            self.dir = path
+            yield path
+        except BaseException:
+            self.dir = previous
+            snapshots.discard(self.index_dir, path)
+            raise
+
+    def publish(self):
+        """Atomically makes the snapshot this object wrote the one that
+        readers load, then garbage-collects old snapshots.
+
+        Writes publish on their own unless called with publish=False, which
+        lets a caller add files of its own (e.g. the pipeline's manifest) to
+        the snapshot first.
+        """
+        snapshots.publish(self.index_dir, self.dir)
+        snapshots.collect_garbage(self.index_dir, self.keep_snapshots)
+
+    def _keeps_exact(self) -> bool:
+        # PQ codes only reconstruct approximately, so PQ types keep the
+        # embeddings too: incremental builds reuse them from vectors().
+        return self.storage != "float32" or "pq" in self.index_type
+
+    def _create(self, train_vectors: np.ndarray):
+        index, self.index_type = create_index(self.configured_type, train_vectors, self.params)
+        self.index = with_ids(index)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+        self._set_deleted(None)
+        self.set_search_params()
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        if nprobe is not None:
+            self.params["nprobe"] = nprobe
+        if ef_search is not None:
+            self.params["ef_search"] = ef_search
+        if self.index is None:
+            return
+        if self.storage == "binary":
+            return
+        ps = _faiss().ParameterSpace()
+        if _is_ivf(self.index_type):
+            ps.set_index_parameter(self.index, "nprobe", self.params["nprobe"])
+        elif self.index_type == "hnsw":
+            ps.set_index_parameter(self.index, "efSearch", self.params["ef_search"])
 
     def build(self, vectors: np.ndarray, chunks: List[Dict]):
         if vectors.ndim != 2:
             raise ValueError("vectors must be 2D array")
-        dim = vectors.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
-        self.index.add(vectors)
+        self._create(vectors)
+        self._index_add(vectors)
+        self._exact = [vectors] if self._keeps_exact() else []
         self.chunks = chunks
+        self.bm25 = BM25Index.build(c["text"] for c in chunks) if self.lexical else None
+
+    def open_stream(self):
+        # Streaming builds append vectors to the in-memory index but write chunk
+        # metadata straight to the chunk store, so only the current batch is held in memory.
+        # Everything goes into a new snapshot, published by close_stream().
+        self._stream_previous = self.dir
+        self.dir = snapshots.create(self.index_dir)
+        self.index_type = self.configured_type  # not a previously loaded index's type
+        self.index = None
+        self.chunks = []
+        self.bm25 = None
+        self._bm25_builder = BM25Builder() if self.lexical else None
+        self._exact = []
+        if self._keeps_exact():
+            self._exact_file = open(self.vectors_path + ".tmp", "wb")
+        self._stream = ChunkStoreWriter(self.store_prefix)
 
-    def save(self):
-        os.makedirs(self.index_dir, exist_ok=True)
+    def _index_add(self, vectors: np.ndarray) -> np.ndarray:
+        ids = np.arange(self.next_id, self.next_id + len(vectors), dtype=np.int64)
+        codes = binarize(vectors) if self.storage == "binary" else vectors
+        if self._ids is None:
+            # Pre-ID index: positions are the IDs, and appending keeps it that way.
+            self.index.add(codes)
+        else:
+            self.index.add_with_ids(codes, ids)
+            self._ids = np.concatenate([self._ids, ids])
+        self.next_id += len(vectors)
+        return ids
+
+    def add(self, vectors: np.ndarray, chunks: List[Dict]):
+        if vectors.ndim != 2:
+            raise ValueError("vectors must be 2D array")
+        if len(vectors) != len(chunks):
+            raise ValueError("vectors and chunks must have the same length")
+        if self.index is None and _needs_training(self.index_type, self.storage):
+            # Hold vectors back until there is a full training sample.
+            self._untrained.append(vectors)
+            if sum(len(v) for v in self._untrained) >= self.params["train_sample_size"]:
+                self._flush_untrained()
+        else:
+            if self.index is None:
+                self._create(vectors)
+            self._index_add(vectors)
+        if self._exact_file is not None:
+            np.ascontiguousarray(vectors, dtype="float32").tofile(self._exact_file)
+        elif self._keeps_exact():
+            self._exact.append(vectors)
+        if self._stream is None:
+            self.chunks.extend(chunks)
+            self.bm25 = None  # rebuilt from self.chunks on save()
+        else:
+            self._stream.append(chunks)
+            if self._bm25_builder is not None:
+                self._bm25_builder.add(c["text"] for c in chunks)
+
+    def _flush_untrained(self):
+        if not self._untrained:
+            return
+        vectors = np.vstack(self._untrained)
+        self._untrained = []
+        self._create(vectors)
+        self._index_add(vectors)
+
+    def close_stream(self, row_extras: Optional[Dict[int, Dict]] = None, publish: bool = True):
+        # row_extras: chunk row -> extra fields replacing those it was added with.
+        if self._stream is None:
+            raise RuntimeError("No stream open")
+        self._flush_untrained()
+        if self.index is None:
+            self.abort_stream()
+            raise ValueError("No vectors were added to the index")
+        for row, extra in (row_extras or {}).items():
+            self._stream.set_extra(row, extra)
+        self._stream.close()
+        self._stream = None
+        if self._exact_file is not None:
+            self._exact_file.close()
+            self._exact_file = None
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        self._write_index()
+        self._save_info()
+        self._save_tombstones()
+        if self._bm25_builder is not None:
+            self._bm25_builder.finish().save(self.bm25_prefix)
+        self._bm25_builder = None
+        # Metadata now lives only on disk; require an explicit load() before searching.
+        self.index = None
+        if publish:
+            self.publish()
+
+    def abort_stream(self):
+        if self._stream is None:
+            return
+        self._stream.abort()
+        self._stream = None
+        if self._exact_file is not None:
+            self._exact_file.close()
+            self._exact_file = None
+        snapshots.discard(self.index_dir, self.dir)
+        self.dir = self._stream_previous
+        self.index = None
+        self._untrained = []
+        self._bm25_builder = None
+
+    def _save_info(self):
+        # Replaced, never rewritten: the file may be hard-linked into an older snapshot.
+        with open(self.info_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "index_type": self.index_type,
+                "params": self.params,
+                "dim": self.index.d,
+                "ntotal": self.index.ntotal,
+                "next_id": self.next_id,
+            }, f, indent=2)
+        os.replace(self.info_path + ".tmp", self.info_path)
+
+    def _write_index(self, index=None, path: Optional[str] = None):
+        index = self.index if index is None else index
+        path = path or self.faiss_index_path
+        if self.storage == "binary":
+            _faiss().write_index_binary(index, path + ".tmp")
+        else:
+            _faiss().write_index(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def _save_tombstones(self):
+        if self._deleted is not None and self._deleted.any():
+            self.chunk_ids()[self._deleted].tofile(self.tombstones_path + ".tmp")
+            os.replace(self.tombstones_path + ".tmp", self.tombstones_path)
+        elif os.path.exists(self.tombstones_path):
+            os.remove(self.tombstones_path)
+
+    def _exact_vectors(self) -> Optional[np.ndarray]:
+        if isinstance(self._exact, list):
+            if not self._exact:
+                return None
+            if len(self._exact) > 1:
+                self._exact = [np.vstack(self._exact)]
+            return self._exact[0]
+        return self._exact
+
+    def save(self, publish: bool = True):
+        # Writes a complete new snapshot; nothing of the previous one is reused.
         if self.index is None:
             raise RuntimeError("Index not built")
-        faiss.write_index(self.index, self.faiss_index_path)
-        with open(self.metadata_path, "w", encoding="utf-8") as f:
-            json.dump(self.chunks, f, ensure_ascii=False)
+        with self._snapshot():
+            self._write_index()
+            self._save_info()
+            self._save_tombstones()
+            exact = self._exact_vectors() if self._keeps_exact() else None
+            if exact is not None:
+                np.ascontiguousarray(exact, dtype="float32").tofile(self.vectors_path + ".tmp")
+                os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            write_store(self.store_prefix, self.chunks)
+            if self.lexical and (self.bm25 is None or len(self.bm25) != len(self.chunks)):
+                self.bm25 = BM25Index.build(c["text"] for c in self.chunks)
+            if self.lexical:
+                self.bm25.save(self.bm25_prefix)
+        if publish:
+            self.publish()
+
+    def ensure_bm25(self, publish: bool = True) -> bool:
+        # Backfills bm25.* for an index built before lexical retrieval existed.
+        if not self.lexical or self.bm25 is not None:
+            return False
+        with self.write_lock:
+            self._require_current()
+            bm25 = BM25Index.build(c["text"] for c in self.chunks)
+            with self._snapshot(fork=True):
+                bm25.save(self.bm25_prefix)
+            self.bm25 = bm25
+            if publish:
+                self.publish()
+        return True
 
     def load(self):
-        if not (os.path.exists(self.faiss_index_path) and os.path.exists(self.metadata_path)):
+        self.dir = snapshots.resolve(self.index_dir)
+        has_store = store_exists(self.store_prefix)
+        if not (os.path.exists(self.faiss_index_path) and (has_store or os.path.exists(self.metadata_path))):
             raise FileNotFoundError("Index files not found. Build first.")
-        self.index = faiss.read_index(self.faiss_index_path)
-        with open(self.metadata_path, "r", encoding="utf-8") as f:
-            self.chunks = json.load(f)
+        info: Dict = {}
+        if os.path.exists(self.info_path):
+            with open(self.info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            self.index_type = info["index_type"]
+            self.params = {**DEFAULT_INDEX_PARAMS, **info["params"]}
+        else:
+            # Indexes written before index_info.json existed are always flat float32.
+            self.index_type = "flat"
+            self.params["storage"] = "float32"
+        if self.storage == "binary":
+            self.index = _faiss().read_index_binary(self.faiss_index_path)
+        else:
+            self.index = _faiss().read_index(self.faiss_index_path)
+        id_map = getattr(self.index, "id_map", None)
+        self._ids = _faiss().vector_to_array(id_map).astype(np.int64) if id_map is not None else None
+        self.next_id = info.get("next_id", self.index.ntotal)
+        self._exact = self._open_exact()
+        self.set_search_params()
+        deleted = None
+        if os.path.exists(self.tombstones_path):
+            deleted = np.isin(self.chunk_ids(), np.fromfile(self.tombstones_path, dtype=np.int64))
+        self._set_deleted(deleted)
+        if has_store:
+            self.chunks = ChunkStore(self.store_prefix, self.index.ntotal)
+        else:
+            print(f"Note: {self.metadata_path} is a legacy JSON index; run `python app.py convert` for faster loads")
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                self.chunks = json.load(f)
+        self.bm25 = BM25Index.load(self.bm25_prefix) if BM25Index.exists(self.bm25_prefix) else None
+
+    def _open_exact(self):
+        if self._keeps_exact() and os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path):
+            # Memory-mapped: only the re-scored shortlist rows are paged in.
+            # Bounded by ntotal, like the chunk store.
+            vectors = np.memmap(self.vectors_path, dtype="float32", mode="r").reshape(-1, self.index.d)
+            return vectors[:self.index.ntotal]
+        return []
+
+    def convert_legacy_metadata(self) -> int:
+        if not os.path.exists(self.metadata_path):
+            raise FileNotFoundError(f"No legacy metadata found at {self.metadata_path}")
+        return convert_metadata_json(self.metadata_path, self.store_prefix)
 
-    def search(self, query_vec: np.ndarray, top_k: int) -> List[Dict]:
+    def has_exact_vectors(self) -> bool:
+        # Whether vectors() returns the embeddings as added, not PQ approximations.
+        return self._exact_vectors() is not None or (self.storage == "float32" and "pq" not in self.index_type)
+
+    def vectors(self) -> np.ndarray:
         if self.index is None:
             raise RuntimeError("Index not loaded")
+        if self.index.ntotal == 0:
+            return np.zeros((0, self.index.d), dtype="float32")
+        exact = self._exact_vectors()
+        if exact is not None:
+            return exact
+        if self.storage == "binary":
+            raise RuntimeError(f"{self.vectors_path} is missing; binary codes cannot be turned back into vectors")
+        # Row order: the index inside the ID map holds vectors by position.
+        base = self._base_index()
+        if _is_ivf(self.index_type):
+            # PQ codes reconstruct approximately; IVF needs a direct map first.
+            _faiss().extract_index_ivf(base).make_direct_map()
+        return base.reconstruct_n(0, base.ntotal)
+
+    def _base_index(self):
+        if self._ids is None:
+            return self.index
+        faiss = _faiss()
+        if self.storage == "binary":
+            return faiss.downcast_IndexBinary(self.index.index)
+        return faiss.downcast_index(self.index.index)
+
+    def chunk_ids(self) -> np.ndarray:
+        # Stable 64-bit ID of every chunk row (deleted rows included until compaction).
+        if self._ids is None:
+            return np.arange(self.index.ntotal, dtype=np.int64)
+        return self._ids
+
+    def _rows(self, labels: np.ndarray) -> np.ndarray:
+        # FAISS labels (chunk IDs) -> chunk rows; -1 stays -1.
+        if self._ids is None:
+            return labels
+        return np.where(labels >= 0, np.searchsorted(self._ids, labels), -1)
+
+    def _selector(self, rows: np.ndarray):
+        # The ID map hands IDs, not rows, to the selector: build the bitmap over IDs.
+        if self._ids is None:
+            return id_selector(rows)
+        allowed = np.zeros(self.next_id, dtype=bool)
+        allowed[self._ids[rows]] = True
+        return id_selector(allowed)
+
+    def _set_deleted(self, deleted: Optional[np.ndarray]):
+        if deleted is not None and not deleted.any():
+            deleted = None
+        self._deleted = deleted
+        # Selector for unfiltered searches, rebuilt only when rows are deleted or added.
+        self._live_selector = self._selector(~deleted) if deleted is not None else None
+
+    def _selection(self, filters: Optional[Dict]):
+        # (row mask or None, FAISS selector or None) for the live rows matching filters.
+        mask = self.filter_mask(filters)
+        if mask is None:
+            return (None if self._deleted is None else ~self._deleted), self._live_selector
+        if self._deleted is not None:
+            mask = mask & ~self._deleted
+        return mask, self._selector(mask) if mask.any() else None
+
+    def document_counts(self) -> Dict[str, int]:
+        # Live chunks per doc_id, read from the row table without decoding any text.
+        # Under the read lock, so a compaction cannot swap the store halfway through.
+        with self._rw.read():
+            return self._document_counts()
+
+    def _document_counts(self) -> Dict[str, int]:
+        live = None if self._deleted is None else ~self._deleted
+        counts: Dict[str, int] = {}
+        if isinstance(self.chunks, ChunkStore):
+            doc = np.asarray(self.chunks.rows["doc"], dtype=np.int64)
+            per_doc = np.bincount(doc if live is None else doc[live], minlength=len(self.chunks.docs))
+            for entry, n in zip(self.chunks.docs, per_doc.tolist()):
+                if n:
+                    counts[entry[0]] = counts.get(entry[0], 0) + n
+            return counts
+        for i, c in enumerate(self.chunks):
+            if live is None or live[i]:
+                counts[c["doc_id"]] = counts.get(c["doc_id"], 0) + 1
+        return counts
+
+    def tombstone_ratio(self) -> float:
+        if self._deleted is None:
+            return 0.0
+        return float(self._deleted.mean())
+
+    def _require_store(self):
+        if self.index is None or not isinstance(self.chunks, ChunkStore):
+            raise RuntimeError("In-place updates need an index loaded from disk; build and load() it first")
+        self._require_current()
+
+    def _require_current(self):
+        # Updates start from this object's snapshot; if another writer has
+        # published since, applying them would silently drop its changes.
+        if os.path.abspath(snapshots.resolve(self.index_dir)) != os.path.abspath(self.dir):
+            raise RuntimeError(f"{self.index_dir} was rewritten since this index was loaded; load() it again before updating it")
+
+    def _tombstone(self, doc_ids) -> int:
+        rows = self.filter_mask({"doc_id": list(doc_ids)})
+        if self._deleted is not None:
+            rows &= ~self._deleted
+        count = int(rows.sum())
+        if count:
+            with self._rw.write():
+                self._set_deleted(rows if self._deleted is None else self._deleted | rows)
+        return count
+
+    @contextmanager
+    def _replacing(self, doc_ids, appending: bool = False):
+        # Tombstones the live chunks of doc_ids inside a forked snapshot and
+        # yields how many there were. If the block fails, the snapshot is
+        # discarded and those chunks are shown again.
+        deleted = self._deleted
+        with self._snapshot(fork=True, appending=appending):
+            try:
+                yield self._tombstone(doc_ids)
+            except BaseException:
+                with self._rw.write():
+                    current = self._deleted
+                    if current is not None:
+                        # Rows appended before the failure stay visible.
+                        restored = np.zeros(len(current), dtype=bool)
+                        if deleted is not None:
+                            restored[:len(deleted)] = deleted
+                        self._set_deleted(restored)
+                raise
+
+    def _check_append(self, vectors: np.ndarray, chunks: List[Dict]):
+        if vectors.ndim != 2 or len(vectors) != len(chunks):
+            raise ValueError("vectors must be a 2D array with one row per chunk")
+        if vectors.shape[1] != self.index.d:
+            raise ValueError(f"vectors have dimension {vectors.shape[1]}, the index {self.index.d}")
+
+    def _append(self, vectors: np.ndarray, chunks: List[Dict]) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        writer = ChunkStoreWriter(self.store_prefix, append=True)
+        try:
+            writer.append(chunks)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        if self._exact_vectors() is not None:
+            with open(self.vectors_path, "ab") as f:
+                vectors.tofile(f)
+        bm25 = self.bm25.extend(c["text"] for c in chunks) if self.bm25 is not None else None
+        with self._rw.write():
+            ids = self._index_add(vectors)
+            self.chunks = ChunkStore(self.store_prefix, self.index.ntotal)
+            self._exact = self._open_exact()
+            self.bm25 = bm25
+            if self._deleted is not None:
+                self._set_deleted(np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)]))
+        return ids
+
+    def _commit(self, publish: bool):
+        self._write_index()
+        self._save_info()
+        self._save_tombstones()
+        if self.bm25 is not None:
+            self.bm25.save(self.bm25_prefix)
+        if publish:
+            self.publish()
+
+    def add_documents(self, vectors: np.ndarray, chunks: List[Dict], publish: bool = True) -> np.ndarray:
+        """Appends chunks to the loaded index and saves it as a new snapshot;
+        returns their IDs.
+
+        Live chunks of the same doc_ids are deleted first, so re-adding a
+        document replaces it.
+        """
+        with self.write_lock:
+            self._require_store()
+            self._check_append(vectors, chunks)
+            with self._replacing({c["doc_id"] for c in chunks}, appending=True):
+                ids = self._append(vectors, chunks)
+                self._commit(publish)
+        self._maybe_compact()
+        return ids
+
+    def update_document(self, doc_id: str, vectors: np.ndarray, chunks: List[Dict], publish: bool = True) -> np.ndarray:
+        if any(c["doc_id"] != doc_id for c in chunks):
+            raise ValueError(f"All chunks must belong to {doc_id!r}")
+        with self.write_lock:
+            self._require_store()
+            self._check_append(vectors, chunks)
+            with self._replacing([doc_id], appending=True) as count:
+                if not count:
+                    raise KeyError(f"No document {doc_id!r} in the index")
+                ids = self._append(vectors, chunks)
+                self._commit(publish)
+        self._maybe_compact()
+        return ids
+
+    def delete_document(self, doc_id: str, publish: bool = True) -> int:
+        # Tombstones the document's chunks; returns how many were deleted.
+        with self.write_lock:
+            self._require_store()
+            with self._replacing([doc_id]) as count:
+                if not count:
+                    raise KeyError(f"No document {doc_id!r} in the index")
+                self._commit(publish)
+        self._maybe_compact()
+        return count
+
+    def _maybe_compact(self):
+        if not self.compact_threshold or self.tombstone_ratio() < self.compact_threshold:
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._compact_in_background, name="index-compaction")
+        self._compactor.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Warning: index compaction failed: {e}")
+
+    def wait_for_compaction(self):
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def compact(self) -> Optional[np.ndarray]:
+        """Rewrites the index without deleted rows; IDs of the remaining chunks are kept.
+
+        Returns the old row -> new row map (-1 for dropped rows), or None when
+        nothing was deleted. The result is written and published as a new
+        snapshot; searches keep running on the old files until it is swapped in.
+        """
+        with self.write_lock:
+            if self._deleted is None:
+                return None
+            self._require_store()
+            keep = ~self._deleted
+            rows = np.flatnonzero(keep)
+            ids = self.chunk_ids()[rows]
+            exact = self._exact_vectors()
+            faiss = _faiss()
+            base = self._base_index()
+            if self.storage == "binary":
+                if exact is not None:
+                    codes = binarize(np.asarray(exact[rows]))
+                else:
+                    codes = faiss.vector_to_array(base.xb).reshape(-1, base.code_size)[rows]
+                index = with_ids(faiss.IndexBinaryFlat(base.d))
+                index.add_with_ids(codes, ids)
+            else:
+                vectors = np.asarray(exact[rows]) if exact is not None else self.vectors()[rows]
+                empty = faiss.clone_index(base)  # keeps the trained quantizers
+                empty.reset()
+                index = with_ids(empty)
+                index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), ids)
+
+            # Files the rewrite does not produce (the pipeline's manifest) are
+            # carried over from the current snapshot.
+            chunks = self.chunks
+            with self._snapshot(fork=True):
+                writer = ChunkStoreWriter(self.store_prefix)
+                try:
+                    for run in np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1):
+                        if len(run):
+                            writer.append(chunks.span_chunks(int(run[0]), int(run[-1]) + 1))
+                except BaseException:
+                    writer.abort()
+                    raise
+                writer.close()
+                if exact is not None:
+                    np.ascontiguousarray(exact[rows], dtype="float32").tofile(self.vectors_path + ".tmp")
+                    os.replace(self.vectors_path + ".tmp", self.vectors_path)
+                bm25 = self.bm25.select(keep) if self.bm25 is not None else None
+                if bm25 is not None:
+                    bm25.save(self.bm25_prefix)
+                self._write_index(index)
+                with self._rw.write():
+                    self.index = index
+                    self._ids = ids
+                    self._set_deleted(None)
+                    self.chunks = ChunkStore(self.store_prefix, self.index.ntotal)
+                    self._exact = self._open_exact()
+                    self.bm25 = bm25
+                    self.set_search_params()
+                self._save_info()
+                self._save_tombstones()
+            remap = np.full(len(keep), -1, dtype=np.int64)
+            remap[rows] = np.arange(len(rows))
+            if self.on_compact is not None:
+                self.on_compact(remap)
+            self.publish()
+            return remap
+
+    def filter_mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        # Boolean mask over chunk rows for a metadata filter (see filters.MetadataIndex).
+        if not filters:
+            return None
+        md = self._metadata
+        if md is None or md.chunks is not self.chunks or md.size != len(self.chunks):
+            md = self._metadata = MetadataIndex(self.chunks)
+        return md.mask(filters)
+
+    def _search_params(self, selector):
+        # nprobe/efSearch given here override the ParameterSpace values, so pass them again.
+        faiss = _faiss()
+        if _is_ivf(self.index_type):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.params["nprobe"])
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.params["ef_search"])
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, query_vec: np.ndarray, top_k: int, filters: Optional[Dict] = None) -> List[Dict]:
         if query_vec.ndim == 1:
             query_vec = query_vec[None, :]
-        scores, idxs = self.index.search(query_vec.astype("float32"), top_k)
-        results: List[Dict] = []
-        for score, idx in zip(scores[0], idxs[0]):
-            if idx == -1:
-                continue
-            c = self.chunks[idx]
-            results.append({**c, "score": float(score)})
-        return results
+        return self.search_many(query_vec[:1], top_k, filters=filters)[0]
 
+    def search_many(self, query_vecs: np.ndarray, top_k: int, filters: Optional[Dict] = None) -> List[List[Dict]]:
+        # One FAISS call for the whole query matrix; row i of the result holds
+        # the hits for query i. Filters and deletions are applied inside the
+        # FAISS search as an ID bitmap, so top_k is filled from live matching chunks.
+        if self.index is None:
+            raise RuntimeError("Index not loaded")
+        if query_vecs.ndim != 2:
+            raise ValueError("query_vecs must be 2D array")
+        query_vecs = np.ascontiguousarray(query_vecs, dtype="float32")
+        with self._rw.read():
+            return self._search_many(query_vecs, top_k, filters)
 
+    def _search_many(self, query_vecs: np.ndarray, top_k: int, filters: Optional[Dict]) -> List[List[Dict]]:
+        mask, selector = self._selection(filters)
+        if mask is not None and selector is None:
+            return [[] for _ in query_vecs]
+        params = None if selector is None else self._search_params(selector)
+        exact = self._exact_vectors()
+        rescore = exact is not None and self.params["rescore_factor"] > 0
+        k = top_k * self.params["rescore_factor"] if rescore else top_k
+        if self.storage == "binary":
+            scores, idxs = self.index.search(binarize(query_vecs), k, params=params)
+            # Hamming distance -> rough cosine estimate when not re-scored.
+            scores = 1.0 - 2.0 * scores.astype("float32") / self.index.d
+        else:
+            scores, idxs = self.index.search(query_vecs, k, params=params)
+        idxs = self._rows(idxs)
+        if rescore:
+            scores, idxs = self._rescore(exact, query_vecs, idxs, top_k)
+        ids = self.chunk_ids()
+        results: List[List[Dict]] = []
+        for row_scores, row_idxs in zip(scores, idxs):
+            hits: List[Dict] = []
+            for score, idx in zip(row_scores, row_idxs):
+                if idx == -1:
+                    continue
+                c = self.chunks[idx]
+                hits.append({**c, "id": int(ids[idx]), "score": float(score)})
+            results.append(hits)
+        return results
+
+    @staticmethod
+    def _rescore(exact: np.ndarray, query_vecs: np.ndarray, idxs: np.ndarray, top_k: int):
+        # Exact inner products over each query's shortlist, re-sorted.
+        out_scores = np.full((len(idxs), top_k), -np.inf, dtype="float32")
+        out_idxs = np.full((len(idxs), top_k), -1, dtype="int64")
+        for row, (q, cand) in enumerate(zip(query_vecs, idxs)):
+            cand = np.sort(cand[cand >= 0])  # sorted rows read the memmap sequentially
+            if not len(cand):
+                continue
+            sims = np.asarray(exact[cand]) @ q
+            order = np.argsort(-sims, kind="stable")[:top_k]
+            out_scores[row, :len(order)] = sims[order]
+            out_idxs[row, :len(order)] = cand[order]
+        return out_scores, out_idxs
 
+    def search_lexical(self, query: str, top_k: int, filters: Optional[Dict] = None) -> List[Dict]:
+        if self.bm25 is None:
+            raise RuntimeError("No BM25 index loaded; rebuild the index to enable lexical retrieval")
+        with self._rw.read():
+            mask, _ = self._selection(filters)
+            scores, idxs = self.bm25.search(query, top_k, mask=mask)
+            ids = self.chunk_ids()
+            return [{**self.chunks[int(i)], "id": int(ids[i]), "score": float(s)} for s, i in zip(scores, idxs)]
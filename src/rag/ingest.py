@@ -1,61 +1,184 @@
+import io
 import os
-from typing import Dict, Iterable, List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Deque, Dict, Iterable, List, Optional, Tuple, Union
 from pypdf import PdfReader
 
 
+SUPPORTED_EXTENSIONS = (".txt", ".pdf")
+# PDFs at least this big are probed for their page count and, when long
+# enough, have their pages extracted by several workers.
+LARGE_PDF_BYTES = 8 * 1024 * 1024
+
+
 def load_txt(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
 
 
-def load_pdf(file_path: str) -> str:
+def _source_name(source: Union[str, BinaryIO]) -> str:
+    return source if isinstance(source, str) else getattr(source, "name", "<in-memory file>")
+
+
+def extract_pdf_pages(file_path: Union[str, BinaryIO], start: int = 0, end: Optional[int] = None) -> List[str]:
+    # file_path may also be a binary stream (see load_document_bytes).
+    reader = PdfReader(file_path)
+    end = len(reader.pages) if end is None else min(end, len(reader.pages))
+    pages = []
+    for i in range(start, end):
+        try:
+            text = reader.pages[i].extract_text()
+            if text:
+                pages.append(text)
+        except Exception as e:
+            print(f"Warning: Could not extract text from page {i+1} of {_source_name(file_path)}: {e}")
+    return pages
+
+
+def load_pdf(file_path: Union[str, BinaryIO]) -> str:
+    name = _source_name(file_path)
     try:
-        reader = PdfReader(file_path)
-        pages = []
-        for i, page in enumerate(reader.pages):
-            try:
-                text = page.extract_text()
-                if text:
-                    pages.append(text)
-            except Exception as e:
-                print(f"Warning: Could not extract text from page {i+1} of {file_path}: {e}")
+        pages = extract_pdf_pages(file_path)
         if not pages:
-            raise ValueError(f"No text could be extracted from PDF: {file_path}")
+            raise ValueError(f"No text could be extracted from PDF: {name}")
         return "\n".join(pages)
     except Exception as e:
-        raise ValueError(f"Failed to read PDF {file_path}: {e}")
+        raise ValueError(f"Failed to read PDF {name}: {e}")
 
 
-def iter_documents(docs_dir: str) -> Iterable[Dict]:
+def iter_document_paths(docs_dir: str) -> Iterable[str]:
     for root, _, files in os.walk(docs_dir):
         for name in files:
-            lower = name.lower()
-            path = os.path.join(root, name)
-            if lower.endswith(".txt"):
-                try:
-                    text = load_txt(path)
-                    if not text.strip():
-                        print(f"Warning: {path} is empty, skipping")
-                        continue
-                except Exception as e:
-                    print(f"Error loading {path}: {e}")
-                    continue
-            elif lower.endswith(".pdf"):
-                try:
-                    text = load_pdf(path)
-                    if not text.strip():
-                        print(f"Warning: {path} appears empty (no text extracted), skipping")
-                        continue
-                except Exception as e:
-                    print(f"Error loading PDF {path}: {e}")
-                    continue
-            else:
-                continue
-            yield {"id": os.path.relpath(path, docs_dir), "source_path": path, "text": text}
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def _make_document(path: str, docs_dir: Optional[str], text: str) -> Optional[Dict]:
+    # docs_dir None: path is an in-memory file's name, used as its doc_id.
+    if not text.strip():
+        if path.lower().endswith(".pdf"):
+            print(f"Warning: {path} appears empty (no text extracted), skipping")
+        else:
+            print(f"Warning: {path} is empty, skipping")
+        return None
+    if docs_dir is None:
+        return {"id": path, "source_path": None, "text": text}
+    return {"id": os.path.relpath(path, docs_dir), "source_path": path, "text": text}
+
+
+def load_document(path: str, docs_dir: str) -> Optional[Dict]:
+    lower = path.lower()
+    if lower.endswith(".txt"):
+        try:
+            text = load_txt(path)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None
+    elif lower.endswith(".pdf"):
+        try:
+            text = load_pdf(path)
+        except Exception as e:
+            print(f"Error loading PDF {path}: {e}")
+            return None
+    else:
+        return None
+    return _make_document(path, docs_dir, text)
+
+
+def load_document_bytes(name: str, data: bytes) -> Optional[Dict]:
+    """load_document for a file held in memory, e.g. a Streamlit upload
+    (``UploadedFile.getbuffer()``); nothing is written to disk.
+
+    ``name`` becomes the doc_id and the document has no source_path.
+    """
+    lower = name.lower()
+    if lower.endswith(".txt"):
+        text = bytes(data).decode("utf-8", errors="ignore")
+    elif lower.endswith(".pdf"):
+        stream = io.BytesIO(data)
+        stream.name = name
+        try:
+            text = load_pdf(stream)
+        except Exception as e:
+            print(f"Error loading PDF {name}: {e}")
+            return None
+    else:
+        return None
+    return _make_document(name, None, text)
 
 
-def load_corpus(docs_dir: str) -> List[Dict]:
-    return list(iter_documents(docs_dir))
+def _pdf_page_ranges(path: str, pages_per_task: int) -> Optional[List[Tuple[int, int]]]:
+    if not path.lower().endswith(".pdf") or os.path.getsize(path) < LARGE_PDF_BYTES:
+        return None
+    try:
+        n_pages = len(PdfReader(path).pages)
+    except Exception:
+        # Let the regular loader report the error.
+        return None
+    if n_pages <= pages_per_task:
+        return None
+    return [(s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task)]
+
+
+def _join_pdf_parts(path: str, docs_dir: str, parts: List[Future]) -> Optional[Dict]:
+    try:
+        pages = [p for f in parts for p in f.result()]
+        if not pages:
+            raise ValueError(f"No text could be extracted from PDF: {path}")
+    except Exception as e:
+        # Same message load_document prints for a failed load_pdf.
+        print(f"Error loading PDF {path}: Failed to read PDF {path}: {e}")
+        return None
+    return _make_document(path, docs_dir, "\n".join(pages))
+
+
+def iter_loaded(
+    paths: Iterable[str],
+    docs_dir: str,
+    workers: int = 0,
+    max_in_flight: int = 0,
+    pdf_pages_per_task: int = 64,
+) -> Iterable[Tuple[str, Optional[Dict]]]:
+    # Yields (path, document or None) in input order. With workers > 1 files
+    # are parsed by a process pool and large PDFs are split into page ranges;
+    # at most max_in_flight files are submitted ahead of the consumer.
+    if workers <= 1:
+        for path in paths:
+            yield path, load_document(path, docs_dir)
+        return
+
+    max_in_flight = max_in_flight or workers * 2
+    executor = ProcessPoolExecutor(max_workers=workers)
+    in_flight: Deque[Tuple[str, List[Future], bool]] = deque()
+
+    def drain_one():
+        path, futures, split = in_flight.popleft()
+        if split:
+            return path, _join_pdf_parts(path, docs_dir, futures)
+        return path, futures[0].result()
+
+    try:
+        for path in paths:
+            ranges = _pdf_page_ranges(path, pdf_pages_per_task)
+            if ranges:
+                futures = [executor.submit(extract_pdf_pages, path, s, e) for s, e in ranges]
+            else:
+                futures = [executor.submit(load_document, path, docs_dir)]
+            in_flight.append((path, futures, bool(ranges)))
+            if len(in_flight) >= max_in_flight:
+                yield drain_one()
+        while in_flight:
+            yield drain_one()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
 
+def iter_documents(docs_dir: str, workers: int = 0, max_in_flight: int = 0) -> Iterable[Dict]:
+    for _, doc in iter_loaded(iter_document_paths(docs_dir), docs_dir, workers=workers, max_in_flight=max_in_flight):
+        if doc is not None:
+            yield doc
 
 
+def load_corpus(docs_dir: str, workers: int = 0) -> List[Dict]:
+    return list(iter_documents(docs_dir, workers=workers))
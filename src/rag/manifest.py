@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_entry(path: str, docs_dir: str, sha256: str = None) -> Dict:
+    st = os.stat(path)
+    return {
+        "path": os.path.relpath(path, docs_dir),
+        "source_path": path,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha256": sha256 or file_sha256(path),
+        "chunk_start": 0,
+        "chunk_end": 0,
+    }
+
+
+def bytes_entry(name: str, data: bytes) -> Dict:
+    # Entry for an in-memory file (see RagPipeline.add_uploads): no file to
+    # stat, so re-uploads are recognised by content hash alone.
+    return {
+        "path": name,
+        "source_path": None,
+        "size": len(data),
+        "mtime": None,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "chunk_start": 0,
+        "chunk_end": 0,
+    }
+
+
+def _read(manifest_path: str) -> Dict:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict]:
+    return {e["path"]: e for e in _read(manifest_path).get("files", [])}
+
+
+def load_settings(manifest_path: str) -> Dict:
+    # Build settings the stored chunks and vectors were made with ({} for
+    # manifests written before they were recorded).
+    return _read(manifest_path).get("settings", {})
+
+
+def save_manifest(manifest_path: str, entries: List[Dict], settings: Optional[Dict] = None):
+    # settings=None keeps the recorded ones (in-place updates of an existing index).
+    if settings is None:
+        settings = load_settings(manifest_path)
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    # Replaced, not rewritten: the manifest may be hard-linked into an older index snapshot.
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "settings": settings, "files": entries}, f, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def plan_incremental(paths: Iterable[str], docs_dir: str, previous: Dict[str, Dict]) -> Tuple[List[Tuple[str, Dict]], List[str]]:
+    """Classify files against the previous manifest.
+
+    Returns ``(plan, deleted)`` where ``plan`` holds one ``(action, entry)`` pair
+    per current file in walk order. ``action`` is ``"skip"`` (unchanged, entry
+    carries the previous chunk range), ``"add"`` or ``"change"``. Size and mtime
+    are checked first so unchanged files are never re-hashed.
+    """
+    plan: List[Tuple[str, Dict]] = []
+    seen = set()
+    for path in paths:
+        rel = os.path.relpath(path, docs_dir)
+        seen.add(rel)
+        prev = previous.get(rel)
+        st = os.stat(path)
+        if prev and prev["size"] == st.st_size and prev["mtime"] == st.st_mtime:
+            plan.append(("skip", dict(prev, source_path=path)))
+            continue
+        entry = file_entry(path, docs_dir)
+        if prev and prev["sha256"] == entry["sha256"]:
+            # Touched but identical content: keep the vectors, refresh the stat.
+            entry["chunk_start"], entry["chunk_end"] = prev["chunk_start"], prev["chunk_end"]
+            if prev.get("collapsed_into"):
+                # Its collapsed chunks still live in those files' rows.
+                entry["collapsed_into"] = list(prev["collapsed_into"])
+            plan.append(("skip", entry))
+        else:
+            plan.append(("change" if prev else "add", entry))
+    deleted = [rel for rel in previous if rel not in seen]
+    return plan, deleted
@@ -0,0 +1,180 @@
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# Histogram buckets (seconds) for the Prometheus stage-latency metric.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Timings:
+    """Stage durations (summed per name) and counters for one request or batch.
+
+    Spans may be recorded from worker threads (generation engine, streamer),
+    hence the lock.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other: "Timings"):
+        for name, seconds in list(other.spans.items()):
+            self.add(name, seconds)
+        for name, n in list(other.counts.items()):
+            self.count(name, n)
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "stages_ms": {k: round(v * 1000, 3) for k, v in self.spans.items()},
+                "counts": dict(self.counts),
+            }
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("rag_timings", default=None)
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def current() -> Optional[Timings]:
+    return _current.get()
+
+
+def span(name: str):
+    # Times the with-block into the active Timings; a shared no-op otherwise,
+    # so instrumented code costs one context-variable lookup when profiling is off.
+    timings = _current.get()
+    if timings is None:
+        return _NULL_SPAN
+    return _Span(timings, name)
+
+
+def count(name: str, n: int = 1):
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, n)
+
+
+def timed(name: str, fn: Callable) -> Callable:
+    # fn wrapped in a span when profiling is active, fn itself otherwise.
+    timings = _current.get()
+    if timings is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        with _Span(timings, name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def recording(timings: Optional[Timings]) -> Iterator[Optional[Timings]]:
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+class MetricsSink:
+    """Receives the Timings of every profiled pipeline operation.
+
+    Subclass and override ``observe``/``increment`` (or ``record``) to forward
+    to a monitoring system; see PrometheusSink.
+    """
+
+    def observe(self, operation: str, stage: str, seconds: float):
+        pass
+
+    def increment(self, operation: str, name: str, value: int):
+        pass
+
+    def record(self, operation: str, timings: Timings):
+        self.observe(operation, "total", time.perf_counter() - timings.started)
+        for stage, seconds in list(timings.spans.items()):
+            self.observe(operation, stage, seconds)
+        for name, value in list(timings.counts.items()):
+            self.increment(operation, name, value)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class PrometheusSink(MetricsSink):
+    """Aggregates into a stage-latency histogram and counters, rendered in the
+    Prometheus text exposition format (served at /metrics by the HTTP server)."""
+
+    def __init__(self, namespace: str = "rag", buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (operation, stage) -> [bucket counts..., sum, count]
+        self._hist: Dict[Tuple[str, str], List[float]] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+
+    def observe(self, operation: str, stage: str, seconds: float):
+        with self._lock:
+            h = self._hist.get((operation, stage))
+            if h is None:
+                h = self._hist[(operation, stage)] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def increment(self, operation: str, name: str, value: int):
+        with self._lock:
+            by_op = self._counters.setdefault(_metric_name(name), {})
+            by_op[operation] = by_op.get(operation, 0) + value
+
+    def render(self) -> str:
+        ns = self.namespace
+        name = f"{ns}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent per pipeline stage.", f"# TYPE {name} histogram"]
+        with self._lock:
+            for (operation, stage), h in sorted(self._hist.items()):
+                labels = f'operation="{operation}",stage="{stage}"'
+                for bound, n in zip(self.buckets, h):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {n:g}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h[-1]:g}')
+                lines.append(f"{name}_sum{{{labels}}} {h[-2]:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {h[-1]:g}")
+            for counter, by_op in sorted(self._counters.items()):
+                full = f"{ns}_{counter}_total"
+                lines += [f"# HELP {full} Pipeline counter {counter}.", f"# TYPE {full} counter"]
+                for operation, value in sorted(by_op.items()):
+                    lines.append(f'{full}{{operation="{operation}"}} {value:g}')
+        return "\n".join(lines) + "\n"
@@ -1,61 +1,837 @@
+import bisect
 import json
 import os
-from typing import Dict, List
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 
+from .bm25 import reciprocal_rank_fusion
 from .config import RagConfig
-from .ingest import load_corpus
+from .dedup import DUPLICATES_KEY, NearDuplicateIndex, collapse, drop_references, find_duplicates, source_ref
+from .ingest import iter_document_paths, iter_loaded, load_document, load_document_bytes
 from .chunk import chunk_documents
+from .chunk_store import ChunkStore
 from .embeddings import EmbeddingModel
 from .index_faiss import FaissIndex
-from .retriever import format_context
+from .manifest import bytes_entry, file_entry, load_manifest, load_settings, plan_incremental, save_manifest
+from . import metrics, snapshots
+from .metrics import MetricsSink, Timings
+from .retriever import format_context, pack_context
+from .sharded import ShardedIndex
 from .generator import LocalGenerator, OpenAIGenerator, build_prompt
 
 
 class RagPipeline:
     def __init__(self, config: RagConfig):
+        # Embedder and generator are created on first use, so e.g. `build`
+        # never loads a generator and retrieval-only services never import it.
         self.cfg = config
-        self.embedder = EmbeddingModel(config.embed_model_name)
-        self.index = FaissIndex(
-            index_dir=config.index_dir,
+        self._embedder: Optional[EmbeddingModel] = None
+        self._generator = None
+        self.load_timings: Dict[str, float] = {}
+        # Receives per-stage timings of every retrieve/answer call when set
+        # (e.g. metrics.PrometheusSink); profiling is off while this is None
+        # and cfg.profile is False.
+        self.metrics: Optional[MetricsSink] = None
+        self._warned_no_bm25 = False
+        self.index = self.make_index(config.index_dir)
+
+    def make_index(self, index_dir: str) -> FaissIndex:
+        config = self.cfg
+        return FaissIndex(
+            index_dir=index_dir,
             faiss_index_filename=config.faiss_index_filename,
             metadata_filename=config.metadata_filename,
+            chunk_store_prefix=config.chunk_store_prefix,
+            index_type=config.index_type,
+            lexical=config.lexical_index,
+            compact_threshold=config.compact_threshold,
+            keep_snapshots=config.snapshot_keep,
+            index_params={
+                "nlist": config.index_nlist,
+                "pq_m": config.index_pq_m,
+                "pq_nbits": config.index_pq_nbits,
+                "hnsw_m": config.index_hnsw_m,
+                "train_sample_size": config.index_train_sample_size,
+                "storage": config.index_storage,
+                "rescore_factor": config.index_rescore_factor,
+                **({"nprobe": config.nprobe} if config.nprobe is not None else {}),
+                **({"ef_search": config.ef_search} if config.ef_search is not None else {}),
+            },
+        )
+
+    def sharded_index(self) -> ShardedIndex:
+        return ShardedIndex(
+            self.cfg.index_dir,
+            self.make_index,
+            manifest_filename=self.cfg.shards_filename,
+            max_workers=self.cfg.shard_search_workers,
         )
 
-        # Select generator backend
-        backend = config.generator_backend
-        if backend == "auto":
-            if os.environ.get("OPENAI_API_KEY"):
-                backend = "openai"
+    @property
+    def offline(self) -> bool:
+        return self.cfg.offline or os.environ.get("HF_HUB_OFFLINE") == "1"
+
+    @property
+    def embedder(self) -> EmbeddingModel:
+        if self._embedder is None:
+            self._embedder = EmbeddingModel(
+                self.cfg.embed_model_name,
+                cache_dir=self.cfg.embed_cache_dir,
+                cache_max_entries=self.cfg.embed_cache_max_entries,
+                offline=self.offline,
+                batch_size=self.cfg.embed_batch_size,
+                workers=self.cfg.embed_workers,
+                threads_per_worker=self.cfg.embed_threads_per_worker,
+            )
+        return self._embedder
+
+    @embedder.setter
+    def embedder(self, embedder):
+        self._embedder = embedder
+
+    @property
+    def generator(self):
+        return self.load_generator()
+
+    @generator.setter
+    def generator(self, generator):
+        self._generator = generator
+
+    def load_generator(self):
+        if self._generator is None:
+            if self.cfg.retrieval_only:
+                raise RuntimeError("Generation is disabled: pipeline is in retrieval-only mode")
+            started = time.perf_counter()
+            # Select generator backend
+            backend = self.cfg.generator_backend
+            if backend == "auto":
+                if os.environ.get("OPENAI_API_KEY"):
+                    backend = "openai"
+                else:
+                    backend = "local"
+            if backend == "openai":
+                self._generator = OpenAIGenerator(model="gpt-4o-mini")
             else:
-                backend = "local"
-        if backend == "openai":
-            self.generator = OpenAIGenerator(model="gpt-4o-mini")
-        else:
-            self.generator = LocalGenerator(model_name=config.generator_model)
+                self._generator = LocalGenerator(
+                    model_name=self.cfg.generator_model,
+                    batch_size=self.cfg.generator_batch_size,
+                    max_wait_ms=self.cfg.generator_max_wait_ms,
+                    offline=self.offline,
+                )
+            self.load_timings["generator_s"] = time.perf_counter() - started
+        return self._generator
 
-    def build_index(self, docs_dir: str):
-        docs = load_corpus(docs_dir)
-        chunks = chunk_documents(docs, self.cfg.chunk_size_words, self.cfg.chunk_overlap_words)
-        vectors = self.embedder.encode([c["text"] for c in chunks])
-        self.index.build(vectors, chunks)
-        self.index.save()
+    def warmup(self):
+        # Load everything a query needs up front (used by long-running servers).
+        self.embedder.load()
+        if not self.cfg.retrieval_only:
+            self.load_generator()
+
+    def startup_report(self) -> Dict:
+        embedder = self._embedder
+        timings = dict(self.load_timings)
+        if getattr(embedder, "load_seconds", None) is not None:
+            timings["embedder_s"] = embedder.load_seconds
+        return {
+            "embedder_loaded": embedder is not None and getattr(embedder, "loaded", True),
+            "generator_loaded": self._generator is not None,
+            "index_loaded": self.index.index is not None,
+            "retrieval_only": self.cfg.retrieval_only,
+            "offline": self.offline,
+            "timings_s": {k: round(v, 4) for k, v in timings.items()},
+        }
+
+    def _ingest_options(self) -> Dict:
+        return {
+            "workers": self.cfg.ingest_workers,
+            "max_in_flight": self.cfg.ingest_max_in_flight,
+            "pdf_pages_per_task": self.cfg.pdf_pages_per_task,
+        }
+
+    @property
+    def manifest_path(self) -> str:
+        # The manifest is saved inside the index snapshot it describes.
+        directory = self.index.dir if isinstance(self.index, FaissIndex) else self.cfg.index_dir
+        return os.path.join(directory, self.cfg.manifest_filename)
+
+    def build_settings(self) -> Dict:
+        # Settings stored chunks and vectors depend on; recorded in the manifest.
+        return {
+            "chunk_size_words": self.cfg.chunk_size_words,
+            "chunk_overlap_words": self.cfg.chunk_overlap_words,
+            "embed_model_name": self.cfg.embed_model_name,
+        }
+
+    def build_index(
+        self,
+        docs_dir: str,
+        incremental: bool = False,
+        streaming: bool = False,
+        progress: Optional[Callable[[Dict], None]] = None,
+    ) -> Dict:
+        if ShardedIndex.is_sharded(self.cfg.index_dir, self.cfg.shards_filename):
+            raise ValueError(f"{self.cfg.index_dir} is a sharded index; build shards with `app.py shard add`")
+        if streaming and incremental:
+            raise ValueError("streaming and incremental builds cannot be combined")
+        embedder = self.embedder
+        if hasattr(embedder, "stats"):
+            embedder.stats = {"chunks": 0, "seconds": 0.0}
+        try:
+            report = self._build_streaming(docs_dir, progress) if streaming else self._build(docs_dir, incremental)
+        finally:
+            # Embedding worker processes each hold a model copy; release them.
+            if hasattr(embedder, "close"):
+                embedder.close()
+        if hasattr(embedder, "throughput"):
+            report["embedding"] = embedder.throughput()
+        return report
+
+    def _build(self, docs_dir: str, incremental: bool) -> Dict:
+        # Incremental builds reuse vectors of files whose manifest entry still
+        # matches (size+mtime, falling back to the content hash). The result is
+        # written to a new snapshot and published together with its manifest.
+        previous = {}
+        if incremental:
+            try:
+                self.index.load()
+            except FileNotFoundError:
+                pass
+            else:
+                previous = load_manifest(self.manifest_path)
+        settings_changed = []
+        if previous:
+            recorded = load_settings(self.manifest_path)
+            settings_changed = [k for k, v in self.build_settings().items() if k in recorded and recorded[k] != v]
+            if settings_changed:
+                # Stored chunks/vectors no longer match what this build would make.
+                print(f"Note: {', '.join(settings_changed)} changed since the last build; rebuilding the index from scratch")
+                previous = {}
+
+        plan, deleted = plan_incremental(iter_document_paths(docs_dir), docs_dir, previous)
+        report = {"added": [], "changed": [], "skipped": [], "deleted": deleted, "embedded_chunks": 0}
+        if settings_changed:
+            report["settings_changed"] = settings_changed
+        labels = {"add": "added", "change": "changed", "skip": "skipped"}
+        for action, entry in plan:
+            report[labels[action]].append(entry["path"])
+
+        if previous and not deleted and not report["added"] and not report["changed"]:
+            backfilled = self.index.ensure_bm25(publish=False)
+            # Only refreshed stat info otherwise, which readers never look at.
+            save_manifest(self.manifest_path, [e for _, e in plan], self.build_settings())
+            if backfilled:
+                self.index.publish()
+            report["total_chunks"] = len(self.index.chunks)
+            return report
+
+        # Files with chunks collapsed into a file that is re-chunked or deleted
+        # now would lose those chunks: process them again as well.
+        reprocessed = self._requeue_collapsed(plan, set(report["changed"]) | set(deleted))
+        if previous and not self.index.has_exact_vectors():
+            # PQ indexes saved without vectors.f32: re-quantizing their lossy
+            # reconstructions would lose more recall with every build.
+            requeued = [entry["path"] for action, entry in plan if action == "skip"]
+            if requeued:
+                print(f"Warning: {self.cfg.index_dir} stores only approximate vectors; re-embedding {len(requeued)} unchanged file(s) once")
+                plan[:] = [("change" if action == "skip" else action, entry) for action, entry in plan]
+                reprocessed += requeued
+        if reprocessed:
+            report["skipped"] = [p for p in report["skipped"] if p not in reprocessed]
+            report["reprocessed"] = reprocessed
+        stale = set(report["changed"]) | set(deleted) | set(reprocessed)
+
+        old_chunks = self.index.chunks if previous else []
+        old_vectors = self.index.vectors() if any(action == "skip" for action, _ in plan) else None
+        to_load = [entry["source_path"] for action, entry in plan if action != "skip"]
+        loaded = iter_loaded(to_load, docs_dir, **self._ingest_options())
+        segments = []
+        for action, entry in plan:
+            if action == "skip":
+                s, e = entry["chunk_start"], entry["chunk_end"]
+                kept = old_chunks.span_chunks(s, e) if isinstance(old_chunks, ChunkStore) else old_chunks[s:e]
+                if stale:
+                    kept = [drop_references(c, stale) for c in kept]
+                segments.append((entry, kept, old_vectors[s:e]))
+                continue
+            _, doc = next(loaded)
+            chunks = chunk_documents([doc], self.cfg.chunk_size_words, self.cfg.chunk_overlap_words) if doc else []
+            entry.pop("collapsed_into", None)
+            segments.append((entry, chunks, None))
+        loaded.close()
+        if self.cfg.dedup_chunks:
+            segments, report["dedup"] = self._collapse_segments(segments)
+        pending = [c for _, chunks, vecs in segments if vecs is None for c in chunks]
+
+        new_vectors = self.embedder.encode([c["text"] for c in pending]) if pending else None
+        report["embedded_chunks"] = len(pending)
+        if self.embedder.cache is not None:
+            report["embed_cache"] = self.embedder.cache.stats()
+
+        all_chunks: List[Dict] = []
+        all_vectors: List[np.ndarray] = []
+        entries: List[Dict] = []
+        offset = 0
+        for entry, chunks, vecs in segments:
+            if vecs is None:
+                vecs = new_vectors[offset:offset + len(chunks)] if chunks else None
+                offset += len(chunks)
+            entry["chunk_start"] = len(all_chunks)
+            all_chunks.extend(chunks)
+            entry["chunk_end"] = len(all_chunks)
+            if chunks:
+                all_vectors.append(vecs)
+            entries.append(entry)
+        if not all_chunks:
+            raise ValueError(f"No text chunks could be produced from {docs_dir}")
+
+        self.index.build(np.vstack(all_vectors), all_chunks)
+        self.index.save(publish=False)
+        save_manifest(self.manifest_path, entries, self.build_settings())
+        self.index.publish()
+        report["total_chunks"] = len(all_chunks)
+        return report
+
+    @staticmethod
+    def _requeue_collapsed(plan: List[Tuple[str, Dict]], affected: set) -> List[str]:
+        # Turns "skip" into "change" for files whose collapsed chunks live in
+        # an affected file, transitively; returns their paths.
+        requeued: List[str] = []
+        while True:
+            found = [k for k, (action, entry) in enumerate(plan)
+                     if action == "skip" and affected.intersection(entry.get("collapsed_into", ()))]
+            if not found:
+                return requeued
+            for k in found:
+                entry = plan[k][1]
+                plan[k] = ("change", entry)
+                affected.add(entry["path"])
+                requeued.append(entry["path"])
+
+    def _collapse_segments(self, segments: List[Tuple]) -> Tuple[List[Tuple], Dict]:
+        # Collapses near-duplicate chunks across the whole build. Chunks with
+        # stored vectors are registered first so those vectors stay in use.
+        # Each file's "collapsed_into" lists the files whose rows hold its
+        # collapsed chunks.
+        flat: List[Dict] = []
+        owner: List[int] = []
+        reused: List[bool] = []
+        for k, (_, chunks, vecs) in enumerate(segments):
+            flat.extend(chunks)
+            owner += [k] * len(chunks)
+            reused += [vecs is not None] * len(chunks)
+        order = sorted(range(len(flat)), key=lambda i: not reused[i])
+        reps = find_duplicates([c["text"] for c in flat], NearDuplicateIndex(self.cfg.dedup_threshold), order)
+        merged = collapse(flat, reps)
+        out = []
+        start = 0
+        for k, (entry, chunks, vecs) in enumerate(segments):
+            end = start + len(chunks)
+            keep = reps[start:end] == np.arange(start, end)
+            # Reused files keep the holders of chunks collapsed in earlier builds.
+            holders = set(entry.get("collapsed_into", ())) if vecs is not None else set()
+            holders.update(segments[owner[r]][0]["path"] for r in reps[start:end][~keep].tolist() if owner[r] != k)
+            if holders:
+                entry["collapsed_into"] = sorted(holders)
+            else:
+                entry.pop("collapsed_into", None)
+            out.append((entry, [c for c in merged[start:end] if c is not None], vecs[keep] if vecs is not None else None))
+            start = end
+        collapsed = int((reps != np.arange(len(reps))).sum())
+        return out, {"chunks": len(flat), "collapsed": collapsed}
+
+    def _build_streaming(self, docs_dir: str, progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        # ingest -> chunk -> embed -> index in batches of cfg.build_batch_size
+        # chunks; memory stays bounded by one batch plus one document.
+        batch_size = self.cfg.build_batch_size
+        stats = {"documents": 0, "chunks": 0, "batches": 0, "elapsed_s": 0.0, "docs_per_s": 0.0, "chunks_per_s": 0.0}
+        started = time.perf_counter()
+        entries: List[Dict] = []
+        pending: List[Dict] = []
+        # Dedup spans the whole build: rows already flushed get the references
+        # of their later duplicates when the stream is closed.
+        near = NearDuplicateIndex(self.cfg.dedup_threshold) if self.cfg.dedup_chunks else None
+        late_refs: Dict[int, List[Dict]] = {}
+        starts: List[int] = []
+        collapsed = 0
+
+        def flush(batch: List[Dict]):
+            vectors = self.embedder.encode([c["text"] for c in batch])
+            self.index.add(vectors, batch)
+            stats["chunks"] += len(batch)
+            stats["batches"] += 1
+            elapsed = time.perf_counter() - started
+            stats["elapsed_s"] = elapsed
+            stats["docs_per_s"] = stats["documents"] / elapsed if elapsed else 0.0
+            stats["chunks_per_s"] = stats["chunks"] / elapsed if elapsed else 0.0
+            if progress:
+                progress(dict(stats))
+
+        self.index.open_stream()
+        try:
+            for path, doc in iter_loaded(iter_document_paths(docs_dir), docs_dir, **self._ingest_options()):
+                entry = file_entry(path, docs_dir)
+                entry["chunk_start"] = stats["chunks"] + len(pending)
+                if doc is not None:
+                    stats["documents"] += 1
+                    chunks = chunk_documents([doc], self.cfg.chunk_size_words, self.cfg.chunk_overlap_words)
+                    if near is None:
+                        pending.extend(chunks)
+                    else:
+                        holders = set()
+                        for c in chunks:
+                            match = near.find(stats["chunks"] + len(pending), c["text"])
+                            if match is None:
+                                pending.append(c)
+                                continue
+                            collapsed += 1
+                            late_refs.setdefault(match, []).append(source_ref(c))
+                            if match < entry["chunk_start"]:
+                                holders.add(entries[bisect.bisect_right(starts, match) - 1]["path"])
+                        if holders:
+                            entry["collapsed_into"] = sorted(holders)
+                entry["chunk_end"] = stats["chunks"] + len(pending)
+                starts.append(entry["chunk_start"])
+                entries.append(entry)
+                while len(pending) >= batch_size:
+                    batch = pending[:batch_size]
+                    del pending[:batch_size]
+                    flush(batch)
+            if pending:
+                flush(pending)
+        except BaseException:
+            self.index.abort_stream()
+            raise
+        if stats["chunks"] == 0:
+            self.index.abort_stream()
+            raise ValueError(f"No text chunks could be produced from {docs_dir}")
+        self.index.close_stream({row: {DUPLICATES_KEY: refs} for row, refs in late_refs.items()}, publish=False)
+        save_manifest(self.manifest_path, entries, self.build_settings())
+        self.index.publish()
+
+        report = {
+            "added": [e["path"] for e in entries],
+            "changed": [],
+            "skipped": [],
+            "deleted": [],
+            "embedded_chunks": stats["chunks"],
+            "total_chunks": stats["chunks"],
+            "throughput": stats,
+        }
+        if near is not None:
+            report["dedup"] = {"chunks": stats["chunks"] + collapsed, "collapsed": collapsed}
+        if self.embedder.cache is not None:
+            report["embed_cache"] = self.embedder.cache.stats()
+        return report
 
     def load_index(self):
+        started = time.perf_counter()
+        if ShardedIndex.is_sharded(self.cfg.index_dir, self.cfg.shards_filename):
+            self.index = self.sharded_index()
         self.index.load()
+        if isinstance(self.index, FaissIndex):
+            self.index.on_compact = self._remap_manifest
+        self.load_timings["index_s"] = time.perf_counter() - started
+        # Explicit search-time knobs override what was saved with the index.
+        self.index.set_search_params(nprobe=self.cfg.nprobe, ef_search=self.cfg.ef_search)
 
-    def retrieve(self, question: str, top_k: int = None) -> List[Dict]:
-        top_k = top_k or self.cfg.top_k
-        q_vec = self.embedder.encode([question])[0]
-        return self.index.search(q_vec, top_k=top_k)
+    def _updatable_index(self) -> FaissIndex:
+        if ShardedIndex.is_sharded(self.cfg.index_dir, self.cfg.shards_filename):
+            raise ValueError(f"{self.cfg.index_dir} is a sharded index; rebuild the shard with `app.py shard add`")
+        if self.index.index is not None and self.index.dir != snapshots.resolve(self.cfg.index_dir):
+            # Another writer has published since this index was loaded: continue
+            # on a fresh object, the stale one may still be serving searches.
+            self.index = self.make_index(self.cfg.index_dir)
+        if self.index.index is None:
+            self.load_index()
+        return self.index
+
+    def add_documents(self, paths: List[str], docs_dir: str) -> Dict:
+        """Embeds just these files and appends them to the live index in place.
+
+        Files that are already indexed are replaced (their old chunks are
+        tombstoned). doc_ids are paths relative to docs_dir, as in build_index.
+        """
+        return self._upsert(paths, docs_dir, update=False)
+
+    def update_document(self, path: str, docs_dir: str) -> Dict:
+        # Like add_documents for one file, but raises KeyError if it is not indexed yet.
+        return self._upsert([path], docs_dir, update=True)
+
+    def delete_document(self, doc_id: str) -> int:
+        index = self._updatable_index()
+        linked = self._linked_entries(load_manifest(self.manifest_path), {doc_id})
+        with index.write_lock:
+            entries = load_manifest(self.manifest_path)
+            count = index.delete_document(doc_id, publish=False)
+            if entries.pop(doc_id, None) is not None:
+                save_manifest(self.manifest_path, list(entries.values()))
+            index.publish()
+        docs, entries = self._reload(linked)
+        if docs:
+            self._append_documents(index, docs, entries, update=False)
+        return count
+
+    def compact_index(self) -> Optional[np.ndarray]:
+        # Compacts now instead of waiting for compact_threshold; see FaissIndex.compact.
+        return self._updatable_index().compact()
+
+    def add_uploads(self, files: List[Tuple[str, bytes]], progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Indexes files held in memory as (name, bytes) pairs, e.g. Streamlit
+        uploads, without writing them anywhere but the index.
+
+        Only what is new gets embedded: a file whose name and SHA-256 match the
+        manifest is skipped, a changed one replaces its old chunks and the rest
+        are appended to the live index (or build it, when there is none yet).
+        ``progress`` receives ``{"file", "stage", "done", "total"}`` once per
+        file after parsing (stage "parsed", "skipped" or "empty") and once
+        after embedding (stage "embedded", with its chunk count).
+        """
+        try:
+            index = self._updatable_index()
+        except FileNotFoundError:
+            index = None
+        manifest = load_manifest(self.manifest_path) if index is not None else {}
+        docs, entries, skipped = [], [], []
+        for i, (name, data) in enumerate(files):
+            entry = bytes_entry(name, data)
+            prev = manifest.get(name)
+            if prev is not None and prev["sha256"] == entry["sha256"]:
+                skipped.append(name)
+                stage = "skipped"
+            else:
+                doc = load_document_bytes(name, data)
+                if doc is not None:
+                    docs.append(doc)
+                    entries.append(entry)
+                stage = "parsed" if doc is not None else "empty"
+            if progress:
+                progress({"file": name, "stage": stage, "done": i + 1, "total": len(files)})
+
+        if index is None:
+            report = self._build_documents(docs, entries, progress)
+        elif docs:
+            report = self._append_documents(index, docs, entries, update=False, progress=progress)
+        else:
+            report = {"added": [], "changed": [], "embedded_chunks": 0, "total_chunks": len(index.chunks)}
+        report["skipped"] = skipped
+        return report
+
+    def _upsert(self, paths: List[str], docs_dir: str, update: bool) -> Dict:
+        index = self._updatable_index()
+        docs, entries = [], []
+        for path, doc in iter_loaded(paths, docs_dir, **self._ingest_options()):
+            if doc is not None:
+                docs.append(doc)
+                entries.append(file_entry(path, docs_dir))
+        return self._append_documents(index, docs, entries, update)
+
+    def _embed_documents(
+        self, docs: List[Dict], progress: Optional[Callable[[Dict], None]] = None
+    ) -> Tuple[List[Dict], np.ndarray, Optional[Dict]]:
+        # In place, dedup stays within each document so that no other
+        # document's rows depend on it. With a progress callback documents are
+        # embedded one at a time, so each can be reported as it finishes.
+        per_doc = []
+        dedup = {"chunks": 0, "collapsed": 0} if self.cfg.dedup_chunks else None
+        for doc in docs:
+            chunks = chunk_documents([doc], self.cfg.chunk_size_words, self.cfg.chunk_overlap_words)
+            if dedup is not None and chunks:
+                reps = find_duplicates([c["text"] for c in chunks], NearDuplicateIndex(self.cfg.dedup_threshold))
+                dedup["chunks"] += len(chunks)
+                chunks = [c for c in collapse(chunks, reps) if c is not None]
+                dedup["collapsed"] += int((reps != np.arange(len(reps))).sum())
+            per_doc.append(chunks)
+        chunks = [c for doc_chunks in per_doc for c in doc_chunks]
+        if progress is None:
+            parts = [self.embedder.encode([c["text"] for c in chunks])] if chunks else []
+        else:
+            parts = []
+            for i, (doc, doc_chunks) in enumerate(zip(docs, per_doc)):
+                if doc_chunks:
+                    parts.append(self.embedder.encode([c["text"] for c in doc_chunks]))
+                progress({"file": doc["id"], "stage": "embedded", "chunks": len(doc_chunks), "done": i + 1, "total": len(docs)})
+        if not chunks:
+            raise ValueError("No text chunks could be produced from the given files")
+        return chunks, np.vstack(parts), dedup
+
+    @staticmethod
+    def _linked_entries(manifest: Dict[str, Dict], doc_ids: set) -> List[Dict]:
+        # Entries sharing collapsed chunks with doc_ids, directly or through
+        # each other: their chunks live in rows of doc_ids, or rows of theirs
+        # reference chunks of doc_ids. Re-adding doc_ids in place breaks both.
+        if not any(e.get("collapsed_into") for e in manifest.values()):
+            return []
+        linked: set = set()
+        frontier = set(doc_ids)
+        while frontier:
+            holders = {h for p in frontier for h in manifest.get(p, {}).get("collapsed_into", ())}
+            found = {
+                p for p, e in manifest.items()
+                if p not in doc_ids and p not in linked and (p in holders or frontier.intersection(e.get("collapsed_into", ())))
+            }
+            linked |= found
+            frontier = found
+        return [manifest[p] for p in sorted(linked)]
+
+    def _reload(self, entries: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        # Re-reads manifest entries' files (see _linked_entries).
+        docs, fresh = [], []
+        for e in entries:
+            path = e.get("source_path")
+            if not path or not os.path.exists(path):
+                print(f"Warning: {e['path']} shares duplicate chunks with a changed document but cannot be re-read; re-add it to restore them")
+                continue
+            docs_dir = path
+            for _ in e["path"].split(os.sep):
+                docs_dir = os.path.dirname(docs_dir)
+            doc = load_document(path, docs_dir)
+            if doc is not None:
+                docs.append(doc)
+                fresh.append(file_entry(path, docs_dir))
+        return docs, fresh
+
+    @staticmethod
+    def _set_ranges(docs: List[Dict], entries: List[Dict], chunks: List[Dict], start: int):
+        # Chunks are in document order; give each manifest entry its row range.
+        counts = {}
+        for c in chunks:
+            counts[c["doc_id"]] = counts.get(c["doc_id"], 0) + 1
+        for doc, e in zip(docs, entries):
+            e["chunk_start"], e["chunk_end"] = start, start + counts.get(doc["id"], 0)
+            start = e["chunk_end"]
+
+    def _append_documents(
+        self,
+        index: FaissIndex,
+        docs: List[Dict],
+        entries: List[Dict],
+        update: bool,
+        progress: Optional[Callable[[Dict], None]] = None,
+    ) -> Dict:
+        requested = len(entries)
+        linked_docs, linked_entries = self._reload(self._linked_entries(load_manifest(self.manifest_path), {d["id"] for d in docs}))
+        docs, entries = docs + linked_docs, entries + linked_entries
+        chunks, vectors, dedup = self._embed_documents(docs, progress)
+        # Held across the manifest write so a background compaction cannot renumber rows in between.
+        with index.write_lock:
+            manifest = load_manifest(self.manifest_path)
+            report = {"added": [], "changed": [], "embedded_chunks": len(chunks)}
+            for e in entries[:requested]:
+                report["changed" if e["path"] in manifest else "added"].append(e["path"])
+            if linked_entries:
+                report["reprocessed"] = [e["path"] for e in linked_entries]
+            if dedup is not None:
+                report["dedup"] = dedup
+            start = len(index.chunks)
+            if update and not linked_docs:
+                ids = index.update_document(docs[0]["id"], vectors, chunks, publish=False)
+            else:
+                if update and docs[0]["id"] not in index.document_counts():
+                    raise KeyError(f"No document {docs[0]['id']!r} in the index")
+                ids = index.add_documents(vectors, chunks, publish=False)
+            self._set_ranges(docs, entries, chunks, start)
+            for e in entries:
+                manifest[e["path"]] = e
+            save_manifest(self.manifest_path, list(manifest.values()))
+            index.publish()
+        report["ids"] = ids.tolist()
+        report["total_chunks"] = len(index.chunks)
+        report["tombstone_ratio"] = index.tombstone_ratio()
+        return report
+
+    def _build_documents(self, docs: List[Dict], entries: List[Dict], progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        # First index from in-memory documents (add_uploads with nothing built yet).
+        chunks, vectors, dedup = self._embed_documents(docs, progress)
+        self._set_ranges(docs, entries, chunks, 0)
+        self.index.build(vectors, chunks)
+        self.index.save(publish=False)
+        save_manifest(self.manifest_path, entries, self.build_settings())
+        self.index.publish()
+        # Reopen on the saved chunk store so later uploads append in place.
+        self.load_index()
+        report = {"added": [e["path"] for e in entries], "changed": [], "embedded_chunks": len(chunks), "total_chunks": len(chunks)}
+        if dedup is not None:
+            report["dedup"] = dedup
+        return report
+
+    def _remap_manifest(self, remap: np.ndarray):
+        # Compaction renumbers chunk rows; keep the manifest's per-file ranges in step.
+        entries = load_manifest(self.manifest_path)
+        if not entries:
+            return
+        kept = np.concatenate([[0], np.cumsum(remap >= 0)])
+        for e in entries.values():
+            e["chunk_start"] = int(kept[min(e["chunk_start"], len(remap))])
+            e["chunk_end"] = int(kept[min(e["chunk_end"], len(remap))])
+        save_manifest(self.manifest_path, list(entries.values()))
+
+    def _profiling(self) -> bool:
+        return self.cfg.profile or self.metrics is not None
+
+    @contextmanager
+    def profile(self, operation: str) -> Iterator[Optional[Timings]]:
+        # Collects stage timings for one operation when profiling is on; calls
+        # nested in an already profiled operation add to the outer Timings.
+        outer = metrics.current()
+        if outer is not None or not self._profiling():
+            yield outer
+            return
+        timings = Timings()
+        with metrics.recording(timings):
+            yield timings
+        if self.metrics is not None:
+            self.metrics.record(operation, timings)
+
+    def _retrieval_mode(self, mode: Optional[str]) -> str:
+        mode = mode or self.cfg.retrieval_mode
+        if mode not in ("dense", "lexical", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode {mode!r}; expected dense, lexical or hybrid")
+        if mode != "dense" and self.index.bm25 is None:
+            # Indexes built before BM25 support (or with lexical_index=False).
+            if not self._warned_no_bm25:
+                print(f"Warning: {self.cfg.index_dir} has no BM25 index; falling back to dense retrieval")
+                self._warned_no_bm25 = True
+            return "dense"
+        return mode
+
+    def _fuse(self, dense: List[Dict], lexical: List[Dict], top_k: int) -> List[Dict]:
+        hits = {}
+        for h in dense + lexical:
+            hits.setdefault((h.get("shard"), h["doc_id"], h["chunk_id"]), h)
+        rankings = [[(h.get("shard"), h["doc_id"], h["chunk_id"]) for h in hs] for hs in (dense, lexical)]
+        fused = reciprocal_rank_fusion(rankings, k=self.cfg.rrf_k)[:top_k]
+        return [{**hits[key], "score": score} for key, score in fused]
+
+    def retrieve(self, question: str, top_k: int = None, mode: Optional[str] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        return self.retrieve_many([question], top_k=top_k, mode=mode, filters=filters)[0]
+
+    def retrieve_many(
+        self, questions: List[str], top_k: int = None, mode: Optional[str] = None, filters: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        # filters (shared by all questions) restrict the search to matching chunks,
+        # e.g. {"doc_id": ["a.txt"], "source_path_prefix": "docs/hr/"}.
+        with self.profile("retrieve"):
+            return self._retrieve_many(questions, top_k or self.cfg.top_k, self._retrieval_mode(mode), filters)
+
+    def _retrieve_many(self, questions: List[str], top_k: int, mode: str, filters: Optional[Dict]) -> List[List[Dict]]:
+        metrics.count("queries", len(questions))
+        # One index object for the whole call, even if a reload swaps self.index meanwhile.
+        index = self.index
+        if mode == "lexical":
+            with metrics.span("search_lexical"):
+                return [index.search_lexical(q, top_k, filters=filters) for q in questions]
+        # Hybrid fuses a deeper candidate list from each side, then trims to top_k.
+        k = max(top_k, self.cfg.hybrid_candidates) if mode == "hybrid" else top_k
+        results: List[List[Dict]] = []
+        batch_size = self.cfg.query_batch_size
+        for start in range(0, len(questions), batch_size):
+            with metrics.span("embed"):
+                q_vecs = self.embedder.encode(questions[start:start + batch_size])
+            with metrics.span("search"):
+                results.extend(index.search_many(q_vecs, top_k=k, filters=filters))
+        if mode == "hybrid":
+            with metrics.span("search_lexical"):
+                lexical = [index.search_lexical(q, k, filters=filters) for q in questions]
+            with metrics.span("fuse"):
+                results = [self._fuse(dense, lex, top_k) for dense, lex in zip(results, lexical)]
+        return results
+
+    def prepare_prompt(self, question: str, passages: List[Dict]) -> Tuple[str, List[Dict], Dict]:
+        # Packs passages (in score order) into the generator's context window,
+        # counting with its own tokenizer. Returns (prompt, passages used, stats).
+        with metrics.span("context"):
+            return self._prepare_prompt(question, passages)
+
+    def _prepare_prompt(self, question: str, passages: List[Dict]) -> Tuple[str, List[Dict], Dict]:
+        generator = self.generator
+        count_tokens = getattr(generator, "count_tokens", None) or (lambda text: len(text.split()))
+        count_tokens = metrics.timed("tokenize", count_tokens)
+        overhead = count_tokens(build_prompt(question, ""))
+        budget = self.cfg.context_token_budget
+        if budget == 0:
+            context = format_context(passages)
+            tokens = count_tokens(context)
+            stats = {"budget": None, "tokens": tokens, "candidates": len(passages), "used": len(passages)}
+        else:
+            limit = getattr(generator, "prompt_token_limit", None)
+            if limit is not None:
+                room = max(limit - overhead, 0)
+                budget = room if budget is None else min(budget, room)
+            context, passages, stats = pack_context(
+                passages,
+                count_tokens,
+                budget if budget is not None else 1 << 62,
+                dedup_threshold=self.cfg.context_dedup_threshold,
+                min_passage_tokens=self.cfg.context_min_passage_tokens,
+            )
+            stats["budget"] = budget
+        stats["prompt_tokens"] = overhead + stats["tokens"]
+        return build_prompt(question, context), passages, stats
 
-    def answer(self, question: str, top_k: int = None) -> Dict:
-        passages = self.retrieve(question, top_k)
-        context_bullets = format_context(passages)
-        prompt = build_prompt(question, context_bullets)
-        answer = self.generator.generate(prompt)
-        return {"question": question, "answer": answer, "passages": passages}
+    def _with_timings(self, result: Dict, timings: Optional[Timings]) -> Dict:
+        if self.cfg.profile and timings is not None:
+            result["timings"] = timings.as_dict()
+        return result
 
+    def answer(self, question: str, top_k: int = None, filters: Optional[Dict] = None) -> Dict:
+        with self.profile("answer") as timings:
+            passages = self.retrieve(question, top_k, filters=filters)
+            prompt, passages, context = self.prepare_prompt(question, passages)
+            with metrics.span("generate"):
+                answer = self.generator.generate(prompt)
+        result = {"question": question, "answer": answer, "passages": passages, "context": context}
+        return self._with_timings(result, timings)
 
+    def answer_stream(self, question: str, top_k: int = None, filters: Optional[Dict] = None) -> Iterator[Dict]:
+        # Events, in order: {"type": "passages"}, one {"type": "token"} per
+        # generated piece, then {"type": "done"} with the full answer and
+        # time-to-first-token / total latency in seconds.
+        started = time.perf_counter()
+        # The profiling context is only held around code without yields; the
+        # stream itself is timed here (prefill = until the first piece, and
+        # generate includes the consumer's time between pieces).
+        timings = Timings() if self._profiling() and metrics.current() is None else None
+        with metrics.recording(timings or metrics.current()):
+            passages = self.retrieve(question, top_k, filters=filters)
+            prompt, passages, context = self.prepare_prompt(question, passages)
+        yield {"type": "passages", "question": question, "passages": passages, "context": context}
+        pieces: List[str] = []
+        ttft = None
+        generating = time.perf_counter()
+        for piece in self.generator.stream(prompt):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+                if timings is not None:
+                    timings.add("prefill", time.perf_counter() - generating)
+            pieces.append(piece)
+            yield {"type": "token", "text": piece}
+        if timings is not None:
+            timings.add("generate", time.perf_counter() - generating)
+            timings.count("generated_pieces", len(pieces))
+            if self.metrics is not None:
+                self.metrics.record("answer_stream", timings)
+        done = {
+            "type": "done",
+            "question": question,
+            "answer": "".join(pieces).strip(),
+            "passages": passages,
+            "context": context,
+            "ttft_s": ttft,
+            "total_s": time.perf_counter() - started,
+        }
+        yield self._with_timings(done, timings)
 
+    def answer_many(self, questions: List[str], top_k: int = None, filters: Optional[Dict] = None) -> List[Dict]:
+        # With profiling, every answer carries the timings of the whole batch.
+        with self.profile("answer_many") as timings:
+            retrieved = self.retrieve_many(questions, top_k, filters=filters)
+            prepared = [self.prepare_prompt(q, p) for q, p in zip(questions, retrieved)]
+            with metrics.span("generate"):
+                answers = self.generator.generate_many([prompt for prompt, _, _ in prepared])
+        return [
+            self._with_timings({"question": q, "answer": a, "passages": p, "context": c}, timings)
+            for q, a, (_, p, c) in zip(questions, answers, prepared)
+        ]
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
 
 
 def format_context(passages: List[Dict]) -> str:
@@ -9,4 +9,81 @@ def format_context(passages: List[Dict]) -> str:
     return "\n".join(lines)
 
 
+def _overlap(a: List[str], b: List[str]) -> int:
+    # Length of the longest suffix of a that is also a prefix of b.
+    for k in range(min(len(a), len(b)), 0, -1):
+        if a[-k:] == b[:k]:
+            return k
+    return 0
 
+
+def _fit_words(tag: str, words: List[str], count_tokens: Callable[[str], int], budget: int) -> List[str]:
+    # Longest word prefix whose formatted line fits in budget (binary search).
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(f"- {tag} {' '.join(words[:mid])} ...") <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return words[:lo]
+
+
+def pack_context(
+    passages: List[Dict],
+    count_tokens: Callable[[str], int],
+    budget: int,
+    dedup_threshold: float = 0.8,
+    min_passage_tokens: int = 32,
+) -> Tuple[str, List[Dict], Dict]:
+    """Fill a token budget with passages in the given (score) order.
+
+    Passages whose words are mostly contained in already packed chunks of the
+    same document are dropped; word-window overlap with a neighbouring packed
+    chunk is cut off. A passage that does not fit is trimmed if at least
+    ``min_passage_tokens`` remain, otherwise skipped.
+    Returns (context, packed passages, stats).
+    """
+    lines: List[str] = []
+    used: List[Dict] = []
+    seen: Dict[Tuple, List[List[str]]] = {}
+    stats = {"budget": budget, "tokens": 0, "candidates": len(passages), "used": 0, "duplicates": 0, "trimmed": 0, "skipped": 0}
+    for p in passages:
+        words = p["text"].split()
+        packed = seen.setdefault((p.get("shard"), p["doc_id"]), [])
+        vocab = set(words)
+        if vocab and packed:
+            covered = set().union(*packed)
+            if len(vocab & covered) / len(vocab) >= dedup_threshold:
+                stats["duplicates"] += 1
+                continue
+        body = words
+        for other in packed:
+            head = _overlap(other, body)
+            body = body[head:]
+            tail = _overlap(body, other)
+            body = body[:len(body) - tail]
+        if not body:
+            stats["duplicates"] += 1
+            continue
+        tag = f"[{p['doc_id']}#{p['chunk_id']}]"
+        line = f"- {tag} {' '.join(body)}"
+        n = count_tokens(line)
+        remaining = budget - stats["tokens"]
+        if n > remaining:
+            if remaining < min_passage_tokens:
+                stats["skipped"] += 1
+                continue
+            body = _fit_words(tag, body, count_tokens, remaining)
+            if not body:
+                stats["skipped"] += 1
+                continue
+            line = f"- {tag} {' '.join(body)} ..."
+            n = count_tokens(line)
+            stats["trimmed"] += 1
+        lines.append(line)
+        used.append(p)
+        packed.append(words)
+        stats["tokens"] += n
+    stats["used"] = len(used)
+    return "\n".join(lines), used, stats
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, field_validator
+
+from . import metrics
+from .batching import MicroBatcher
+from .config import RagConfig
+from .filters import validate_filters
+from .metrics import PrometheusSink
+
+
+# Largest top_k a request may ask for: a group of batched requests is
+# searched at its largest top_k, so one huge value would slow all of them.
+MAX_TOP_K = 100
+
+
+@dataclass
+class ServerConfig:
+    max_batch_size: int = 32  # requests merged into one embed/search or generate call
+    max_wait_ms: float = 5.0  # how long a batch waits for more requests
+    max_queue: int = 256  # queued requests per stage before answering 503
+    request_timeout_s: float = 30.0
+    index_check_interval_s: float = 2.0  # how often a newly published index snapshot is looked for; 0 = never reload
+
+
+class QueryRequest(BaseModel):
+    question: str
+    top_k: Optional[int] = Field(None, ge=1, le=MAX_TOP_K)
+    timeout_s: Optional[float] = None
+    filters: Optional[Dict[str, Any]] = None  # see filters.MetadataIndex
+
+    @field_validator("filters")
+    @classmethod
+    def _check_filters(cls, value):
+        return validate_filters(value)
+
+
+class RagService:
+    """Loads one RagPipeline and funnels concurrent requests through two
+    micro-batchers: one for query embedding + FAISS search, one for generation.
+
+    A background thread hot-swaps the index when a build publishes a new
+    snapshot: the new one is loaded off the request path and replaces
+    ``pipe.index``, while batches already searching the old one finish on it.
+    """
+
+    def __init__(self, pipeline_factory: Callable, server_cfg: ServerConfig):
+        self.pipeline_factory = pipeline_factory
+        self.server_cfg = server_cfg
+        self.pipe = None
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.ready = threading.Event()
+        self.retrieve_batcher: Optional[MicroBatcher] = None
+        self.generate_batcher: Optional[MicroBatcher] = None
+        self.metrics = PrometheusSink()
+        self.index_reloads = 0
+        self._closed = threading.Event()
+
+    def load(self):
+        from .shared_index import index_version
+
+        try:
+            pipe = self.pipeline_factory()
+            pipe.metrics = self.metrics  # retrieve_many reports its stages here
+            # Taken before loading: a snapshot published meanwhile is picked up by the watcher.
+            version = index_version(pipe.cfg)
+            pipe.load_index()
+            pipe.warmup()
+        except Exception as e:
+            self.error = str(e)
+            return
+        self.pipe = pipe
+        if self.server_cfg.index_check_interval_s > 0:
+            threading.Thread(target=self._watch_index, args=(version,), name="server-index-watch", daemon=True).start()
+        opts = dict(
+            max_batch_size=self.server_cfg.max_batch_size,
+            max_wait_ms=self.server_cfg.max_wait_ms,
+            max_queue=self.server_cfg.max_queue,
+        )
+        self.retrieve_batcher = MicroBatcher(self._retrieve_batch, name="server-retrieve", **opts)
+        self.generate_batcher = MicroBatcher(self._generate_batch, name="server-generate", **opts)
+        self.ready.set()
+
+    def close(self):
+        self._closed.set()
+        for b in (self.retrieve_batcher, self.generate_batcher):
+            if b is not None:
+                b.close()
+
+    def _watch_index(self, version):
+        from .shared_index import index_version
+
+        while not self._closed.wait(self.server_cfg.index_check_interval_s):
+            try:
+                latest = index_version(self.pipe.cfg)
+                if not latest or latest == version:
+                    continue  # unchanged, or withdrawn: keep serving the loaded index
+                fresh = self.pipeline_factory()
+                fresh.load_index()
+            except Exception as e:
+                print(f"Warning: loading the new index failed ({e}); keeping the loaded one")
+                continue
+            self.pipe.index, version = fresh.index, latest
+            self.index_reloads += 1
+
+    def _retrieve_batch(self, items: List[Tuple[str, int, Optional[Dict]]]) -> List[List[Dict]]:
+        # One search per distinct filter at the largest top_k in that group,
+        # trimmed per request. A group that fails gets its exception as the
+        # result, so it does not fail the other groups of the batch.
+        groups: Dict[str, List[int]] = {}
+        for i, (_, _, filters) in enumerate(items):
+            groups.setdefault(json.dumps(filters, sort_keys=True), []).append(i)
+        out: List[Any] = [[] for _ in items]
+        for rows in groups.values():
+            top_k = max(items[i][1] for i in rows)
+            try:
+                results = self.pipe.retrieve_many([items[i][0] for i in rows], top_k=top_k, filters=items[rows[0]][2])
+            except Exception as e:
+                for i in rows:
+                    out[i] = e
+                continue
+            for i, hits in zip(rows, results):
+                out[i] = hits[:items[i][1]]
+        return out
+
+    def _profiled(self, operation: str, fn: Callable, *args):
+        timings = metrics.Timings()
+        with metrics.recording(timings):
+            with metrics.span(operation):
+                result = fn(*args)
+        self.metrics.record(operation, timings)
+        return result
+
+    def _generate_batch(self, prompts: List[str]) -> List[str]:
+        return self._profiled("generate", self.pipe.generator.generate_many, prompts)
+
+    def health(self) -> Dict:
+        pipe = self.pipe
+        report = pipe.startup_report() if pipe is not None else {}
+        return {
+            "status": "ok" if self.ready.is_set() else ("error" if self.error else "loading"),
+            "error": self.error,
+            "uptime_s": round(time.time() - self.started, 3),
+            "embedder_loaded": report.get("embedder_loaded", False),
+            "generator_loaded": report.get("generator_loaded", False),
+            "index_loaded": report.get("index_loaded", False),
+            "retrieval_only": report.get("retrieval_only", False),
+            "load_timings_s": report.get("timings_s", {}),
+            "chunks": len(pipe.index.chunks) if pipe is not None else 0,
+            "index_reloads": self.index_reloads,
+            "queued": {
+                "retrieve": self.retrieve_batcher.qsize() if self.retrieve_batcher else 0,
+                "generate": self.generate_batcher.qsize() if self.generate_batcher else 0,
+            },
+        }
+
+    async def _call(self, batcher: MicroBatcher, item, deadline: float):
+        try:
+            fut = batcher.submit(item, block=False)
+        except queue.Full:
+            raise HTTPException(status_code=503, detail="Server busy, retry later")
+        remaining = deadline - time.monotonic()
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(fut), timeout=max(remaining, 0.001))
+        except asyncio.TimeoutError:
+            fut.cancel()
+            raise HTTPException(status_code=504, detail="Request timed out")
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _check_ready(self):
+        if not self.ready.is_set():
+            raise HTTPException(status_code=503, detail=self.error or "Pipeline is still loading")
+
+    def _deadline(self, req: QueryRequest) -> float:
+        return time.monotonic() + (req.timeout_s or self.server_cfg.request_timeout_s)
+
+    async def retrieve(self, req: QueryRequest) -> Dict:
+        self._check_ready()
+        top_k = req.top_k or self.pipe.cfg.top_k
+        passages = await self._call(self.retrieve_batcher, (req.question, top_k, req.filters), self._deadline(req))
+        return {"question": req.question, "passages": passages}
+
+    async def answer(self, req: QueryRequest) -> Dict:
+        self._check_ready()
+        if self.pipe.cfg.retrieval_only:
+            raise HTTPException(status_code=400, detail="Server runs in retrieval-only mode; use /retrieve")
+        deadline = self._deadline(req)
+        top_k = req.top_k or self.pipe.cfg.top_k
+        passages = await self._call(self.retrieve_batcher, (req.question, top_k, req.filters), deadline)
+        # Token counting and trimming are CPU work: keep them off the event loop.
+        prompt, passages, context = await asyncio.to_thread(
+            self._profiled, "prepare_prompt", self.pipe.prepare_prompt, req.question, passages
+        )
+        answer = await self._call(self.generate_batcher, prompt, deadline)
+        return {"question": req.question, "answer": answer, "passages": passages, "context": context}
+
+
+def create_app(pipeline_factory: Optional[Callable] = None, server_cfg: Optional[ServerConfig] = None) -> FastAPI:
+    if pipeline_factory is None:
+        from .pipeline import RagPipeline
+
+        def pipeline_factory():
+            return RagPipeline(RagConfig())
+
+    service = RagService(pipeline_factory, server_cfg or ServerConfig())
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Load in the background so /health answers (with "loading") immediately.
+        loader = asyncio.create_task(asyncio.to_thread(service.load))
+        yield
+        await loader
+        service.close()
+
+    app = FastAPI(title="RAG Pipeline", lifespan=lifespan)
+    app.state.service = service
+
+    @app.exception_handler(RequestValidationError)
+    async def bad_filters(request: Request, exc: RequestValidationError):
+        # Malformed filters answer 400; other invalid bodies keep FastAPI's 422.
+        if any(tuple(e["loc"][:2]) == ("body", "filters") for e in exc.errors()):
+            return JSONResponse(status_code=400, content={"detail": jsonable_encoder(exc.errors())})
+        return await request_validation_exception_handler(request, exc)
+
+    @app.get("/health")
+    async def health():
+        return service.health()
+
+    @app.get("/metrics")
+    async def prometheus_metrics():
+        return PlainTextResponse(service.metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/retrieve")
+    async def retrieve(req: QueryRequest):
+        return await service.retrieve(req)
+
+    @app.post("/answer")
+    async def answer(req: QueryRequest):
+        return await service.answer(req)
+
+    return app
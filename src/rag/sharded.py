@@ -0,0 +1,180 @@
+import heapq
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .index_faiss import FaissIndex
+
+
+SHARDS_FILENAME = "shards.json"
+
+
+class ShardedChunks:
+    """Read-only concatenation of the shards' chunk stores."""
+
+    def __init__(self, parts: List):
+        self.parts = parts
+
+    def __len__(self) -> int:
+        return sum(len(p) for p in self.parts)
+
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += len(self)
+        for p in self.parts:
+            if i < len(p):
+                return p[i]
+            i -= len(p)
+        raise IndexError("chunk index out of range")
+
+    def __iter__(self) -> Iterator[Dict]:
+        for p in self.parts:
+            yield from p
+
+    def doc_ids(self) -> List[str]:
+        return sorted({c["doc_id"] for c in self})
+
+
+class ShardedIndex:
+    """Several FaissIndex directories listed in ``<root>/shards.json``, searched
+    in parallel and merged into one global top-k by score.
+
+    Each shard is built on its own (usually one per source collection), and
+    adding or removing a shard only rewrites the manifest. FAISS releases the
+    GIL during search, so a thread pool is enough to use several cores.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        make_shard: Callable[[str], FaissIndex],
+        manifest_filename: str = SHARDS_FILENAME,
+        max_workers: int = 0,
+    ):
+        self.root_dir = root_dir
+        self.manifest_path = os.path.join(root_dir, manifest_filename)
+        self.make_shard = make_shard
+        self.max_workers = max_workers
+        self.shards: Dict[str, FaissIndex] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def is_sharded(root_dir: str, manifest_filename: str = SHARDS_FILENAME) -> bool:
+        return os.path.exists(os.path.join(root_dir, manifest_filename))
+
+    def entries(self) -> List[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)["shards"]
+
+    def _save_entries(self, entries: List[Dict]):
+        os.makedirs(self.root_dir, exist_ok=True)
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "shards": entries}, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def shard_dir(self, entry: Dict) -> str:
+        return os.path.join(self.root_dir, entry["dir"])
+
+    def add_shard(self, name: str, shard_dir: str) -> Dict:
+        # shard_dir must hold a built index; re-adding a name replaces its entry.
+        shard = self.make_shard(shard_dir)
+        shard.load()
+        entry = {"name": name, "dir": os.path.relpath(shard_dir, self.root_dir), "chunks": len(shard.chunks)}
+        entries = [e for e in self.entries() if e["name"] != name] + [entry]
+        self._save_entries(entries)
+        return entry
+
+    def remove_shard(self, name: str, delete_files: bool = False) -> Dict:
+        entries = self.entries()
+        entry = next((e for e in entries if e["name"] == name), None)
+        if entry is None:
+            raise KeyError(f"No shard named {name!r}")
+        self._save_entries([e for e in entries if e["name"] != name])
+        self.shards.pop(name, None)
+        if delete_files:
+            shutil.rmtree(self.shard_dir(entry), ignore_errors=True)
+        return entry
+
+    def load(self):
+        entries = self.entries()
+        if not entries:
+            raise FileNotFoundError("Index files not found. Build first.")
+        shards: Dict[str, FaissIndex] = {}
+        for e in entries:
+            shard = self.make_shard(self.shard_dir(e))
+            shard.load()
+            shards[e["name"]] = shard
+        dims = {s.index.d for s in shards.values()}
+        if len(dims) > 1:
+            raise ValueError(f"Shards have different vector dimensions {sorted(dims)}; were they built with the same embedding model?")
+        self.shards = shards
+        self.close()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers or len(shards), thread_name_prefix="shard-search")
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    @property
+    def index(self):
+        # Mirrors FaissIndex.index: None until load().
+        return [s.index for s in self.shards.values()] if self.shards else None
+
+    @property
+    def bm25(self):
+        if not self.shards or any(s.bm25 is None for s in self.shards.values()):
+            return None
+        return [s.bm25 for s in self.shards.values()]
+
+    @property
+    def chunks(self) -> ShardedChunks:
+        return ShardedChunks([s.chunks for s in self.shards.values()])
+
+    def document_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for shard in self.shards.values():
+            for doc_id, n in shard.document_counts().items():
+                counts[doc_id] = counts.get(doc_id, 0) + n
+        return counts
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        for s in self.shards.values():
+            s.set_search_params(nprobe=nprobe, ef_search=ef_search)
+
+    def _fan_out(self, search: Callable[[FaissIndex], List[List[Dict]]]) -> List[List[List[Dict]]]:
+        if self._pool is None:
+            raise RuntimeError("Index not loaded")
+        names = list(self.shards)
+        futures = [self._pool.submit(search, self.shards[n]) for n in names]
+        out = []
+        for name, fut in zip(names, futures):
+            out.append([[{**h, "shard": name} for h in hits] for hits in fut.result()])
+        return out
+
+    @staticmethod
+    def _merge(per_shard: List[List[List[Dict]]], top_k: int) -> List[List[Dict]]:
+        return [
+            heapq.nlargest(top_k, (h for hits in per_query for h in hits), key=lambda h: h["score"])
+            for per_query in zip(*per_shard)
+        ]
+
+    def search(self, query_vec: np.ndarray, top_k: int, filters: Optional[Dict] = None) -> List[Dict]:
+        if query_vec.ndim == 1:
+            query_vec = query_vec[None, :]
+        return self.search_many(query_vec[:1], top_k, filters=filters)[0]
+
+    def search_many(self, query_vecs: np.ndarray, top_k: int, filters: Optional[Dict] = None) -> List[List[Dict]]:
+        return self._merge(self._fan_out(lambda s: s.search_many(query_vecs, top_k, filters=filters)), top_k)
+
+    def search_lexical(self, query: str, top_k: int, filters: Optional[Dict] = None) -> List[Dict]:
+        # BM25 statistics are per shard, so merged lexical scores are approximate;
+        # hybrid retrieval only uses their ranks.
+        return self._merge(self._fan_out(lambda s: [s.search_lexical(query, top_k, filters=filters)]), top_k)[0]
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from . import snapshots
+from .config import RagConfig
+from .pipeline import RagPipeline
+from .sharded import ShardedIndex
+
+
+def _file_versions(directory: str, prefix: str = "") -> list:
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        # Retained and unfinished snapshots are not the version readers load.
+        dirs[:] = [d for d in dirs if d != snapshots.SNAPSHOTS_DIRNAME]
+        for name in files:
+            # Files being written (.tmp, including the CURRENT pointer's) are not a new version.
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((prefix + os.path.relpath(path, directory), st.st_mtime_ns, st.st_size))
+    return entries
+
+
+def _dir_version(directory: str, prefix: str = "") -> list:
+    # A published snapshot is identified by its name: every write publishes a
+    # new one. Directories from before snapshots by their files.
+    name = snapshots.current(directory)
+    if name is not None:
+        return [(prefix + snapshots.POINTER_FILENAME, name)]
+    return _file_versions(directory, prefix)
+
+
+def index_version(config: RagConfig) -> Tuple:
+    # Published snapshot (or file stats) of the index, including shard
+    # directories outside the root; () when nothing has been built.
+    index_dir = config.index_dir
+    if not os.path.isdir(index_dir):
+        return ()
+    entries = _dir_version(index_dir)
+    if ShardedIndex.is_sharded(index_dir, config.shards_filename):
+        sharded = ShardedIndex(index_dir, None, manifest_filename=config.shards_filename)
+        try:
+            shard_entries = sharded.entries()
+        except (OSError, ValueError, KeyError):
+            shard_entries = []  # manifest being rewritten; the next check sees it
+        root = os.path.abspath(index_dir)
+        for entry in shard_entries:
+            shard_dir = os.path.abspath(sharded.shard_dir(entry))
+            if not shard_dir.startswith(root + os.sep):
+                entries += _dir_version(shard_dir, prefix=entry["name"] + ":")
+    return tuple(sorted(entries))
+
+
+class SharedIndex:
+    """One loaded index per process, shared by every caller (e.g. all Streamlit
+    sessions) and reloaded only when its files change on disk.
+
+    ``get()`` checks the published snapshot at most every ``check_interval_s``
+    seconds. A reload builds a fresh index object and swaps it in, so searches
+    already running on the previous one finish undisturbed.
+    """
+
+    def __init__(self, config: RagConfig, check_interval_s: float = 1.0):
+        self.cfg = config
+        self.check_interval_s = check_interval_s
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._index = None
+        self._summary: Optional[Dict] = None
+        self._version: Optional[Tuple] = None
+        self._checked = 0.0
+
+    def _load(self):
+        pipe = RagPipeline(self.cfg)
+        pipe.load_index()
+        return pipe.index
+
+    def get(self) -> Tuple[Any, Dict]:
+        # (index, summary); raises FileNotFoundError when no index is built.
+        with self._lock:
+            now = time.monotonic()
+            if self._index is not None and now - self._checked < self.check_interval_s:
+                return self._index, self._summary
+            self._checked = now
+            version = index_version(self.cfg)
+            if self._index is None or version != self._version:
+                if not version:
+                    self._index = self._summary = self._version = None
+                    raise FileNotFoundError("Index files not found. Build first.")
+                # Version taken before loading: a write that lands meanwhile
+                # shows up as a change on the next check.
+                try:
+                    index = self._load()
+                except Exception as e:
+                    if self._index is None:
+                        raise
+                    # Most likely files caught mid-rewrite: keep serving the loaded index.
+                    print(f"Warning: reloading {self.cfg.index_dir} failed ({e}); keeping the loaded index")
+                    return self._index, self._summary
+                self._index, self._summary, self._version = index, summarize(index), version
+                self.loads += 1
+            return self._index, self._summary
+
+    def written(self, index):
+        # The shared index object was changed in place (e.g. by
+        # RagPipeline.add_uploads): adopt the files it wrote as the current
+        # version instead of reloading what is already in memory.
+        with self._lock:
+            if index is self._index:
+                self._version = index_version(self.cfg)
+                self._summary = summarize(index)
+                self._checked = time.monotonic()
+
+    def invalidate(self):
+        # Forces a version check on the next get(), e.g. right after a build.
+        with self._lock:
+            self._checked = 0.0
+
+
+def summarize(index) -> Dict:
+    counts = index.document_counts()
+    return {"documents": dict(sorted(counts.items())), "chunks": sum(counts.values())}
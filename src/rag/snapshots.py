@@ -0,0 +1,204 @@
+"""Versioned index snapshots published through an atomic pointer file.
+
+Every write of an index directory goes into a new snapshot directory,
+``<index_dir>/snapshots/<name>``, and is then published by replacing
+``<index_dir>/CURRENT`` with a file naming it. ``os.replace`` is atomic, so a
+reader resolves either the previous complete snapshot or the new one, never
+a mix of files from both. Older snapshots stay on disk for readers still
+using them (and for rolling back) until ``collect_garbage`` removes them.
+
+A directory without ``CURRENT`` is read as before snapshots existed, with
+the index files directly inside it.
+"""
+import os
+import re
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+POINTER_FILENAME = "CURRENT"
+SNAPSHOTS_DIRNAME = "snapshots"
+# Present in a snapshot that has not been published yet (still being written,
+# or abandoned by a crashed writer); garbage collection leaves these alone.
+UNFINISHED_MARKER = ".unfinished"
+_NAME = re.compile(r"v(\d+)$")
+
+
+def snapshots_dir(index_dir: str) -> str:
+    return os.path.join(index_dir, SNAPSHOTS_DIRNAME)
+
+
+def current(index_dir: str) -> Optional[str]:
+    # Name of the published snapshot, or None (nothing published / legacy layout).
+    try:
+        with open(os.path.join(index_dir, POINTER_FILENAME), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return name or None
+
+
+def resolve(index_dir: str) -> str:
+    # Directory holding the files readers should load.
+    name = current(index_dir)
+    return os.path.join(snapshots_dir(index_dir), name) if name else index_dir
+
+
+def _names(index_dir: str) -> List[str]:
+    # Snapshot names, oldest first.
+    try:
+        names = [n for n in os.listdir(snapshots_dir(index_dir)) if _NAME.match(n)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda n: int(_NAME.match(n).group(1)))
+
+
+def create(index_dir: str) -> str:
+    """Creates and returns a new, empty, unfinished snapshot directory.
+
+    Numbers only grow, so names sort in creation order; mkdir fails if a
+    concurrent writer took the same number, and the next one is tried.
+    """
+    root = snapshots_dir(index_dir)
+    os.makedirs(root, exist_ok=True)
+    names = _names(index_dir)
+    number = int(_NAME.match(names[-1]).group(1)) + 1 if names else 1
+    while True:
+        path = os.path.join(root, f"v{number:06d}")
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            number += 1
+            continue
+        open(os.path.join(path, UNFINISHED_MARKER), "w").close()
+        return path
+
+
+def _copy_head(src: str, dst: str, size: Optional[int]):
+    if size is None:
+        shutil.copy2(src, dst)
+        return
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while size > 0:
+            block = fin.read(min(size, 1 << 20))
+            if not block:
+                break
+            fout.write(block)
+            size -= len(block)
+
+
+def fork(src_dir: str, dst_dir: str, heads: Optional[Dict[str, Optional[int]]] = None):
+    """Fills dst_dir with the files of src_dir for a copy-on-write update.
+
+    Files are hard-linked, which is safe as long as every writer replaces
+    files (write to .tmp, then os.replace). Files named in ``heads`` are
+    about to be appended to, so they get real copies of their first N bytes
+    (None: the whole file).
+    """
+    heads = heads or {}
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        if name == UNFINISHED_MARKER or name.endswith(".tmp") or not os.path.isfile(src):
+            continue
+        dst = os.path.join(dst_dir, name)
+        if name not in heads:
+            try:
+                os.link(src, dst)
+                continue
+            except OSError:
+                pass  # no hard links on this file system
+        _copy_head(src, dst, heads.get(name))
+
+
+def discard(index_dir: str, snapshot: str):
+    # Removes an unpublished snapshot after a failed or aborted write.
+    shutil.rmtree(snapshot, ignore_errors=True)
+    try:
+        os.rmdir(snapshots_dir(index_dir))  # only succeeds when no snapshot is left
+    except OSError:
+        pass
+
+
+def publish(index_dir: str, snapshot: str):
+    """Atomically makes ``snapshot`` the one readers load."""
+    name = os.path.basename(os.path.normpath(snapshot))
+    marker = os.path.join(snapshot, UNFINISHED_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+    pointer = os.path.join(index_dir, POINTER_FILENAME)
+    tmp = f"{pointer}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+
+
+def switch(index_dir: str, name: str):
+    # Publishes a retained snapshot again, e.g. to roll back a bad build.
+    path = os.path.join(snapshots_dir(index_dir), name)
+    if not _NAME.match(name) or not os.path.isdir(path):
+        raise KeyError(f"No snapshot {name!r} in {index_dir}")
+    if os.path.exists(os.path.join(path, UNFINISHED_MARKER)):
+        raise ValueError(f"Snapshot {name!r} was never finished and cannot be published")
+    publish(index_dir, path)
+
+
+def unpublish(index_dir: str) -> Optional[str]:
+    """Withdraws the published snapshot; readers that load afterwards find
+    no index, while those already using it keep their files until garbage
+    collection. Returns the withdrawn name."""
+    name = current(index_dir)
+    if name is not None:
+        os.remove(os.path.join(index_dir, POINTER_FILENAME))
+    return name
+
+
+def list_snapshots(index_dir: str) -> List[Dict]:
+    published = current(index_dir)
+    out = []
+    for name in _names(index_dir):
+        path = os.path.join(snapshots_dir(index_dir), name)
+        size = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                size += entry.stat().st_size
+        out.append({
+            "name": name,
+            "current": name == published,
+            "finished": not os.path.exists(os.path.join(path, UNFINISHED_MARKER)),
+            "bytes": size,
+        })
+    return out
+
+
+def collect_garbage(index_dir: str, keep: int, unfinished: bool = False) -> List[str]:
+    """Deletes all but the ``keep`` newest finished snapshots (the published
+    one always counts as kept); ``keep`` 0 keeps everything. Unfinished
+    snapshots are only removed with ``unfinished=True``, when no writer can
+    be running. Returns the names deleted.
+
+    A snapshot whose files are still open by another process (memory-mapped
+    files on Windows) cannot be deleted yet; it is retried next time.
+    """
+    published = current(index_dir)
+    root = snapshots_dir(index_dir)
+    retained = 1 if published is not None else 0
+    deleted = []
+    for name in reversed(_names(index_dir)):
+        path = os.path.join(root, name)
+        if name == published:
+            continue
+        if os.path.exists(os.path.join(path, UNFINISHED_MARKER)):
+            if not unfinished:
+                continue
+        elif not keep or retained < keep:
+            retained += 1
+            continue
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            print(f"Warning: could not delete snapshot {path} ({e}); retrying at the next collection")
+            continue
+        deleted.append(name)
+    return deleted
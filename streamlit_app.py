@@ -3,12 +3,37 @@ import json
 import streamlit as st
 
 from src.rag.config import RagConfig
+from src.rag import snapshots
+from src.rag.chunk_store import store_paths
+from src.rag.index_faiss import BM25_PREFIX, INFO_FILENAME, TOMBSTONES_FILENAME, VECTORS_FILENAME
 from src.rag.pipeline import RagPipeline
+from src.rag.shared_index import SharedIndex
 
 
 st.set_page_config(page_title="RAG Demo", page_icon="📚", layout="wide")
 st.title("RAG Pipeline Demo")
 
+
+# One loaded index per directory for the whole server process, shared by all
+# sessions; it is only re-read when a new index snapshot is published.
+@st.cache_resource
+def get_shared_index(index_dir):
+    return SharedIndex(RagConfig(index_dir=index_dir))
+
+def legacy_index_files(cfg):
+    names = [
+        cfg.faiss_index_filename,
+        cfg.metadata_filename,
+        cfg.manifest_filename,
+        INFO_FILENAME,
+        VECTORS_FILENAME,
+        TOMBSTONES_FILENAME,
+        BM25_PREFIX + ".npz",
+        BM25_PREFIX + ".vocab.json",
+    ]
+    paths = [os.path.join(cfg.index_dir, n) for n in names]
+    return paths + list(store_paths(os.path.join(cfg.index_dir, cfg.chunk_store_prefix)))
+
 with st.sidebar:
     st.header("Document Upload")
     uploaded_files = st.file_uploader(
@@ -18,51 +43,33 @@ with st.sidebar:
         help="Upload one or more PDF or TXT files to build the index"
     )
     
-    # Save uploaded files
-    upload_dir = "data/uploads"
-    use_uploaded = False
-    # Ensure index_dir is defined before using it in clear buttons
+    # Uploads are indexed straight from memory; nothing is saved under data/.
+    use_uploaded = bool(uploaded_files)
+    # Ensure index_dir is defined before using it in the clear button
     index_dir = st.text_input("Index directory", value="indexes")
     
-    col_a, col_b = st.columns(2)
-    with col_a:
-        clear_uploads = st.button("Clear uploaded files", help="Delete all files in data/uploads")
-    with col_b:
-        clear_index = st.button("Clear index", help="Delete saved index to force a fresh rebuild")
-
-    if clear_uploads:
-        try:
-            if os.path.exists(upload_dir):
-                for name in os.listdir(upload_dir):
-                    try:
-                        os.remove(os.path.join(upload_dir, name))
-                    except IsADirectoryError:
-                        pass
-            st.success("Uploads cleared.")
-        except Exception as e:
-            st.error(f"Failed to clear uploads: {e}")
+    clear_index = st.button("Clear index", help="Withdraw the saved index to force a fresh rebuild")
 
     if clear_index:
         try:
             if os.path.exists(index_dir):
-                for name in os.listdir(index_dir):
-                    p = os.path.join(index_dir, name)
+                # Only the snapshot pointer is removed: searches still running on
+                # the snapshot finish, and later builds garbage-collect its files.
+                snapshots.unpublish(index_dir)
+                # Files of an index saved before snapshots existed; anything
+                # else in the directory is left alone.
+                for p in legacy_index_files(RagConfig(index_dir=index_dir)):
                     try:
                         os.remove(p)
-                    except IsADirectoryError:
+                    except FileNotFoundError:
                         pass
+            get_shared_index(index_dir).invalidate()
             st.success("Index cleared. Please click 'Build/Refresh Index'.")
         except Exception as e:
             st.error(f"Failed to clear index: {e}")
 
     if uploaded_files:
-        os.makedirs(upload_dir, exist_ok=True)
-        for uploaded_file in uploaded_files:
-            file_path = os.path.join(upload_dir, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
         st.success(f"✅ {len(uploaded_files)} file(s) uploaded!")
-        use_uploaded = True
         with st.expander("📄 View uploaded files"):
             for f in uploaded_files:
                 st.write(f"• {f.name} ({f.size / 1024:.1f} KB)")
@@ -71,12 +78,12 @@ with st.sidebar:
     st.header("Settings")
     
     # Show which source will be used
-    if use_uploaded and uploaded_files:
-        st.info("📤 Will use uploaded files to build index")
+    if use_uploaded:
+        st.info("📤 Will add uploaded files to the index (unchanged ones are skipped)")
     else:
         st.info("📁 Will use documents from directory")
     
-    docs_dir = st.text_input("Documents directory (if not using uploads)", value="data", disabled=use_uploaded and bool(uploaded_files))
+    docs_dir = st.text_input("Documents directory (if not using uploads)", value="data", disabled=use_uploaded)
     top_k = st.slider("Top K", min_value=1, max_value=10, value=5, step=1)
     build_clicked = st.button("Build/Refresh Index")
     st.divider()
@@ -127,42 +134,62 @@ def get_pipeline(index_dir, backend, local_model):
     return RagPipeline(cfg)
 
 pipe = get_pipeline(index_dir, backend, local_model)
+shared_index = get_shared_index(index_dir)
 
 if build_clicked:
-    with st.spinner("Building index..."):
-        # Determine which directory to use
-        from src.rag.ingest import load_corpus
-        
-        if use_uploaded and uploaded_files:
-            source_dir = upload_dir
-            source_type = "uploaded files"
+    # Write through a separate pipeline: the shared index may be serving other
+    # sessions, which pick up the change on their next rerun.
+    builder = RagPipeline(pipe.cfg)
+    builder.embedder = pipe.embedder
+    if use_uploaded:
+        try:
+            # Appended to in place, so only the uploads are parsed and embedded.
+            builder.index, _ = shared_index.get()
+        except FileNotFoundError:
+            pass  # first upload: add_uploads builds the index
+        live = builder.index
+        progress_bar = st.progress(0.0, text="Indexing uploads...")
+
+        def on_progress(event):
+            # Parsing fills the first half of the bar, embedding the second.
+            fraction = event["done"] / event["total"] / 2 + (0.5 if event["stage"] == "embedded" else 0.0)
+            progress_bar.progress(min(fraction, 1.0), text=f"{event['file']}: {event['stage']}")
+
+        try:
+            report = builder.add_uploads([(f.name, f.getbuffer()) for f in uploaded_files], progress=on_progress)
+        except ValueError as e:
+            progress_bar.empty()
+            st.error(f"Could not index the uploaded files: {e}")
         else:
-            source_dir = docs_dir
-            source_type = "directory"
-        
-        docs = load_corpus(source_dir)
-        if len(docs) == 0:
-            if use_uploaded and uploaded_files:
-                st.error("No uploaded files found! Please upload PDF or TXT files first.")
-            elif use_uploaded:
-                st.error("No files uploaded yet. Please use the file uploader above.")
+            progress_bar.progress(1.0, text="Done")
+            if builder.index is live:
+                shared_index.written(live)
             else:
-                st.error(f"No documents found in {docs_dir}! Please add .txt or .pdf files or use the file uploader.")
-        else:
-            st.info(f"Found {len(docs)} document(s) from {source_type}: {', '.join([d['id'] for d in docs])}")
-            pipe.build_index(source_dir)
-            # Reload the index after building
-            pipe.load_index()
-            st.success(f"Index built and loaded successfully from {len(docs)} document(s)!")
+                shared_index.invalidate()
+            st.success(
+                f"Added {len(report['added'])} and updated {len(report['changed'])} file(s) "
+                f"({report['embedded_chunks']} new chunks); {len(report['skipped'])} unchanged file(s) skipped."
+            )
+    else:
+        with st.spinner("Building index..."):
+            try:
+                report = builder.build_index(docs_dir)
+            except ValueError as e:
+                report = None
+                st.error(f"{e}. Add .txt or .pdf files to {docs_dir} or use the file uploader.")
+        if report is not None:
+            shared_index.invalidate()
+            st.success(f"Index built and loaded successfully from {len(report['added'])} document(s)!")
 
 # Show current index status
+index_ready = False
 try:
-    pipe.load_index()
-    unique_docs = set(m.get('doc_id', '') for m in pipe.index.chunks)
-    st.sidebar.info(f"📚 Index loaded: {len(unique_docs)} document(s)")
+    pipe.index, summary = shared_index.get()
+    index_ready = True
+    st.sidebar.info(f"📚 Index loaded: {len(summary['documents'])} document(s), {summary['chunks']} chunks")
     with st.sidebar.expander("View indexed documents"):
-        for doc_id in sorted(unique_docs):
-            st.write(f"• {doc_id}")
+        for doc_id, n_chunks in summary["documents"].items():
+            st.write(f"• {doc_id} ({n_chunks} chunks)")
 except FileNotFoundError:
     st.sidebar.warning("⚠️ No index found. Build index first!")
 
@@ -171,22 +198,33 @@ ask = st.button("Ask")
 
 if ask and question.strip():
     try:
-        # Ensure index is loaded
-        try:
-            pipe.load_index()
-        except FileNotFoundError:
+        if not index_ready:
             st.error("Index not found! Please build the index first by clicking 'Build/Refresh Index'.")
             st.stop()
         
-        out = pipe.answer(question, top_k=top_k)
         st.subheader("Answer")
-        st.write(out["answer"])
-
+        answer_box = st.empty()
+        timing_box = st.empty()
         st.subheader("Context")
-        for m in out["passages"]:
-            st.markdown(f"**[{m['doc_id']}#{m['chunk_id']}]** (score={m['score']:.3f}) — `{m.get('source_path','')}`")
-            st.write(m["text"])
-            st.write("---")
+        context_box = st.container()
+
+        # Passages arrive first, then answer tokens as they are generated.
+        text = ""
+        for event in pipe.answer_stream(question, top_k=top_k):
+            if event["type"] == "passages":
+                with context_box:
+                    for m in event["passages"]:
+                        st.markdown(f"**[{m['doc_id']}#{m['chunk_id']}]** (score={m['score']:.3f}) — `{m.get('source_path','')}`")
+                        st.write(m["text"])
+                        st.write("---")
+                answer_box.markdown("_Generating..._")
+            elif event["type"] == "token":
+                text += event["text"]
+                answer_box.markdown(text + "▌")
+            else:
+                answer_box.markdown(event["answer"])
+                ttft = f"{event['ttft_s']:.2f}s" if event["ttft_s"] is not None else "n/a"
+                timing_box.caption(f"Time to first token: {ttft} · total: {event['total_s']:.2f}s")
     except Exception as e:
         st.error(str(e))
 
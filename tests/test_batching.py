@@ -0,0 +1,51 @@
+import pytest
+
+from src.rag.batching import MicroBatcher
+
+
+def test_concurrent_submits_are_coalesced():
+    seen = []
+
+    def run(items):
+        seen.append(list(items))
+        return [x * 2 for x in items]
+
+    batcher = MicroBatcher(run, max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit(i) for i in range(6)]
+    assert [f.result(5) for f in futures] == [0, 2, 4, 6, 8, 10]
+    batcher.close()
+    assert seen == [[0, 1, 2, 3], [4, 5]]
+
+
+def test_batch_errors_propagate_to_every_request():
+    def run(items):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(run, max_batch_size=2, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(2)]
+    for f in futures:
+        with pytest.raises(RuntimeError, match="boom"):
+            f.result(5)
+    batcher.close()
+
+
+def test_local_generate_many_goes_through_the_engine():
+    from src.rag import metrics
+    from src.rag.generator import LocalGenerator
+
+    batches = []
+
+    def generate_batch(prompts, max_new_tokens):
+        batches.append(list(prompts))
+        metrics.current().add("decode", 1.0)
+        return [p.upper() for p in prompts]
+
+    gen = LocalGenerator.__new__(LocalGenerator)
+    gen.batch_size, gen.max_wait_ms, gen._engine = 2, 200.0, None
+    gen._generate_batch = generate_batch
+    timings = metrics.Timings()
+    with metrics.recording(timings):
+        assert gen.generate_many(["a", "b", "c"], max_new_tokens=8) == ["A", "B", "C"]
+    gen.close()
+    assert batches == [["a", "b"], ["c"]]
+    assert timings.spans["decode"] == 2.0 and timings.counts["batch_size"] == 3  # once per batch, not per prompt
@@ -0,0 +1,56 @@
+import numpy as np
+
+from src.rag.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+DOCS = [
+    "The pump failed with error code ERR-4711 during startup.",
+    "Routine maintenance of the pump and the valve.",
+    "Replace part no. PX-220b when the valve leaks.",
+    "The valve, the pump and the motor were inspected.",
+]
+
+
+def test_tokenize_keeps_identifiers_whole():
+    assert tokenize("Error ERR-4711 in v2.3.1, part_no PX-220b.") == ["error", "err-4711", "in", "v2.3.1", "part_no", "px-220b"]
+
+
+def test_search_ranks_exact_identifier_first():
+    bm25 = BM25Index.build(DOCS)
+    scores, idxs = bm25.search("err-4711", top_k=3)
+    assert idxs.tolist() == [0]
+    scores, idxs = bm25.search("pump valve", top_k=2)
+    assert len(idxs) == 2 and np.all(np.diff(scores) <= 0)
+    assert len(bm25.search("nothing matches this", top_k=3)[1]) == 0
+
+
+def test_save_load_roundtrip(tmp_path):
+    bm25 = BM25Index.build(DOCS)
+    prefix = str(tmp_path / "bm25")
+    bm25.save(prefix)
+    assert BM25Index.exists(prefix)
+    loaded = BM25Index.load(prefix)
+    assert loaded.docs.dtype == np.int32 and loaded.indptr.dtype == np.int64
+    for q in ("px-220b valve", "the pump"):
+        s1, i1 = bm25.search(q, top_k=4)
+        s2, i2 = loaded.search(q, top_k=4)
+        assert i1.tolist() == i2.tolist() and np.allclose(s1, s2)
+
+
+def test_reciprocal_rank_fusion_prefers_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+    assert [idx for idx, _ in fused] == [1, 3, 2, 4]
+
+
+def test_extend_and_select_match_a_fresh_build():
+    extra = ["New pump ERR-9 fitted.", "Valve only."]
+    extended = BM25Index.build(DOCS).extend(extra)
+    fresh = BM25Index.build(DOCS + extra)
+    keep = np.array([True, False, True, False, True, True])
+    selected = extended.select(keep)
+    kept = BM25Index.build([d for d, k in zip(DOCS + extra, keep) if k])
+    for query in ("pump", "err-9", "valve err-4711"):
+        for a, b in ((extended, fresh), (selected, kept)):
+            sa, ia = a.search(query, top_k=5)
+            sb, ib = b.search(query, top_k=5)
+            assert ia.tolist() == ib.tolist() and np.allclose(sa, sb)
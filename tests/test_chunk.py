@@ -9,3 +9,39 @@ def test_chunk_text_words_basic():
 
 
 
+
+
+def test_word_spans_match_word_chunks():
+    from src.rag.chunk import iter_word_spans
+
+    text = "  one two\nthree  four five six\tseven eight nine ten eleven "
+    for size, overlap in [(4, 2), (3, 0), (5, 1), (20, 5)]:
+        spans = list(iter_word_spans(text, size, overlap))
+        assert [" ".join(text[s:e].split()) for s, e in spans] == chunk_text_words(text, size, overlap)
+    assert list(iter_word_spans("   ", 4, 2)) == []
+
+
+def test_chunk_documents_returns_spans_into_document_text():
+    from src.rag.chunk import Chunk, chunk_documents, chunk_spans
+
+    docs = [{"id": "a.txt", "text": "alpha beta gamma delta", "source_path": "d/a.txt"}, {"id": "b.txt", "text": "x y"}]
+    assert chunk_spans(docs, 3, 1) == [(0, 0, 16), (0, 11, 22), (1, 0, 3)]
+    chunks = chunk_documents(docs, 3, 1)
+    assert all(isinstance(c, Chunk) and c.doc is docs[int(c["doc_id"] == "b.txt")] for c in chunks)
+    assert dict(chunks[1]) == {"doc_id": "a.txt", "chunk_id": 1, "text": "gamma delta", "source_path": "d/a.txt"}
+    assert [c["chunk_id"] for c in chunks] == [0, 1, 0]
+
+
+def test_span_chunk_text_is_whitespace_normalized_like_word_chunks(tmp_path):
+    from src.rag.chunk import chunk_documents
+    from src.rag.chunk_store import ChunkStore, write_store
+
+    text = "hello\n\n  world   foo\tbar\r\nbaz"
+    docs = [{"id": "a.txt", "text": text}]
+    chunks = chunk_documents(docs, 4, 1)
+    assert [c["text"] for c in chunks] == chunk_text_words(text, 4, 1) == ["hello world foo bar", "bar baz"]
+    assert text[chunks[0].start:chunks[0].end] == "hello\n\n  world   foo\tbar"  # the span itself is untouched
+
+    prefix = str(tmp_path / "chunks")
+    write_store(prefix, chunks)
+    assert [c["text"] for c in ChunkStore(prefix)] == ["hello world foo bar", "bar baz"]
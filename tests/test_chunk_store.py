@@ -0,0 +1,97 @@
+import json
+
+from src.rag.chunk import Chunk, chunk_documents
+from src.rag.chunk_store import ChunkStore, ChunkStoreWriter, convert_metadata_json, store_exists, write_store
+
+
+CHUNKS = [
+    {"doc_id": "a.txt", "chunk_id": 0, "text": "héllo wörld", "source_path": "data/a.txt"},
+    {"doc_id": "a.txt", "chunk_id": 1, "text": "", "source_path": "data/a.txt"},
+    {"doc_id": "b.pdf", "chunk_id": 0, "text": "second doc", "source_path": None, "page": 3},
+]
+
+
+def test_store_roundtrip(tmp_path):
+    prefix = str(tmp_path / "chunks")
+    assert write_store(prefix, CHUNKS) == 3
+    store = ChunkStore(prefix)
+    assert len(store) == 3
+    assert list(store) == CHUNKS
+    assert store[-1] == CHUNKS[2]
+    assert store[0:2] == CHUNKS[0:2]
+    assert len(store.docs) == 2
+    assert store.doc_ids() == ["a.txt", "b.pdf"]
+
+
+def test_empty_store(tmp_path):
+    prefix = str(tmp_path / "chunks")
+    write_store(prefix, [])
+    assert len(ChunkStore(prefix)) == 0
+
+
+def test_convert_metadata_json(tmp_path):
+    meta = tmp_path / "metadata.json"
+    meta.write_text(json.dumps(CHUNKS), encoding="utf-8")
+    prefix = str(tmp_path / "chunks")
+    assert convert_metadata_json(str(meta), prefix) == 3
+    assert not meta.exists()
+    assert store_exists(prefix)
+    assert list(ChunkStore(prefix)) == CHUNKS
+
+
+def test_span_chunks_store_document_text_once(tmp_path):
+    text = " ".join(f"wörd{i}" for i in range(100))
+    chunks = chunk_documents([{"id": "a.txt", "text": text, "source_path": "data/a.txt"}], 30, 10)
+    prefix = str(tmp_path / "chunks")
+    writer = ChunkStoreWriter(prefix)
+    writer.append(chunks[:2])
+    writer.append(chunks[2:])
+    writer.close()
+    store = ChunkStore(prefix)
+    assert list(store) == [dict(c) for c in chunks]
+    assert len(store.blob) == len(text.encode("utf-8"))
+
+    # Reading spans back and re-writing them keeps a single copy as well.
+    respanned = store.span_chunks(0, len(store))
+    assert [(c.start, c.end) for c in respanned] == [(c.start, c.end) for c in chunks]
+    write_store(str(tmp_path / "copy"), respanned)
+    assert list(ChunkStore(str(tmp_path / "copy"))) == list(store)
+
+
+def test_append_mode_adds_rows_and_abort_restores(tmp_path):
+    prefix = str(tmp_path / "chunks")
+    write_store(prefix, CHUNKS[:2])
+    text = "alpha beta gamma delta"
+    spans = chunk_documents([{"id": "a.txt", "text": text, "source_path": "data/a.txt"}], 2, 0)
+
+    writer = ChunkStoreWriter(prefix, append=True)
+    writer.append(spans + CHUNKS[2:])
+    writer.close()
+    store = ChunkStore(prefix)
+    assert list(store) == CHUNKS[:2] + [dict(c) for c in spans] + CHUNKS[2:]
+    # The re-added a.txt gets its own docs entry, separate from its old rows.
+    assert [d[0] for d in store.docs] == ["a.txt", "a.txt", "b.pdf"]
+    assert [c.start for c in store.span_chunks(2, 4)] == [c.start for c in spans]
+
+    writer = ChunkStoreWriter(prefix, append=True)
+    writer.append(CHUNKS)
+    writer.abort()
+    assert list(ChunkStore(prefix)) == list(store)
+
+
+def test_span_chunk_extras_survive_rewrites_and_late_updates(tmp_path):
+    text = " ".join(f"word{i}" for i in range(40))
+    chunks = chunk_documents([{"id": "a.txt", "text": text, "source_path": "data/a.txt"}], 10, 0)
+    ref = {"doc_id": "b.txt", "chunk_id": 0, "source_path": None}
+    chunks[1] = Chunk(chunks[1].doc, 1, chunks[1].start, chunks[1].end, {"duplicates": [ref]})
+    prefix = str(tmp_path / "chunks")
+    writer = ChunkStoreWriter(prefix)
+    writer.append(chunks)
+    writer.set_extra(3, {"duplicates": [ref, ref]})
+    writer.close()
+    store = ChunkStore(prefix)
+    assert [len(c.get("duplicates", [])) for c in store] == [0, 1, 0, 2]
+    assert store[1]["text"] == chunks[1]["text"]
+
+    write_store(str(tmp_path / "copy"), store.span_chunks(0, len(store)))
+    assert list(ChunkStore(str(tmp_path / "copy"))) == list(store)
@@ -0,0 +1,39 @@
+import numpy as np
+
+from src.rag.dedup import NearDuplicateIndex, collapse, drop_references, find_duplicates
+
+
+WORDS = [f"w{i}" for i in range(400)]
+
+
+def test_near_duplicates_collapse_into_the_first_copy():
+    base = " ".join(WORDS[:200])
+    texts = [
+        base,
+        " ".join(WORDS[200:400]),
+        base.replace("w100", "changed", 1),  # one word edited
+        base.upper(),  # case is ignored
+        " ".join(WORDS[:100] + WORDS[200:300]),  # half shared: not a duplicate
+    ]
+    reps = find_duplicates(texts, NearDuplicateIndex(threshold=0.9))
+    assert reps.tolist() == [0, 1, 0, 0, 4]
+
+    # Registration order decides which copy is kept.
+    reps = find_duplicates(texts, NearDuplicateIndex(threshold=0.9), order=[2, 0, 1, 3, 4])
+    assert reps.tolist() == [2, 1, 2, 2, 4]
+
+
+def test_collapse_keeps_every_source_reference():
+    chunks = [
+        {"doc_id": "a.txt", "chunk_id": 0, "text": "x", "source_path": "d/a.txt"},
+        {"doc_id": "b.txt", "chunk_id": 3, "text": "x", "source_path": "d/b.txt",
+         "duplicates": [{"doc_id": "c.txt", "chunk_id": 1, "source_path": None}]},
+        {"doc_id": "b.txt", "chunk_id": 4, "text": "y", "source_path": "d/b.txt"},
+    ]
+    out = collapse(chunks, np.array([0, 0, 2]))
+    assert out[1] is None and out[2] is chunks[2]
+    assert [(r["doc_id"], r["chunk_id"]) for r in out[0]["duplicates"]] == [("b.txt", 3), ("c.txt", 1)]
+    assert "duplicates" not in chunks[0]
+
+    assert [r["doc_id"] for r in drop_references(out[0], {"c.txt"})["duplicates"]] == ["b.txt"]
+    assert "duplicates" not in drop_references(out[0], {"b.txt", "c.txt"})
@@ -0,0 +1,67 @@
+import numpy as np
+
+from src.rag.embedding_cache import EmbeddingCache, text_key
+
+
+def _vecs(n, dim=4, seed=0):
+    return np.random.default_rng(seed).random((n, dim), dtype=np.float32)
+
+
+def test_text_key_normalizes_whitespace_and_includes_model():
+    assert text_key("m", "hello   world\n") == text_key("m", " hello world")
+    assert text_key("m", "hello world") != text_key("other", "hello world")
+
+
+def test_cache_roundtrip_and_persistence(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=10)
+    texts = ["a", "b", "c"]
+    _, keys, missing = cache.lookup(texts)
+    assert missing == [0, 1, 2]
+    vecs = _vecs(3)
+    cache.put(keys, vecs)
+    cache.flush()
+
+    reopened = EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=10)
+    out, _, missing = reopened.lookup(["c", "a", "z"])
+    assert missing == [2]
+    np.testing.assert_allclose(out[:2], vecs[[2, 0]])
+    assert reopened.hit_rate == 2 / 3
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=2)
+    _, keys, _ = cache.lookup(["a", "b"])
+    cache.put(keys, _vecs(2))
+    cache.lookup(["a"])  # "b" is now the oldest
+    _, keys, _ = cache.lookup(["c"])
+    cache.put(keys, _vecs(1, seed=1))
+
+    _, _, missing = cache.lookup(["a", "b", "c"])
+    assert missing == [1]
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+
+def test_second_opener_is_read_only_and_skips_reused_slots(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=2)
+    _, keys, _ = writer.lookup(["a", "b"])
+    writer.put(keys, _vecs(2))
+    writer.flush()
+
+    reader = EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=2)
+    assert reader.read_only and not writer.read_only
+    _, keys, _ = reader.lookup(["c"])
+    reader.put(keys, _vecs(1, seed=1))  # ignored
+    assert len(reader) == 2 and reader.stats()["read_only"]
+
+    # The writer evicts "a" (least recently used) for "c"; the reader must not serve c's vector as "a".
+    writer.lookup(["b"])
+    _, keys, _ = writer.lookup(["c"])
+    writer.put(keys, _vecs(1, seed=1))
+    writer.flush()
+    out, _, missing = reader.lookup(["a", "b"])
+    assert missing == [0]
+    np.testing.assert_allclose(out[1], _vecs(2)[1])
+
+    writer.close()
+    assert not EmbeddingCache(str(tmp_path), "m", dim=4, max_entries=2).read_only
@@ -1,3 +1,5 @@
+import numpy as np
+
 from src.rag.embeddings import EmbeddingModel
 
 
@@ -8,4 +10,53 @@ def test_embeddings_shape():
     assert vecs.shape[1] > 10
 
 
+class _LengthModel:
+    """Stands in for SentenceTransformer: row = [len(text), batch size]."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        self.batches.append([len(t) for t in texts])
+        return np.array([[len(t), len(texts)] for t in texts], dtype="float32")
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+
+def test_parallel_encode_sorts_by_length_and_restores_order(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import src.rag.embeddings as embeddings
+
+    worker = _LengthModel()
+    monkeypatch.setattr(embeddings, "_worker_model", worker)
+    model = EmbeddingModel("unused", batch_size=4, workers=2)
+    model._model = _LengthModel()
+    model._pool = ThreadPoolExecutor(max_workers=2)
+    texts = ["x" * n for n in (5, 1, 9, 3, 7, 2, 8, 4, 6, 10)]
+    out = model.encode(texts)
+    model.close()
+    assert out[:, 0].tolist() == [len(t) for t in texts]
+    assert sorted(worker.batches) == [[2, 1], [6, 5, 4, 3], [10, 9, 8, 7]]
+    assert model.throughput()["chunks"] == 10 and model.throughput()["workers"] == 2
+
+
+def test_pooled_encode_never_loads_the_model_in_the_parent(monkeypatch, tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import src.rag.embeddings as embeddings
 
+    monkeypatch.setattr(embeddings, "_worker_model", _LengthModel())
+    monkeypatch.setattr(EmbeddingModel, "load", lambda self: (_ for _ in ()).throw(AssertionError("parent model loaded")))
+    texts = ["x" * n for n in range(1, 11)]
+    hits = []
+    for _ in range(2):
+        model = EmbeddingModel("unused", cache_dir=str(tmp_path), batch_size=4, workers=2)
+        model._pool = ThreadPoolExecutor(max_workers=2)
+        out = model.encode(texts)
+        hits.append(model.cache.hits)
+        model.close()
+        assert out[:, 0].tolist() == [len(t) for t in texts] and model.dim == 2
+    # The second model found the dimension in the cache and served every text from it.
+    assert hits == [0, len(texts)] and model.throughput()["chunks"] == 0
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from src.rag.chunk_store import ChunkStore, write_store
+from src.rag.filters import MetadataIndex
+from src.rag.index_faiss import FaissIndex
+
+
+def _chunks(n):
+    # Doc i % 5, under docs/hr/ for even docs, with a "lang" extra field.
+    return [
+        {
+            "doc_id": f"d{i % 5}",
+            "chunk_id": i // 5,
+            "text": f"text {i} shared",
+            "source_path": f"docs/{'hr' if i % 5 % 2 == 0 else 'eng'}/d{i % 5}.txt",
+            "lang": "de" if i % 3 == 0 else "en",
+        }
+        for i in range(n)
+    ]
+
+
+def _unit(n, dim=16, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _expected(chunks, pred):
+    return np.array([pred(c) for c in chunks])
+
+
+def test_mask_matches_chunk_store_and_list(tmp_path):
+    chunks = _chunks(40)
+    write_store(str(tmp_path / "chunks"), chunks)
+    for source in (chunks, ChunkStore(str(tmp_path / "chunks"))):
+        md = MetadataIndex(source)
+        assert md.mask(None) is None and md.mask({}) is None
+        assert (md.mask({"doc_id": "d1"}) == _expected(chunks, lambda c: c["doc_id"] == "d1")).all()
+        assert (md.mask({"doc_id": ["d1", "d3"], "chunk_id": [0, 2]}) == _expected(
+            chunks, lambda c: c["doc_id"] in ("d1", "d3") and c["chunk_id"] in (0, 2))).all()
+        assert (md.mask({"source_path_prefix": "docs/hr/", "lang": "de"}) == _expected(
+            chunks, lambda c: c["source_path"].startswith("docs/hr/") and c["lang"] == "de")).all()
+        assert not md.mask({"doc_id": "missing"}).any()
+
+
+@pytest.mark.parametrize("index_type,storage", [
+    ("flat", "float32"), ("ivf_flat", "float32"), ("hnsw", "float32"), ("ivf_pq", "float32"),
+    ("flat", "int8"), ("flat", "binary"),
+])
+def test_filtered_search_only_returns_matching_chunks(tmp_path, index_type, storage):
+    vecs, chunks = _unit(600), _chunks(600)
+    params = {"nlist": 8, "pq_m": 4, "pq_nbits": 6, "nprobe": 8, "storage": storage}
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type=index_type, index_params=params)
+    idx.build(vecs, chunks)
+    idx.save()
+    idx.load()
+
+    filters = {"doc_id": ["d1", "d2"], "lang": "en"}
+    hits = idx.search(vecs[0], top_k=10, filters=filters)
+    assert len(hits) == 10
+    assert all(h["doc_id"] in ("d1", "d2") and h["lang"] == "en" for h in hits)
+    # A query that is itself a matching chunk still finds that chunk first.
+    assert idx.search(vecs[7], top_k=3, filters=filters)[0]["chunk_id"] == 1
+    assert idx.search_many(vecs[:2], top_k=5, filters={"doc_id": "nope"}) == [[], []]
+
+    lexical = idx.search_lexical("shared", top_k=20, filters={"source_path_prefix": "docs/eng/"})
+    assert len(lexical) == 20 and all(h["source_path"].startswith("docs/eng/") for h in lexical)
+
+
+def test_id_selector_rejects_ids_past_the_mask():
+    from src.rag.filters import id_selector
+
+    mask = np.zeros(11, dtype=bool)
+    mask[[0, 7, 10]] = True
+    selector = id_selector(mask)
+    assert [i for i in range(64) if selector.is_member(i)] == [0, 7, 10]
+
+
+def test_store_filters_use_postings_written_with_the_store(tmp_path, monkeypatch):
+    from src.rag.chunk_store import ChunkStoreWriter
+
+    chunks = _chunks(40)
+    prefix = str(tmp_path / "chunks")
+    writer = ChunkStoreWriter(prefix)
+    writer.append(chunks[:30])
+    writer.set_extra(0, {"lang": "fr"})
+    writer.close()
+    writer = ChunkStoreWriter(prefix, append=True)
+    writer.append(chunks[30:])
+    writer.close()
+    chunks[0]["lang"] = "fr"
+
+    monkeypatch.setattr(ChunkStore, "_decode", lambda self, i: pytest.fail("row decoded"))
+    md = MetadataIndex(ChunkStore(prefix))
+    for lang in ("de", "en", "fr"):
+        assert (md.mask({"lang": lang, "chunk_id": [0, 1, 7]}) == _expected(
+            chunks, lambda c: c["lang"] == lang and c["chunk_id"] in (0, 1, 7))).all()
+    assert not md.mask({"unknown": 1}).any()
+    # A view limited to the first rows only sees their postings.
+    assert MetadataIndex(ChunkStore(prefix, 20)).mask({"lang": "de"}).sum() == 6
@@ -0,0 +1,246 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.rag import snapshots
+from src.rag.index_faiss import FaissIndex
+
+
+def _unit(n, dim=8, seed=0):
+    v = np.random.default_rng(seed).random((n, dim), dtype=np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _centered(n, dim, seed=0):
+    # Binary codes keep one sign bit per dimension, so use zero-mean vectors.
+    v = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _chunks(n):
+    return [{"doc_id": f"d{i}", "chunk_id": 0, "text": f"text {i}", "source_path": None} for i in range(n)]
+
+
+def test_streamed_index_matches_build(tmp_path):
+    vecs, chunks = _unit(10), _chunks(10)
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    idx.open_stream()
+    for s in range(0, 10, 4):
+        idx.add(vecs[s:s + 4], chunks[s:s + 4])
+    idx.close_stream()
+
+    idx.load()
+    assert list(idx.chunks) == chunks
+    hits = idx.search(vecs[7], top_k=1)
+    assert hits[0]["doc_id"] == "d7"
+
+
+def test_abort_stream_leaves_no_partial_metadata(tmp_path):
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    idx.open_stream()
+    idx.add(_unit(2), _chunks(2))
+    idx.abort_stream()
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "ivf_pq", "hnsw", "opq_ivf_pq"])
+def test_index_types_roundtrip(tmp_path, index_type):
+    vecs, chunks = _unit(600, dim=16), _chunks(600)
+    params = {"nlist": 8, "pq_m": 4, "pq_nbits": 6, "nprobe": 8, "ef_search": 32}
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type=index_type, index_params=params)
+    idx.build(vecs, chunks)
+    idx.save()
+
+    loaded = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    loaded.load()
+    assert loaded.index_type == index_type
+    assert loaded.params["nprobe"] == 8 and loaded.params["ef_search"] == 32
+    hits = loaded.search(vecs[42], top_k=5)
+    assert "d42" in [h["doc_id"] for h in hits]
+    # Exact for every type: PQ types keep the embeddings in vectors.f32.
+    assert loaded.has_exact_vectors()
+    np.testing.assert_allclose(loaded.vectors(), vecs, atol=1e-6)
+
+
+def test_pq_falls_back_to_flat_for_tiny_corpus(tmp_path):
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type="ivf_pq", index_params={"pq_m": 4})
+    idx.build(_unit(20, dim=16), _chunks(20))
+    assert idx.index_type == "flat"
+    assert idx.configured_type == "ivf_pq"
+
+
+def test_search_many_matches_single_queries(tmp_path):
+    vecs, chunks = _unit(50), _chunks(50)
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    idx.build(vecs, chunks)
+    batched = idx.search_many(vecs[[3, 17, 42]], top_k=4)
+    assert len(batched) == 3
+    for row, q in zip(batched, (3, 17, 42)):
+        assert row == idx.search(vecs[q], top_k=4)
+        assert row[0]["doc_id"] == f"d{q}"
+
+
+@pytest.mark.parametrize("index_type,storage", [("flat", "float16"), ("flat", "int8"), ("flat", "binary"), ("hnsw", "int8"), ("ivf_flat", "float16")])
+def test_quantized_storage_rescores_with_exact_vectors(tmp_path, index_type, storage):
+    vecs, chunks = _centered(300, dim=32), _chunks(300)
+    params = {"storage": storage, "nlist": 4, "nprobe": 4}
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type=index_type, index_params=params)
+    idx.build(vecs, chunks)
+    idx.save()
+
+    loaded = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    loaded.load()
+    assert loaded.storage == storage
+    np.testing.assert_array_equal(loaded.vectors(), vecs)
+    hits = loaded.search(vecs[42], top_k=3)
+    assert hits[0]["doc_id"] == "d42"
+    # Re-scored results carry exact inner products.
+    assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_streamed_binary_index_matches_build(tmp_path):
+    vecs, chunks = _centered(40, dim=16), _chunks(40)
+    idx = FaissIndex(str(tmp_path / "s"), "faiss.index", "metadata.json", index_params={"storage": "binary"})
+    idx.open_stream()
+    for s in range(0, 40, 16):
+        idx.add(vecs[s:s + 16], chunks[s:s + 16])
+    idx.close_stream()
+    idx.load()
+    np.testing.assert_array_equal(idx.vectors(), vecs)
+    assert [h["doc_id"] for h in idx.search(vecs[7], top_k=2)][0] == "d7"
+
+
+def test_storage_rejects_pq_and_non_flat_binary(tmp_path):
+    for index_type, storage in [("ivf_pq", "int8"), ("hnsw", "binary")]:
+        idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type=index_type, index_params={"storage": storage})
+        with pytest.raises(ValueError):
+            idx.build(_unit(300, dim=16), _chunks(300))
+
+
+def _doc_chunks(doc_ids, per_doc=4):
+    return [{"doc_id": d, "chunk_id": j, "text": f"{d} part{j}", "source_path": None} for d in doc_ids for j in range(per_doc)]
+
+
+@pytest.mark.parametrize("index_type,storage", [("flat", "float32"), ("hnsw", "float32"), ("ivf_flat", "int8"), ("flat", "binary")])
+def test_in_place_updates_keep_stable_ids(tmp_path, index_type, storage):
+    vecs = _centered(200, 16)
+    params = {"nlist": 4, "storage": storage}
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_type=index_type, index_params=params, compact_threshold=0)
+    idx.build(vecs, _doc_chunks([f"d{i}" for i in range(50)]))
+    idx.save()
+    idx.load()
+    assert idx.search(vecs[9], top_k=1)[0]["id"] == 9
+
+    assert idx.delete_document("d2") == 4
+    assert all(h["doc_id"] != "d2" for h in idx.search(vecs[9], top_k=20))
+    new = _centered(4, 16, seed=1)
+    assert idx.update_document("d3", new, _doc_chunks(["d3"])).tolist() == [200, 201, 202, 203]
+    assert idx.add_documents(_centered(4, 16, seed=2), _doc_chunks(["d50"])).tolist() == [204, 205, 206, 207]
+    with pytest.raises(KeyError):
+        idx.delete_document("d2")
+
+    reloaded = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", compact_threshold=0)
+    reloaded.load()
+    assert reloaded.tombstone_ratio() == pytest.approx(8 / 208)
+    assert reloaded.search(new[1], top_k=1)[0]["id"] == 201
+    assert reloaded.search_lexical("d3 part2", top_k=1)[0]["id"] == 202
+    assert all(h["doc_id"] not in ("d2",) and h["id"] not in range(12, 16) for h in reloaded.search(vecs[13], top_k=30))
+
+    remap = reloaded.compact()
+    assert (remap == -1).sum() == 8 and remap[200] == 192
+    reloaded = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    reloaded.load()
+    assert len(reloaded.chunks) == 200 and reloaded.tombstone_ratio() == 0
+    assert reloaded.search(new[1], top_k=1)[0]["id"] == 201
+    assert reloaded.search(vecs[40], top_k=1)[0]["id"] == 40
+    assert reloaded.search_lexical("d50 part0", top_k=1)[0]["id"] == 204
+
+
+def test_compaction_runs_in_background_past_threshold(tmp_path):
+    vecs = _unit(40)
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", compact_threshold=0.2)
+    idx.build(vecs, _doc_chunks([f"d{i}" for i in range(10)]))
+    idx.save()
+    idx.load()
+    remaps = []
+    idx.on_compact = remaps.append
+    idx.delete_document("d0")
+    idx.wait_for_compaction()
+    assert not remaps and idx.tombstone_ratio() == pytest.approx(0.1)
+    idx.delete_document("d1")
+    idx.wait_for_compaction()
+    assert len(remaps) == 1 and idx.tombstone_ratio() == 0
+    assert len(idx.chunks) == 32 and idx.search(vecs[20], top_k=1)[0]["id"] == 20
+
+
+def test_rebuild_publishes_new_snapshot_while_readers_keep_theirs(tmp_path):
+    vecs = _unit(20)
+    writer = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", keep_snapshots=2)
+    writer.build(vecs[:10], _chunks(10))
+    writer.save()
+    reader = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    reader.load()
+
+    for _ in range(3):
+        writer.build(vecs[10:], _chunks(10))
+        writer.save()
+    assert sorted(p.name for p in (tmp_path / "snapshots").iterdir()) == ["v000003", "v000004"]
+    assert reader.search(vecs[3], top_k=1)[0]["text"] == "text 3"  # its files are still mapped
+    with pytest.raises(RuntimeError):
+        reader.delete_document("d3")  # would write on top of an outdated snapshot
+
+    fresh = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    fresh.load()
+    assert fresh.search(vecs[13], top_k=1)[0]["text"] == "text 3"
+    assert fresh.dir == str(tmp_path / "snapshots" / "v000004")
+
+
+def test_failed_update_keeps_the_replaced_document_live(tmp_path):
+    vecs = _unit(8)
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", compact_threshold=0)
+    idx.build(vecs, _doc_chunks(["d0", "d1"]))
+    idx.save()
+    idx.load()
+    with pytest.raises(ValueError):
+        idx.update_document("d0", _unit(4, dim=4), _doc_chunks(["d0"]))
+
+    def broken(vectors):
+        raise OSError("disk full")
+
+    idx._index_add = broken
+    with pytest.raises(OSError):
+        idx.add_documents(_unit(4, seed=1), _doc_chunks(["d0"]))
+    assert idx.document_counts() == {"d0": 4, "d1": 4}
+    assert idx.search(vecs[1], top_k=1)[0]["doc_id"] == "d0"
+    assert [s["name"] for s in snapshots.list_snapshots(str(tmp_path))] == ["v000001"]
+
+
+def test_in_place_appends_copy_the_files_they_extend(tmp_path):
+    vecs = _centered(60, 16)
+    params = {"storage": "int8"}  # keeps vectors.f32
+    idx = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", index_params=params, compact_threshold=0, keep_snapshots=0)
+    idx.build(vecs[:40], _doc_chunks([f"d{i}" for i in range(10)]))
+    idx.save()
+    idx.load()
+    reader = FaissIndex(str(tmp_path), "faiss.index", "metadata.json")
+    reader.load()
+    first = idx.dir
+    sizes = {name: os.path.getsize(os.path.join(first, name)) for name in ("chunks.rows", "chunks.blob", "vectors.f32")}
+    idx.add_documents(vecs[40:44], _doc_chunks(["d10"]))
+    for name, size in sizes.items():
+        assert not os.path.samefile(os.path.join(first, name), os.path.join(idx.dir, name))
+        assert os.path.getsize(os.path.join(first, name)) == size
+    assert len(reader.chunks) == len(reader.vectors()) == 40
+    assert reader.search_lexical("d10 part0", top_k=1)[0]["doc_id"] != "d10"
+
+    # Rolled back, the first snapshot is unchanged and can be appended to again.
+    snapshots.switch(str(tmp_path), os.path.basename(first))
+    rolled = FaissIndex(str(tmp_path), "faiss.index", "metadata.json", compact_threshold=0, keep_snapshots=0)
+    rolled.load()
+    assert len(rolled.chunks) == 40 and "d10" not in rolled.document_counts()
+    rolled.add_documents(vecs[44:48], _doc_chunks(["d11"]))
+    assert rolled.search(vecs[45], top_k=1)[0]["doc_id"] == "d11"
+    assert len(rolled.chunks) == 44 and "d10" not in rolled.document_counts()
+    idx.load()
+    assert idx.search(vecs[45], top_k=1)[0]["doc_id"] == "d11"
@@ -0,0 +1,68 @@
+import os
+
+from src.rag import ingest
+from src.rag.ingest import iter_document_paths, iter_documents, iter_loaded, load_document, load_document_bytes
+
+
+def _write_pdf(path, pages):
+    # Minimal uncompressed PDF with one Helvetica text line per page.
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>"
+        )
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def _corpus(tmp_path):
+    for i in range(6):
+        (tmp_path / f"doc{i}.txt").write_text(f"text document number {i}", encoding="utf-8")
+    (tmp_path / "empty.txt").write_text("   ", encoding="utf-8")
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    _write_pdf(str(tmp_path / "paged.pdf"), [f"page {i} words" for i in range(5)])
+    return str(tmp_path)
+
+
+def test_parallel_ingest_matches_sequential(tmp_path):
+    docs_dir = _corpus(tmp_path)
+    sequential = list(iter_documents(docs_dir))
+    parallel = list(iter_documents(docs_dir, workers=3, max_in_flight=2))
+    assert parallel == sequential
+    assert {d["id"] for d in sequential} == {f"doc{i}.txt" for i in range(6)} | {"paged.pdf"}
+
+
+def test_large_pdf_split_into_page_ranges(tmp_path, monkeypatch):
+    docs_dir = _corpus(tmp_path)
+    monkeypatch.setattr(ingest, "LARGE_PDF_BYTES", 0)
+    paths = sorted(iter_document_paths(docs_dir))
+    loaded = dict(iter_loaded(paths, docs_dir, workers=2, pdf_pages_per_task=2))
+    pdf = loaded[os.path.join(docs_dir, "paged.pdf")]
+    assert pdf["text"] == ingest.load_pdf(os.path.join(docs_dir, "paged.pdf"))
+    assert "page 4 words" in pdf["text"]
+    assert loaded[os.path.join(docs_dir, "broken.pdf")] is None
+    assert list(loaded) == paths
+
+
+def test_in_memory_files_load_like_files_on_disk(tmp_path):
+    docs_dir = _corpus(tmp_path)
+    for name in ("doc0.txt", "paged.pdf"):
+        data = memoryview((tmp_path / name).read_bytes())  # what UploadedFile.getbuffer() returns
+        from_disk = load_document(os.path.join(docs_dir, name), docs_dir)
+        assert load_document_bytes(name, data) == dict(from_disk, source_path=None)
+    assert load_document_bytes("broken.pdf", b"not a pdf") is None
+    assert load_document_bytes("empty.txt", b"   ") is None
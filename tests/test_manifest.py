@@ -0,0 +1,45 @@
+import os
+
+from src.rag.manifest import file_entry, plan_incremental
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_plan_incremental_classifies_files(tmp_path):
+    docs = str(tmp_path)
+    a, b, c = (os.path.join(docs, n) for n in ("a.txt", "b.txt", "c.txt"))
+    _write(a, "alpha")
+    _write(b, "bravo")
+    previous = {}
+    for i, p in enumerate((a, b)):
+        e = file_entry(p, docs)
+        e["chunk_start"], e["chunk_end"] = i, i + 1
+        previous[e["path"]] = e
+    previous["gone.txt"] = dict(previous["a.txt"], path="gone.txt")
+
+    _write(b, "bravo changed")
+    _write(c, "charlie")
+    plan, deleted = plan_incremental([a, b, c], docs, previous)
+
+    actions = {e["path"]: action for action, e in plan}
+    assert actions == {"a.txt": "skip", "b.txt": "change", "c.txt": "add"}
+    assert deleted == ["gone.txt"]
+    assert plan[0][1]["chunk_end"] == 1
+
+
+def test_plan_incremental_touched_file_with_same_content_is_skipped(tmp_path):
+    docs = str(tmp_path)
+    a = os.path.join(docs, "a.txt")
+    _write(a, "alpha")
+    e = file_entry(a, docs)
+    e["chunk_start"], e["chunk_end"] = 3, 5
+    os.utime(a, (e["mtime"] + 10, e["mtime"] + 10))
+
+    plan, _ = plan_incremental([a], docs, {"a.txt": e})
+    action, entry = plan[0]
+    assert action == "skip"
+    assert (entry["chunk_start"], entry["chunk_end"]) == (3, 5)
+    assert entry["mtime"] == e["mtime"] + 10
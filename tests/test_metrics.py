@@ -0,0 +1,55 @@
+import threading
+
+from src.rag import metrics
+from src.rag.metrics import PrometheusSink, Timings
+
+
+def test_spans_are_no_ops_without_active_timings():
+    assert metrics.current() is None
+    assert metrics.span("embed") is metrics.span("search")
+    fn = len
+    assert metrics.timed("tokenize", fn) is fn
+    metrics.count("queries")  # nothing to record into, must not fail
+
+
+def test_recording_collects_spans_and_counts_across_threads():
+    timings = Timings()
+    with metrics.recording(timings):
+        with metrics.span("embed"):
+            pass
+        with metrics.span("embed"):
+            pass
+        metrics.timed("tokenize", len)("abc")
+        metrics.count("queries", 2)
+
+        def worker():
+            # New threads do not inherit the context; they record explicitly.
+            assert metrics.current() is None
+            with metrics.recording(timings):
+                metrics.count("queries")
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+    assert metrics.current() is None
+    out = timings.as_dict()
+    assert set(out["stages_ms"]) == {"embed", "tokenize"}
+    assert out["counts"] == {"queries": 3}
+    assert out["total_ms"] >= out["stages_ms"]["embed"]
+
+
+def test_prometheus_sink_renders_histograms_and_counters():
+    sink = PrometheusSink(buckets=(0.01, 0.1))
+    timings = Timings()
+    timings.add("search", 0.05)
+    timings.count("prompt_tokens", 120)
+    sink.record("answer", timings)
+    sink.record("answer", timings)
+    text = sink.render()
+    assert "# TYPE rag_stage_duration_seconds histogram" in text
+    assert 'rag_stage_duration_seconds_bucket{operation="answer",stage="search",le="0.01"} 0' in text
+    assert 'rag_stage_duration_seconds_bucket{operation="answer",stage="search",le="0.1"} 2' in text
+    assert 'rag_stage_duration_seconds_count{operation="answer",stage="search"} 2' in text
+    assert 'rag_stage_duration_seconds_count{operation="answer",stage="total"} 2' in text
+    assert "# TYPE rag_prompt_tokens_total counter" in text
+    assert 'rag_prompt_tokens_total{operation="answer"} 240' in text
@@ -0,0 +1,342 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from src.rag.config import RagConfig
+from src.rag.metrics import PrometheusSink
+from src.rag.pipeline import RagPipeline
+
+
+class HashEmbedder:
+    """Deterministic bag-of-words embedder so pipeline tests need no model download."""
+
+    cache = None
+    dim = 256
+
+    def __init__(self):
+        self.encoded = 0
+
+    def load(self):
+        return self
+
+    def encode(self, texts):
+        texts = list(texts)
+        self.encoded += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            for w in t.lower().split():
+                out[i, int(hashlib.md5(w.encode()).hexdigest(), 16) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+def make_pipeline(tmp_path, **cfg):
+    pipe = RagPipeline(RagConfig(index_dir=str(tmp_path / "idx"), **cfg))
+    pipe.embedder = HashEmbedder()
+    return pipe
+
+
+def write_docs(docs_dir, docs):
+    docs_dir.mkdir(exist_ok=True)
+    for name, text in docs.items():
+        (docs_dir / name).write_text(text, encoding="utf-8")
+    return str(docs_dir)
+
+
+def test_construction_is_lazy_and_retrieval_only_blocks_generation(tmp_path):
+    pipe = RagPipeline(RagConfig(index_dir=str(tmp_path), retrieval_only=True))
+    report = pipe.startup_report()
+    assert not report["embedder_loaded"] and not report["generator_loaded"]
+    assert not pipe.embedder.loaded
+    with pytest.raises(RuntimeError, match="retrieval-only"):
+        pipe.generator
+
+
+def test_incremental_build_only_embeds_changed_files(tmp_path):
+    docs = write_docs(tmp_path / "docs", {
+        "a.txt": "alpha apples and apricots",
+        "b.txt": "bravo bananas and blueberries",
+        "c.txt": "charlie cherries and coconuts",
+    })
+    pipe = make_pipeline(tmp_path)
+    report = pipe.build_index(docs, incremental=True)
+    assert sorted(report["added"]) == ["a.txt", "b.txt", "c.txt"]
+
+    (tmp_path / "docs" / "b.txt").write_text("bravo broccoli and beans, now longer", encoding="utf-8")
+    (tmp_path / "docs" / "c.txt").unlink()
+    (tmp_path / "docs" / "d.txt").write_text("delta dates", encoding="utf-8")
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)
+    assert report["skipped"] == ["a.txt"]
+    assert report["changed"] == ["b.txt"] and report["added"] == ["d.txt"] and report["deleted"] == ["c.txt"]
+    assert pipe.embedder.encoded == 2
+
+    pipe.load_index()
+    assert sorted(pipe.index.chunks.doc_ids()) == ["a.txt", "b.txt", "d.txt"]
+    assert pipe.retrieve("bravo broccoli now longer", top_k=1)[0]["doc_id"] == "b.txt"
+
+
+def test_incremental_build_starts_over_when_chunking_or_model_changed(tmp_path):
+    docs = write_docs(tmp_path / "docs", {"a.txt": " ".join(f"a{i}" for i in range(40)), "b.txt": " ".join(f"b{i}" for i in range(40))})
+    pipe = make_pipeline(tmp_path, chunk_size_words=20, chunk_overlap_words=0)
+    pipe.build_index(docs, incremental=True)
+    assert pipe.index.document_counts() == {"a.txt": 2, "b.txt": 2}
+
+    (tmp_path / "docs" / "b.txt").write_text(" ".join(f"c{i}" for i in range(40)), encoding="utf-8")
+    pipe.cfg.chunk_size_words = 10
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)
+    assert report["settings_changed"] == ["chunk_size_words"]
+    assert sorted(report["added"]) == ["a.txt", "b.txt"] and not report["skipped"]
+    assert pipe.embedder.encoded == 8
+    pipe.load_index()
+    assert pipe.index.document_counts() == {"a.txt": 4, "b.txt": 4}
+
+    pipe.cfg.embed_model_name = "another-model"
+    report = pipe.build_index(docs, incremental=True)
+    assert report["settings_changed"] == ["embed_model_name"]
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)  # recorded now: nothing to redo
+    assert sorted(report["skipped"]) == ["a.txt", "b.txt"] and pipe.embedder.encoded == 0
+
+
+def test_streaming_build_matches_regular_build(tmp_path):
+    docs = write_docs(tmp_path / "docs", {f"{i}.txt": f"doc{i} " + "word " * 50 for i in range(6)})
+    regular = make_pipeline(tmp_path / "r", chunk_size_words=20, chunk_overlap_words=5)
+    regular.build_index(docs)
+    streamed = make_pipeline(tmp_path / "s", chunk_size_words=20, chunk_overlap_words=5, build_batch_size=7)
+    seen = []
+    report = streamed.build_index(docs, streaming=True, progress=seen.append)
+    assert report["total_chunks"] == len(regular.index.chunks)
+    assert seen[-1]["chunks"] == report["total_chunks"] and len(seen) > 1
+
+    regular.load_index()
+    streamed.load_index()
+    assert list(streamed.index.chunks) == list(regular.index.chunks)
+    np.testing.assert_allclose(streamed.index.vectors(), regular.index.vectors())
+    np.testing.assert_array_equal(streamed.index.bm25.docs, regular.index.bm25.docs)
+
+
+def test_hybrid_and_lexical_retrieval_find_exact_identifiers(tmp_path):
+    docs = write_docs(tmp_path / "docs", {
+        "a.txt": "pump maintenance schedule for the north plant",
+        "b.txt": "pump fault ERR-4711 means the pressure sensor failed",
+        "c.txt": "pump pump pump overview of pump models and pump sizes",
+    })
+    pipe = make_pipeline(tmp_path)
+    pipe.build_index(docs)
+    pipe.load_index()
+    assert pipe.index.bm25 is not None
+    assert pipe.retrieve("what does ERR-4711 mean", top_k=1, mode="lexical")[0]["doc_id"] == "b.txt"
+    hybrid = pipe.retrieve_many(["what does ERR-4711 mean", "pump sizes"], top_k=2, mode="hybrid")
+    assert hybrid[0][0]["doc_id"] == "b.txt"
+    assert [len(h) for h in hybrid] == [2, 2]
+
+
+def test_hybrid_falls_back_to_dense_without_bm25(tmp_path):
+    docs = write_docs(tmp_path / "docs", {"a.txt": "alpha apples", "b.txt": "bravo bananas"})
+    pipe = make_pipeline(tmp_path, lexical_index=False, retrieval_mode="hybrid")
+    pipe.build_index(docs)
+    pipe.load_index()
+    assert pipe.index.bm25 is None
+    assert pipe.retrieve("bravo bananas", top_k=1)[0]["doc_id"] == "b.txt"
+
+
+@pytest.mark.parametrize("mode", ["dense", "lexical", "hybrid"])
+def test_filters_restrict_every_retrieval_mode(tmp_path, mode):
+    docs_dir = tmp_path / "docs"
+    write_docs(docs_dir, {"a.txt": "pump maintenance schedule", "b.txt": "pump fault codes"})
+    write_docs(docs_dir / "hr", {"c.txt": "pump maintenance leave policy"})
+    pipe = make_pipeline(tmp_path)
+    pipe.build_index(str(docs_dir))
+    pipe.load_index()
+    hits = pipe.retrieve("pump maintenance schedule", top_k=3, mode=mode, filters={"doc_id": ["b.txt", "hr/c.txt"]})
+    assert {h["doc_id"] for h in hits} == {"b.txt", "hr/c.txt"}
+    prefix = str(docs_dir / "hr")
+    assert [h["doc_id"] for h in pipe.retrieve("pump", top_k=3, mode=mode, filters={"source_path_prefix": prefix})] == ["hr/c.txt"]
+
+
+def test_in_place_document_changes_keep_manifest_usable(tmp_path):
+    docs_dir = tmp_path / "docs"
+    docs = write_docs(docs_dir, {
+        "a.txt": "alpha apples and apricots",
+        "b.txt": "bravo bananas and blueberries",
+        "c.txt": "charlie cherries and coconuts",
+    })
+    pipe = make_pipeline(tmp_path, compact_threshold=0.5)
+    pipe.build_index(docs)
+    pipe.load_index()
+
+    write_docs(docs_dir, {"d.txt": "delta dates and durians", "b.txt": "bravo broccoli and beans"})
+    pipe.embedder = HashEmbedder()
+    report = pipe.add_documents([str(docs_dir / "d.txt")], docs)
+    assert report["added"] == ["d.txt"] and pipe.embedder.encoded == 1
+    report = pipe.update_document(str(docs_dir / "b.txt"), docs)
+    assert report["changed"] == ["b.txt"]
+    assert pipe.delete_document("c.txt") == 1
+    with pytest.raises(KeyError):
+        pipe.update_document(str(docs_dir / "c.txt"), docs)
+    (docs_dir / "c.txt").unlink()
+    pipe.index.wait_for_compaction()  # 2 of 5 rows deleted: below the threshold
+    assert pipe.index.tombstone_ratio() == pytest.approx(0.4)
+
+    assert pipe.retrieve("delta dates", top_k=1)[0]["doc_id"] == "d.txt"
+    assert pipe.retrieve("bravo broccoli", top_k=1)[0]["doc_id"] == "b.txt"
+    assert "c.txt" not in {h["doc_id"] for h in pipe.retrieve("charlie cherries", top_k=5)}
+
+    pipe.compact_index()
+    # The manifest follows compaction, so an incremental build reuses every vector.
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)
+    assert sorted(report["skipped"]) == ["a.txt", "b.txt", "d.txt"] and pipe.embedder.encoded == 0
+    pipe.load_index()
+    assert pipe.retrieve("bravo broccoli", top_k=1)[0]["doc_id"] == "b.txt"
+
+
+def test_uploads_are_indexed_from_memory_and_only_new_content_is_embedded(tmp_path):
+    pipe = make_pipeline(tmp_path)
+    events = []
+    report = pipe.add_uploads(
+        [("a.txt", b"alpha apples and apricots"), ("b.txt", b"bravo bananas and blueberries"), ("e.txt", b"  ")],
+        progress=events.append,
+    )
+    assert report["added"] == ["a.txt", "b.txt"] and report["total_chunks"] == 2
+    assert [(e["file"], e["stage"]) for e in events] == [
+        ("a.txt", "parsed"), ("b.txt", "parsed"), ("e.txt", "empty"), ("a.txt", "embedded"), ("b.txt", "embedded"),
+    ]
+    assert not (tmp_path / "idx" / "uploads").exists()
+
+    pipe.embedder = HashEmbedder()
+    report = pipe.add_uploads([
+        ("a.txt", b"alpha apples and apricots"),
+        ("b.txt", b"bravo broccoli and beans"),
+        ("c.txt", b"charlie cherries and coconuts"),
+    ])
+    assert report["skipped"] == ["a.txt"] and report["changed"] == ["b.txt"] and report["added"] == ["c.txt"]
+    assert pipe.embedder.encoded == 2
+    assert pipe.index.document_counts() == {"a.txt": 1, "b.txt": 1, "c.txt": 1}
+
+    pipe.index.wait_for_compaction()  # the replaced b.txt row tips it over the threshold
+    fresh = make_pipeline(tmp_path)
+    fresh.load_index()
+    assert fresh.retrieve("bravo broccoli", top_k=1)[0]["doc_id"] == "b.txt"
+    assert fresh.retrieve("charlie cherries", top_k=1)[0]["source_path"] is None
+
+
+def test_dedup_collapses_copies_and_keeps_their_sources(tmp_path):
+    words = [f"w{i}" for i in range(200)]
+    boilerplate = "this document is confidential and may not be shared outside the company " * 2
+    docs_dir = tmp_path / "docs"
+    # Root files are walked before subdirectories, so a.txt is seen first and keeps the shared chunks.
+    docs = write_docs(docs_dir, {"a.txt": " ".join(words[:100]) + " " + boilerplate})
+    write_docs(docs_dir / "copies", {"b.txt": " ".join(words[:100]).replace("w60", "v60") + " " + boilerplate})
+    write_docs(docs_dir / "other", {"c.txt": " ".join(words[100:]) + " " + boilerplate})
+    b, c = os.path.join("copies", "b.txt"), os.path.join("other", "c.txt")
+    reports = []
+    for streaming in (False, True):
+        pipe = make_pipeline(tmp_path, dedup_chunks=True, chunk_size_words=25, chunk_overlap_words=0)
+        reports.append(pipe.build_index(docs, streaming=streaming))
+        pipe.load_index()
+        assert pipe.index.document_counts() == {"a.txt": 5, b: 1, c: 4}  # b.txt keeps only its edited chunk
+        hit = pipe.retrieve("confidential company shared", top_k=1)[0]
+        assert hit["doc_id"] == "a.txt" and {r["doc_id"] for r in hit["duplicates"]} == {b, c}
+    assert reports[0]["dedup"] == reports[1]["dedup"] == {"chunks": 15, "collapsed": 5}
+    assert reports[0]["embedded_chunks"] == reports[1]["embedded_chunks"] == 10
+
+    # a.txt holds chunks of b.txt and c.txt: changing it re-processes both.
+    (docs_dir / "a.txt").write_text("something else entirely", encoding="utf-8")
+    report = pipe.build_index(docs, incremental=True)
+    assert report["changed"] == ["a.txt"] and sorted(report["reprocessed"]) == [b, c]
+    pipe.load_index()
+    counts = pipe.index.document_counts()
+    assert counts["a.txt"] == 1 and counts[b] + counts[c] == 9
+    hit = pipe.retrieve("confidential company shared", top_k=1)[0]
+    other = c if hit["doc_id"] == b else b
+    assert [r["doc_id"] for r in hit["duplicates"]] == [other]
+
+    # Deleting the holder in place re-adds the other file, whose boilerplate lived in its rows.
+    pipe.delete_document(hit["doc_id"])
+    pipe.index.wait_for_compaction()
+    assert pipe.index.document_counts() == {"a.txt": 1, other: 5}
+
+
+def test_touched_duplicate_is_reprocessed_when_its_holder_changes(tmp_path):
+    text = " ".join(f"w{i}" for i in range(50))
+    docs_dir = tmp_path / "docs"
+    docs = write_docs(docs_dir, {"a.txt": text, "b.txt": text})
+    pipe = make_pipeline(tmp_path, dedup_chunks=True, chunk_size_words=25, chunk_overlap_words=0)
+    pipe.build_index(docs, incremental=True)
+    (holder,) = pipe.index.document_counts()
+    copy = "b.txt" if holder == "a.txt" else "a.txt"
+
+    # Same content, new mtime: the copy must still remember which file holds its chunks.
+    st = os.stat(docs_dir / copy)
+    os.utime(docs_dir / copy, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert sorted(pipe.build_index(docs, incremental=True)["skipped"]) == ["a.txt", "b.txt"]
+
+    (docs_dir / holder).write_text("something else entirely", encoding="utf-8")
+    report = pipe.build_index(docs, incremental=True)
+    assert report["reprocessed"] == [copy]
+    pipe.load_index()
+    assert pipe.index.document_counts() == {holder: 1, copy: 2}
+
+
+def test_incremental_build_re_embeds_pq_index_without_exact_vectors(tmp_path):
+    docs = write_docs(tmp_path / "docs", {f"{i}.txt": f"doc{i} " + " ".join(f"w{i}x{j}" for j in range(40)) for i in range(4)})
+    pipe = make_pipeline(tmp_path, index_type="ivf_pq", index_pq_m=8, index_pq_nbits=2, index_nlist=2, chunk_size_words=10, chunk_overlap_words=0)
+    pipe.build_index(docs, incremental=True)
+    assert pipe.index.index_type == "ivf_pq" and pipe.index.has_exact_vectors()
+
+    # An index saved before PQ types kept vectors.f32 can only reconstruct approximations.
+    os.remove(pipe.index.vectors_path)
+    (tmp_path / "docs" / "0.txt").write_text("doc0 changed", encoding="utf-8")
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)
+    assert report["changed"] == ["0.txt"] and sorted(report["reprocessed"]) == ["1.txt", "2.txt", "3.txt"]
+    assert pipe.embedder.encoded == 1 + 3 * 5
+    assert pipe.index.has_exact_vectors()
+
+    pipe.embedder = HashEmbedder()
+    report = pipe.build_index(docs, incremental=True)  # nothing changed: no re-embedding
+    assert pipe.embedder.encoded == 0 and "reprocessed" not in report
+
+
+class EchoGenerator:
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def generate(self, prompt):
+        return "answer"
+
+    def stream(self, prompt):
+        yield from ["ans", "wer"]
+
+
+def test_profile_adds_stage_timings_and_feeds_the_metrics_sink(tmp_path):
+    docs = write_docs(tmp_path / "docs", {"a.txt": "alpha apples", "b.txt": "bravo bananas"})
+    pipe = make_pipeline(tmp_path)
+    pipe.build_index(docs)
+    pipe.load_index()
+    pipe.generator = EchoGenerator()
+    assert "timings" not in pipe.answer("alpha apples", top_k=1)
+
+    pipe.cfg.profile = True
+    timings = pipe.answer("alpha apples", top_k=1)["timings"]
+    assert {"embed", "search", "context", "tokenize", "generate"} <= set(timings["stages_ms"])
+    assert timings["counts"]["queries"] == 1
+    done = list(pipe.answer_stream("bravo", top_k=1))[-1]
+    assert {"embed", "prefill", "generate"} <= set(done["timings"]["stages_ms"])
+
+    pipe.cfg.profile = False
+    pipe.metrics = PrometheusSink()
+    out = pipe.answer("alpha apples", top_k=1)
+    pipe.retrieve_many(["bravo"], top_k=1, mode="hybrid")
+    assert "timings" not in out
+    text = pipe.metrics.render()
+    assert 'rag_stage_duration_seconds_count{operation="answer",stage="search"} 1' in text
+    assert 'operation="retrieve",stage="fuse"' in text
+    # Nested retrieve calls report under the outer operation only.
+    assert 'rag_queries_total{operation="answer"} 1' in text and 'rag_queries_total{operation="retrieve"} 1' in text
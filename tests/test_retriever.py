@@ -0,0 +1,37 @@
+from src.rag.chunk import chunk_documents
+from src.rag.retriever import format_context, pack_context
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def _passages(text, size=10, overlap=4, doc_id="a.txt"):
+    return chunk_documents([{"id": doc_id, "text": text}], size, overlap)
+
+
+def test_format_context_tags_passages():
+    assert format_context([{"doc_id": "a", "chunk_id": 2, "text": "hello"}]) == "- [a#2] hello"
+
+
+def test_pack_context_strips_window_overlap_and_drops_duplicates():
+    text = " ".join(f"w{i}" for i in range(16))
+    chunks = _passages(text)  # w0-w9, w6-w15
+    duplicate = dict(chunks[0], chunk_id=9)
+    context, used, stats = pack_context([chunks[1], chunks[0], duplicate], count_words, budget=1000)
+    assert [p["chunk_id"] for p in used] == [1, 0]
+    assert stats["duplicates"] == 1
+    # Each word appears once even though the two windows share w6-w9.
+    words = [w for w in context.split() if w.startswith("w")]
+    assert sorted(words, key=lambda w: int(w[1:])) == [f"w{i}" for i in range(16)]
+
+
+def test_pack_context_trims_then_skips_when_budget_runs_out():
+    passages = [
+        {"doc_id": d, "chunk_id": 0, "text": " ".join(f"{d}{i}" for i in range(20))}
+        for d in ("a", "b", "c")
+    ]
+    context, used, stats = pack_context(passages, count_words, budget=35, min_passage_tokens=5)
+    assert [p["doc_id"] for p in used] == ["a", "b"]
+    assert stats["trimmed"] == 1 and stats["skipped"] == 1
+    assert stats["tokens"] <= 35 and stats["tokens"] == count_words(context)
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient
+
+from src.rag.config import RagConfig
+from src.rag.generator import build_prompt
+from src.rag.retriever import pack_context
+from src.rag.server import ServerConfig, create_app
+
+
+class _Index:
+    index = object()
+    chunks = [{"doc_id": "a.txt", "chunk_id": 0, "text": "alpha", "source_path": None}]
+
+
+class _Generator:
+    def __init__(self):
+        self.batches = []
+
+    def generate_many(self, prompts):
+        self.batches.append(len(prompts))
+        return [f"answer {i}" for i in range(len(prompts))]
+
+
+class _Pipeline:
+    def __init__(self):
+        self.cfg = RagConfig(top_k=3)
+        self.embedder = object()
+        self.index = _Index()
+        self.generator = _Generator()
+        self.retrieve_calls = []
+
+    def load_index(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    def startup_report(self):
+        return {"embedder_loaded": True, "generator_loaded": True, "index_loaded": True, "timings_s": {}}
+
+    def retrieve_many(self, questions, top_k=None, filters=None):
+        self.retrieve_calls.append((len(questions), top_k, filters))
+        return [[{"doc_id": q, "chunk_id": i, "filters": filters, "text": f"{q} text {i}", "score": 1.0 - i / 10} for i in range(top_k)] for q in questions]
+
+    def prepare_prompt(self, question, passages):
+        context, used, stats = pack_context(passages, lambda t: len(t.split()), 1000)
+        return build_prompt(question, context), used, stats
+
+
+def _app(pipe, **cfg):
+    return create_app(lambda: pipe, ServerConfig(**cfg))
+
+
+def test_health_retrieve_and_answer():
+    app = _app(_Pipeline())
+    with TestClient(app) as client:
+        app.state.service.ready.wait(5)
+        health = client.get("/health").json()
+        assert health["status"] == "ok" and health["index_loaded"] and health["chunks"] == 1
+
+        res = client.post("/retrieve", json={"question": "q1", "top_k": 2}).json()
+        assert [p["chunk_id"] for p in res["passages"]] == [0, 1]
+
+        res = client.post("/answer", json={"question": "q2"}).json()
+        assert res["answer"] == "answer 0"
+        assert len(res["passages"]) == 3
+        assert res["context"]["used"] == 3 and res["context"]["tokens"] > 0
+
+
+def test_concurrent_requests_are_micro_batched():
+    pipe = _Pipeline()
+    app = _app(pipe, max_wait_ms=200, max_batch_size=8)
+    results = [None] * 8
+    with TestClient(app) as client:
+        app.state.service.ready.wait(5)
+
+        def call(i):
+            results[i] = client.post("/retrieve", json={"question": f"q{i}", "top_k": 1 + i % 3}).json()
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert all(len(r["passages"]) == 1 + i % 3 for i, r in enumerate(results))
+    assert len(pipe.retrieve_calls) < 8
+
+
+def test_not_ready_returns_503():
+    def failing():
+        raise FileNotFoundError("Index files not found. Build first.")
+
+    app = create_app(failing)
+    with TestClient(app) as client:
+        app.state.service.ready.wait(0.2)
+        assert client.post("/retrieve", json={"question": "q"}).status_code == 503
+        assert client.get("/health").json()["status"] == "error"
+
+
+def test_batched_requests_are_grouped_by_filters():
+    pipe = _Pipeline()
+    app = _app(pipe, max_wait_ms=200, max_batch_size=8)
+    results = [None] * 6
+    with TestClient(app) as client:
+        app.state.service.ready.wait(5)
+
+        def call(i):
+            filters = {"doc_id": ["a.txt"]} if i % 2 else None
+            results[i] = client.post("/retrieve", json={"question": f"q{i}", "top_k": 2, "filters": filters}).json()
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    for i, r in enumerate(results):
+        assert all(p["filters"] == ({"doc_id": ["a.txt"]} if i % 2 else None) for p in r["passages"])
+
+
+class _PickyPipeline(_Pipeline):
+    def retrieve_many(self, questions, top_k=None, filters=None):
+        if filters and "broken" in filters:
+            raise RuntimeError("search failed")
+        return super().retrieve_many(questions, top_k, filters)
+
+
+def test_bad_filters_get_400_and_failures_stay_in_their_group():
+    app = _app(_PickyPipeline(), max_wait_ms=200, max_batch_size=8)
+    with TestClient(app, raise_server_exceptions=False) as client:
+        app.state.service.ready.wait(5)
+        for filters in ({"doc_id": [["a.txt"]]}, {"source_path_prefix": 3}, {"page": {"gt": 1}}, ["a.txt"]):
+            assert client.post("/retrieve", json={"question": "q", "filters": filters}).status_code == 400
+        assert client.post("/retrieve", json={"top_k": 2}).status_code == 422
+        for top_k in (0, -1, 10**9):
+            assert client.post("/retrieve", json={"question": "q", "top_k": top_k}).status_code == 422
+
+        statuses = {}
+
+        def call(name, filters):
+            statuses[name] = client.post("/retrieve", json={"question": name, "filters": filters}).status_code
+
+        threads = [threading.Thread(target=call, args=a) for a in (("good", {"doc_id": "a.txt"}), ("bad", {"broken": 1}))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert statuses == {"good": 200, "bad": 500}
+
+
+def test_prompt_is_prepared_off_the_event_loop():
+    pipe = _Pipeline()
+    prepare = pipe.prepare_prompt
+    on_loop = []
+
+    def prepare_prompt(question, passages):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return prepare(question, passages)
+
+    pipe.prepare_prompt = prepare_prompt
+    app = _app(pipe)
+    with TestClient(app) as client:
+        app.state.service.ready.wait(5)
+        assert client.post("/answer", json={"question": "q"}).status_code == 200
+    assert on_loop == [False]
+
+
+def test_metrics_endpoint_exposes_stage_latencies():
+    pipe = _Pipeline()
+    app = _app(pipe)
+    with TestClient(app) as client:
+        app.state.service.ready.wait(5)
+        assert pipe.metrics is app.state.service.metrics
+        client.post("/answer", json={"question": "q"})
+        res = client.get("/metrics")
+    assert res.status_code == 200 and res.headers["content-type"].startswith("text/plain")
+    assert 'rag_stage_duration_seconds_count{operation="generate",stage="generate"} 1' in res.text
+    assert 'operation="prepare_prompt"' in res.text
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.rag.index_faiss import FaissIndex
+from src.rag.sharded import ShardedIndex
+
+
+def _unit(n, dim=8, seed=0):
+    v = np.random.default_rng(seed).random((n, dim), dtype=np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _make(index_dir):
+    return FaissIndex(index_dir, "faiss.index", "metadata.json")
+
+
+def _build_shard(root, name, vecs, start):
+    shard_dir = str(root / "shards" / name)
+    idx = _make(shard_dir)
+    idx.build(vecs, [{"doc_id": f"d{start + i}", "chunk_id": 0, "text": f"word{start + i} shared", "source_path": None} for i in range(len(vecs))])
+    idx.save()
+    return shard_dir
+
+
+def test_fan_out_merges_global_top_k(tmp_path):
+    vecs = _unit(30)
+    sharded = ShardedIndex(str(tmp_path), _make)
+    for i, s in enumerate(range(0, 30, 10)):
+        sharded.add_shard(f"s{i}", _build_shard(tmp_path, f"s{i}", vecs[s:s + 10], s))
+    assert ShardedIndex.is_sharded(str(tmp_path))
+    sharded.load()
+    assert len(sharded.chunks) == 30 and sharded.chunks[25]["doc_id"] == "d25"
+    assert sharded.document_counts() == {f"d{i}": 1 for i in range(30)}
+
+    queries = _unit(4, seed=1)
+    expected = np.argsort(-(queries @ vecs.T), axis=1)[:, :5]
+    results = sharded.search_many(queries, top_k=5)
+    assert [[h["doc_id"] for h in hits] for hits in results] == [[f"d{j}" for j in row] for row in expected]
+    assert {h["shard"] for hits in results for h in hits} <= {"s0", "s1", "s2"}
+    assert sharded.search_lexical("word12", top_k=3)[0]["doc_id"] == "d12"
+    filtered = sharded.search(queries[0], top_k=5, filters={"doc_id": ["d3", "d17", "d29"]})
+    assert sorted(h["doc_id"] for h in filtered) == ["d17", "d29", "d3"]
+    sharded.close()
+
+
+def test_add_and_remove_shards_touch_only_the_manifest(tmp_path):
+    vecs = _unit(20)
+    sharded = ShardedIndex(str(tmp_path), _make)
+    a = _build_shard(tmp_path, "a", vecs[:10], 0)
+    sharded.add_shard("a", a)
+    sharded.add_shard("b", _build_shard(tmp_path, "b", vecs[10:], 10))
+    a_index = _make(a).faiss_index_path  # inside the shard's published snapshot
+    mtime = os.stat(a_index).st_mtime_ns
+
+    sharded.remove_shard("b", delete_files=True)
+    assert [e["name"] for e in sharded.entries()] == ["a"]
+    assert not (tmp_path / "shards" / "b").exists()
+    assert os.stat(a_index).st_mtime_ns == mtime
+    sharded.load()
+    assert len(sharded.chunks) == 10
+    with pytest.raises(KeyError):
+        sharded.remove_shard("b")
+    sharded.close()
+
+
+def test_mismatched_dimensions_are_rejected(tmp_path):
+    sharded = ShardedIndex(str(tmp_path), _make)
+    sharded.add_shard("a", _build_shard(tmp_path, "a", _unit(4, dim=8), 0))
+    sharded.add_shard("b", _build_shard(tmp_path, "b", _unit(4, dim=16), 4))
+    with pytest.raises(ValueError, match="dimensions"):
+        sharded.load()
@@ -0,0 +1,76 @@
+import threading
+
+import numpy as np
+import pytest
+
+from src.rag.config import RagConfig
+from src.rag.index_faiss import FaissIndex
+from src.rag.shared_index import SharedIndex, index_version
+
+
+def _build(index_dir, n_docs, chunks_per_doc=2):
+    vecs = np.random.default_rng(0).random((n_docs * chunks_per_doc, 8), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    chunks = [
+        {"doc_id": f"d{d}.txt", "chunk_id": c, "text": f"doc {d} part {c}", "source_path": None}
+        for d in range(n_docs) for c in range(chunks_per_doc)
+    ]
+    idx = FaissIndex(index_dir, "faiss.index", "metadata.json")
+    idx.build(vecs, chunks)
+    idx.save()
+    return idx
+
+
+def test_index_is_loaded_once_and_reloaded_when_files_change(tmp_path):
+    index_dir = str(tmp_path / "idx")
+    shared = SharedIndex(RagConfig(index_dir=index_dir), check_interval_s=0)
+    with pytest.raises(FileNotFoundError):
+        shared.get()
+    assert index_version(RagConfig(index_dir=index_dir)) == ()
+
+    _build(index_dir, 3)
+    index, summary = shared.get()
+    assert summary == {"documents": {"d0.txt": 2, "d1.txt": 2, "d2.txt": 2}, "chunks": 6}
+    assert shared.get()[0] is index and shared.loads == 1
+
+    # An in-place delete rewrites the tombstones: the next get() sees a new
+    # version, swaps in a fresh object and drops the deleted document.
+    writer = FaissIndex(index_dir, "faiss.index", "metadata.json", compact_threshold=0)
+    writer.load()
+    writer.delete_document("d1.txt")
+    reloaded, summary = shared.get()
+    assert reloaded is not index and shared.loads == 2
+    assert summary == {"documents": {"d0.txt": 2, "d2.txt": 2}, "chunks": 4}
+    assert index.document_counts()["d1.txt"] == 2  # the old object is left untouched
+
+    _build(index_dir, 5)
+    assert shared.get()[1]["chunks"] == 10
+
+
+def test_checks_are_throttled_and_shared_between_threads(tmp_path):
+    index_dir = str(tmp_path / "idx")
+    _build(index_dir, 2)
+    shared = SharedIndex(RagConfig(index_dir=index_dir), check_interval_s=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(shared.get()[0])) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(r) for r in results}) == 1 and shared.loads == 1
+
+    _build(index_dir, 4)
+    assert shared.get()[1]["chunks"] == 4  # still within the check interval
+    shared.invalidate()
+    assert shared.get()[1]["chunks"] == 8
+
+
+def test_in_place_writes_to_the_shared_object_are_adopted_without_reload(tmp_path):
+    index_dir = str(tmp_path / "idx")
+    _build(index_dir, 2)
+    shared = SharedIndex(RagConfig(index_dir=index_dir), check_interval_s=0)
+    index, _ = shared.get()
+    index.delete_document("d0.txt")
+    shared.written(index)
+    assert shared.get() == (index, {"documents": {"d1.txt": 2}, "chunks": 2})
+    assert shared.loads == 1
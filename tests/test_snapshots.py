@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from src.rag import snapshots
+
+
+def _write(index_dir, text):
+    path = snapshots.create(index_dir)
+    with open(os.path.join(path, "data.txt"), "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def _read(index_dir):
+    with open(os.path.join(snapshots.resolve(index_dir), "data.txt"), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_publish_switches_readers_and_gc_keeps_recent_and_unfinished(tmp_path):
+    index_dir = str(tmp_path)
+    assert snapshots.resolve(index_dir) == index_dir  # nothing published: legacy layout
+    paths = [_write(index_dir, f"build {i}") for i in range(4)]
+    assert snapshots.current(index_dir) is None
+    for p in paths:
+        snapshots.publish(index_dir, p)
+    assert _read(index_dir) == "build 3"
+
+    pending = _write(index_dir, "in progress")
+    assert snapshots.collect_garbage(index_dir, keep=2) == ["v000002", "v000001"]
+    listed = {s["name"]: s for s in snapshots.list_snapshots(index_dir)}
+    assert sorted(listed) == ["v000003", "v000004", "v000005"]
+    assert listed["v000004"]["current"] and not listed["v000005"]["finished"]
+
+    snapshots.switch(index_dir, "v000003")  # roll back
+    assert _read(index_dir) == "build 2"
+    with pytest.raises(ValueError):
+        snapshots.switch(index_dir, os.path.basename(pending))
+    with pytest.raises(KeyError):
+        snapshots.switch(index_dir, "v000001")
+
+    assert snapshots.unpublish(index_dir) == "v000003"
+    assert snapshots.resolve(index_dir) == index_dir
+    assert snapshots.collect_garbage(index_dir, keep=1, unfinished=True) == ["v000005", "v000003"]
+
+
+def test_fork_shares_files_and_copies_heads_of_appended_files(tmp_path):
+    index_dir = str(tmp_path)
+    first = _write(index_dir, "rows")
+    with open(os.path.join(first, "other.txt"), "w", encoding="utf-8") as f:
+        f.write("info")
+    snapshots.publish(index_dir, first)
+
+    second = snapshots.create(index_dir)
+    snapshots.fork(first, second, heads={"data.txt": 4})
+    with open(os.path.join(second, "data.txt"), "a", encoding="utf-8") as f:
+        f.write(" appended")
+    assert _read(index_dir) == "rows"  # the published snapshot's copy is untouched
+    assert os.path.samefile(os.path.join(first, "other.txt"), os.path.join(second, "other.txt"))
+
+    third = snapshots.create(index_dir)
+    snapshots.fork(second, third, heads={"data.txt": 4})
+    with open(os.path.join(third, "data.txt"), "r", encoding="utf-8") as f:
+        assert f.read() == "rows"
+
+    snapshots.discard(index_dir, third)
+    snapshots.publish(index_dir, second)
+    snapshots.collect_garbage(index_dir, keep=0)
+    assert [s["name"] for s in snapshots.list_snapshots(index_dir)] == ["v000001", "v000002"]